@@ -1,24 +1,240 @@
 from io import StringIO
+import csv
 import pandas as pd
 from bs4 import BeautifulSoup as bs
 import string
 import os
 import sys
-import subprocess
+import traceback
 import json
 import time
+import argparse
+import shutil
+import threading
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from amazon_utils import AmazonRequest
+from amazon_utils import AmazonRequest, http_metrics
+from Procesar_StowMap import (corregir_csv, procesar_stowmap, procesamiento_pendiente, VERSION_CORRECCIONES,
+                              FILAS_POR_BLOQUE)
+from Generar_Heatmaps import generar_heatmaps
+from stowmap_snapshot import leer_stowmap, guardar_snapshot
+from esquema_stowmap import aplicar_esquema, leer_csv
+from progreso import write_progress, escribir_json_atomico
+from stowmap_manifest import (cargar_manifest, guardar_manifest, hash_archivo, hash_dataframe,
+                              firma_csv, manifest_valido)
 
+# ============================================
+# CONFIGURACIÓN: DESCARGA CONCURRENTE
+# ============================================
+# True: descarga todos los pisos y los reportes del DPS Portal a la vez (pool de hilos acotado)
+# False: descarga secuencial, una tarea detrás de otra
+DESCARGA_CONCURRENTE = True
+# Número máximo de peticiones simultáneas contra StowMap / DPS Portal
+MAX_DESCARGAS_SIMULTANEAS = 4
 
-def _download_dps_portal_data(fc: str, endpoint: str, data_type: str):
+# ============================================
+# CONFIGURACIÓN: MODO MULTI-FC (BATCH)
+# ============================================
+# FC por defecto: sus datos van directamente a data/space-heatmap (la carpeta que lee la app).
+# Con --fc VLC1 MAD4 ... cada FC usa su propia carpeta y su archivo de reglas fullness_<fc>.json
+FC_POR_DEFECTO = 'VLC1'
+# Número máximo de FCs que se procesan a la vez en modo batch
+MAX_FC_SIMULTANEOS = 2
+# Límite global de peticiones simultáneas sumando todos los FCs (cada FC además respeta MAX_DESCARGAS_SIMULTANEAS).
+# Se ocupa un hueco por intento de descarga: las esperas entre reintentos no lo retienen.
+MAX_DESCARGAS_GLOBALES = 6
+_descargas_semaforo = threading.BoundedSemaphore(MAX_DESCARGAS_GLOBALES)
+
+
+def _con_hueco_de_descarga(func):
+    """
+    Decorador para las funciones que hacen un intento de descarga (una petición y su reautenticación):
+    ocupan un hueco de MAX_DESCARGAS_GLOBALES solo mientras dura el intento.
+    """
+    @wraps(func)
+    def envoltorio(*args, **kwargs):
+        with _descargas_semaforo:
+            return func(*args, **kwargs)
+    return envoltorio
+
+# ============================================
+# CONFIGURACIÓN: CACHÉ DE METADATOS DE STOWMAP
+# ============================================
+# Los bin types / usages de loadFCAreaMap.htm casi nunca cambian: se guardan en memoria
+# (una vez por proceso) y en disco (stowmap_metadata_<fc>.json) durante METADATA_CACHE_TTL segundos
+METADATA_CACHE_TTL = 12 * 3600
+METADATA_CACHE_FILE = "stowmap_metadata_{fc}.json"
+
+_metadata_memo = {}
+# Un lock por FC: las descargas de metadatos de FCs distintos no se esperan entre sí
+_metadata_locks = {}
+_metadata_lock = threading.Lock()
+
+# ============================================
+# CONFIGURACIÓN: DESCARGA EN STREAMING
+# ============================================
+# True: cada respuesta se escribe a disco por bloques mientras llega (memoria constante)
+# False: cada respuesta se carga como DataFrame y se combinan en memoria con pd.concat
+DESCARGA_STREAMING = True
+# Número de filas que se procesan (eliminación de columnas) y escriben por bloque
+STREAMING_CHUNK_ROWS = 50000
+
+# ============================================
+# CONFIGURACIÓN: DESCARGA POR FRAGMENTOS (MODS / PASILLOS)
+# ============================================
+# True: cada piso se pide por mods en paralelo (uno por mod de los metadatos) y se une al final.
+# Si un mod sigue fallando tras los reintentos se pide pasillo a pasillo (pasillos de la
+# descarga anterior), de modo que un fallo solo pierde una parte del piso y no el piso entero.
+# False (o metadatos sin lista de mods): una petición por piso completo
+DESCARGA_POR_MODS = True
+# Reintentos de cada fragmento y espera inicial entre ellos (se duplica en cada reintento)
+REINTENTOS_FRAGMENTO = 3
+BACKOFF_FRAGMENTO_SEGUNDOS = 2
+
+_pasillos_memo = {}
+_pasillos_lock = threading.Lock()
+
+# ============================================
+# CONFIGURACIÓN: DESCARGAS REANUDABLES
+# ============================================
+# En modo streaming cada pieza (fragmento de piso o reporte del DPS Portal) se descarga en la
+# carpeta de la ejecución (descarga_<run_id>/) y se anota en descarga_checkpoint.json. Si la
+# ejecución se interrumpe o falla alguna pieza, otra ejecución del mismo FC solo descarga las piezas
+# que faltan y las descargadas hace más de CHECKPOINT_VENTANA_SEGUNDOS (desactivar con --no-resume).
+# El checkpoint se cierra en cuanto todas las piezas están combinadas en Stowmap_data.csv
+DESCARGA_REANUDABLE = True
+CHECKPOINT_VENTANA_SEGUNDOS = 2 * 3600
+CHECKPOINT_FILE = "descarga_checkpoint.json"
+
+# ============================================
+# CONFIGURACIÓN: MÉTRICAS HTTP
+# ============================================
+# Al terminar se guardan las métricas agregadas de las peticiones (ver amazon_utils.HttpMetrics):
+# tiempo hasta cabeceras y hasta el cuerpo, bytes, reintentos, reautenticaciones y rondas Kerberos por endpoint.
+# Con la variable de entorno AMAZON_HTTP_LOG=1 además se imprime una línea por petición
+HTTP_METRICS_FILE = "http_metrics.json"
+
+# Columnas de StowMap que no se usan en la app y se eliminan del CSV final
+COLUMNAS_A_ELIMINAR = [
+    'Bin Size',
+    'Available Bin Volume',
+    'Bin Usage',
+    'Can Hold High Value Asins',
+    'Can Hold Full Case Asins',
+    'Can Hold Non Conveyable Asins',
+    'Can Hold Sortable',
+    'Max Unique Asin Count'
+]
+
+
+def _stream_csv_a_archivo(req: AmazonRequest, response, dest_path: str, columnas_eliminar=(), columnas_extra=None,
+                          permitir_vacio=False):
+    """
+    Escribe el CSV de una respuesta en streaming directamente a disco, por bloques de
+    STREAMING_CHUNK_ROWS filas, eliminando columnas al vuelo. Se escribe primero en un
+    archivo temporal que solo reemplaza a dest_path si la descarga termina bien.
+    
+    :param req: AmazonRequest que hizo la petición
+    :param response: Respuesta obtenida con send_stream_req
+    :param dest_path: Ruta del CSV de destino
+    :param columnas_eliminar: Columnas a eliminar de cada bloque si existen
+    :param columnas_extra: Diccionario {columna: valor} a añadir si la columna no viene en el CSV
+    :param permitir_vacio: Si True, una respuesta vacía deja un archivo vacío (0 filas) en vez de fallar
+    :return: Número de filas escritas
+    """
+    tmp_path = dest_path + ".tmp"
+    filas = 0
+    try:
+        reader = csv.reader(req.iter_text_lines(response))
+        header = next(reader, None)
+        if header is None:
+            if not permitir_vacio:
+                raise ValueError("CSV vacio")
+            open(tmp_path, 'w').close()
+            os.replace(tmp_path, dest_path)
+            return 0
+        
+        indices = [i for i, col in enumerate(header) if col not in columnas_eliminar]
+        extra = {col: valor for col, valor in (columnas_extra or {}).items() if col not in header}
+        valores_extra = [str(valor) for valor in extra.values()]
+        
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([header[i] for i in indices] + list(extra.keys()))
+            bloque = []
+            for row in reader:
+                if not row:
+                    continue
+                bloque.append([row[i] if i < len(row) else '' for i in indices] + valores_extra)
+                if len(bloque) >= STREAMING_CHUNK_ROWS:
+                    writer.writerows(bloque)
+                    filas += len(bloque)
+                    bloque = []
+            writer.writerows(bloque)
+            filas += len(bloque)
+        os.replace(tmp_path, dest_path)
+        return filas
+    finally:
+        response.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def combinar_csv(partes, dest_path):
+    """
+    Combina varios CSV (uno por piso) en un único archivo, en el orden recibido,
+    copiando por bloques y eliminando la cabecera de todos menos el primero.
+    Si la cabecera de una parte no coincide con la primera, sus filas se reordenan
+    según las columnas de la primera.
+    
+    :param partes: Lista ordenada de rutas de CSV
+    :param dest_path: Ruta del CSV combinado
+    :return: Número de filas de datos escritas
+    """
+    tmp_path = dest_path + ".tmp"
+    filas = 0
+    header = None
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as out:
+        writer = csv.writer(out)
+        for parte in partes:
+            with open(parte, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                header_parte = next(reader, None)
+                if header_parte is None:
+                    continue
+                if header is None:
+                    header = header_parte
+                    writer.writerow(header)
+                if header_parte == header:
+                    bloque = []
+                    for row in reader:
+                        bloque.append(row)
+                        if len(bloque) >= STREAMING_CHUNK_ROWS:
+                            writer.writerows(bloque)
+                            filas += len(bloque)
+                            bloque = []
+                    writer.writerows(bloque)
+                    filas += len(bloque)
+                else:
+                    posiciones = {col: i for i, col in enumerate(header_parte)}
+                    for row in reader:
+                        writer.writerow([row[posiciones[col]] if col in posiciones and posiciones[col] < len(row) else '' for col in header])
+                        filas += 1
+    os.replace(tmp_path, dest_path)
+    return filas
+
+
+@_con_hueco_de_descarga
+def _download_dps_portal_data(fc: str, endpoint: str, data_type: str, dest_path: str = None):
     """
     Función helper genérica para descargar datos del DPS Portal.
     
     :param fc: Código del centro de distribución (ej: 'VLC1')
     :param endpoint: Nombre del endpoint (ej: 'downloadAllLockedEmptyBins.do')
     :param data_type: Nombre del tipo de datos para mensajes de error
-    :return: DataFrame con los datos o None en caso de error
+    :param dest_path: Si se indica, el CSV se escribe en streaming en esta ruta
+    :return: DataFrame con los datos (o número de filas escritas si dest_path) o None en caso de error
     """
     req = AmazonRequest()
     req.set_mw_cookie()
@@ -29,10 +245,25 @@ def _download_dps_portal_data(fc: str, endpoint: str, data_type: str):
         'warehouseId': fc
     }
     
+    if dest_path:
+        response = req.send_stream_req(url=BASE_URL, params=params)
+        if not response.ok:
+            response.close()
+            req.set_mw_cookie(flags=['-o'], delete_cookie=True)
+            response = req.send_stream_req(url=BASE_URL, params=params, attempt=1)
+        if not response.ok:
+            response.close()
+            return None
+        try:
+            return _stream_csv_a_archivo(req, response, dest_path)
+        except Exception as e:
+            print(f"Error al procesar CSV de {data_type}: {str(e)}")
+            return None
+    
     response = req.send_req(url=BASE_URL, params=params)
     if not response.ok:
         req.set_mw_cookie(flags=['-o'], delete_cookie=True)
-        response = req.send_req(url=BASE_URL, params=params)
+        response = req.send_req(url=BASE_URL, params=params, attempt=1)
     
     if response.ok:
         try:
@@ -45,41 +276,138 @@ def _download_dps_portal_data(fc: str, endpoint: str, data_type: str):
         return None
 
 
-def get_locked_empty_bins(fc: str):
+def get_locked_empty_bins(fc: str, dest_path: str = None):
     """
     Obtiene todos los bins vacíos bloqueados desde DPS Portal.
     
     :param fc: Código del centro de distribución (ej: 'VLC1')
     :return: DataFrame con los bins bloqueados vacíos o None en caso de error
     """
-    return _download_dps_portal_data(fc, "downloadAllLockedEmptyBins.do", "locked empty bins")
+    return _download_dps_portal_data(fc, "downloadAllLockedEmptyBins.do", "locked empty bins", dest_path)
 
 
-def get_pending_verification_bins(fc: str):
+def get_pending_verification_bins(fc: str, dest_path: str = None):
     """
     Obtiene los bins pendientes de verificación desde DPS Portal.
     
     :param fc: Código del centro de distribución (ej: 'VLC1')
-    :return: DataFrame con los bins pendientes de verificación o None en caso de error
+    :param dest_path: Si se indica, el CSV se escribe en streaming en esta ruta
+    :return: DataFrame con los bins pendientes de verificación o None en caso de error (número de filas escritas si dest_path)
     """
-    return _download_dps_portal_data(fc, "downloadPendingVerificationBins.do", "pending verification bins")
+    return _download_dps_portal_data(fc, "downloadPendingVerificationBins.do", "pending verification bins", dest_path)
 
 
-def get_pending_stow_bins(fc: str):
+def get_pending_stow_bins(fc: str, dest_path: str = None):
     """
     Obtiene los bins pendientes de stow desde DPS Portal.
     
     :param fc: Código del centro de distribución (ej: 'VLC1')
-    :return: DataFrame con los bins pendientes de stow o None en caso de error
+    :param dest_path: Si se indica, el CSV se escribe en streaming en esta ruta
+    :return: DataFrame con los bins pendientes de stow o None en caso de error (número de filas escritas si dest_path)
     """
-    return _download_dps_portal_data(fc, "downloadPendingStowBins.do", "pending stow bins")
+    return _download_dps_portal_data(fc, "downloadPendingStowBins.do", "pending stow bins", dest_path)
 
 
+def _parse_area_metadata(html: str):
+    """
+    Parsea loadFCAreaMap.htm en una sola pasada sobre el árbol.
+    
+    :param html: Contenido HTML de la página
+    :return: Diccionario {metric-head: [valores]} (ej: {'type': [...], 'usage': [...]})
+    """
+    soup = bs(html, "html.parser")
+    data = {}
+    
+    # Cada <ul class="metric"> contiene un <li class="metric-head"> y un <ul class="metric-content">
+    for ul in soup.find_all("ul", {"class": "metric"}):
+        metric_head = ul.find("li", {"class": "metric-head"})
+        if metric_head is None:
+            continue
+        valores = []
+        metric_content = ul.find("ul", {"class": "metric-content"})
+        if metric_content is not None:
+            valores = [li.text.strip() for li in metric_content.find_all("li")]
+        data[metric_head.text.strip()] = valores
+    
+    return data
+
+
+def get_area_metadata(fc: str, req: AmazonRequest = None, cache_dir: str = None, force_refresh: bool = False):
+    """
+    Obtiene los metadatos del área de StowMap (bin types, usages...) para un warehouse.
+    
+    Usa primero la caché en memoria del proceso, después la caché en disco (si cache_dir
+    está definido y no ha superado METADATA_CACHE_TTL) y solo en último caso descarga y
+    parsea loadFCAreaMap.htm. Si la descarga falla se usa la caché en disco aunque esté caducada.
+    
+    :param fc: Código del centro de distribución (ej: 'VLC1')
+    :param req: AmazonRequest a reutilizar (opcional)
+    :param cache_dir: Carpeta de la caché en disco (opcional)
+    :param force_refresh: Si True, ignora ambas cachés y vuelve a descargar los metadatos
+    :return: Diccionario {metric-head: [valores]} o None en caso de error
+    """
+    with _metadata_lock:
+        fc_lock = _metadata_locks.setdefault(fc, threading.Lock())
+    
+    with fc_lock:
+        if not force_refresh and fc in _metadata_memo:
+            return _metadata_memo[fc]
+        
+        cache_file = os.path.join(cache_dir, METADATA_CACHE_FILE.format(fc=fc.lower())) if cache_dir else None
+        cached = None
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    cached = json.load(f)
+            except Exception as e:
+                print(f"[WARNING] Cache de metadatos ilegible, se descargará de nuevo: {str(e)}", flush=True)
+        
+        if cached and not force_refresh and time.time() - cached.get('timestamp', 0) < METADATA_CACHE_TTL:
+            _metadata_memo[fc] = cached['data']
+            return cached['data']
+        
+        if req is None:
+            req = AmazonRequest()
+            req.set_mw_cookie()
+        
+        url = f"https://stowmap-eu.amazon.com/stowmap/loadFCAreaMap.htm?warehouseId={fc}"
+        response = req.send_req(url)
+        if not response.ok:
+            req.set_mw_cookie(flags=['-o'], delete_cookie=True)
+            response = req.send_req(url, attempt=1)
+        
+        if not response.ok:
+            if cached:
+                print("[WARNING] No se pudieron descargar los metadatos de StowMap, usando la cache en disco.", flush=True)
+                _metadata_memo[fc] = cached['data']
+                return cached['data']
+            return None
+        
+        data = _parse_area_metadata(response.text)
+        _metadata_memo[fc] = data
+        
+        if cache_file:
+            try:
+                escribir_json_atomico(cache_file, {"timestamp": time.time(), "data": data}, indent=2)
+            except Exception as e:
+                print(f"[WARNING] No se pudo guardar la cache de metadatos: {str(e)}", flush=True)
+        
+        return data
+
+
+@_con_hueco_de_descarga
 def get_stow_map(fc: str, floor: int = None, mod: str = None, aisle: int = None, is_locked: str = None,
                 can_hold_high_value: str = None, can_hold_full_case: str = None, can_hold_non_conveyable: str = None,
-                can_hold_sortable: str = None, bin_types: list = None, shelves: list = None, bin_usages: list = None):
+                can_hold_sortable: str = None, bin_types: list = None, shelves: list = None, bin_usages: list = None,
+                dest_path: str = None, permitir_vacio: bool = False, intento: int = 0):
     """
     Obtiene el mapa de almacenamiento para un piso específico en un centro de distribución de Amazon.
+    
+    Si se indica dest_path, el CSV se escribe en streaming en esa ruta (sin las columnas de
+    COLUMNAS_A_ELIMINAR y con la columna Floor si no viene) y se devuelve el número de filas.
+    Con permitir_vacio una respuesta sin datos (p.ej. un mod que no existe en ese piso) se
+    considera correcta y devuelve 0 filas / un DataFrame vacío en vez de None.
+    intento es el número de intento de la petición (0 = primero), para las métricas HTTP.
     """
     bin_properties = dict()
 
@@ -104,34 +432,14 @@ def get_stow_map(fc: str, floor: int = None, mod: str = None, aisle: int = None,
     bin_properties["canHoldNonConveyable"] = can_hold_non_conveyable if can_hold_non_conveyable else 'Ignore'
     bin_properties["canHoldSortable"] = can_hold_sortable if can_hold_sortable else 'Ignore'
 
-    # Obtención de bin_types y usage dinámicamente desde el sitio web
+    # Obtención de bin_types y usage desde la caché de metadatos (o el sitio web si no hay caché)
     req = AmazonRequest()
     req.set_mw_cookie()
     
-    # Enviar una solicitud a StowMap
-    response = req.send_req("https://stowmap-eu.amazon.com/stowmap/loadFCAreaMap.htm?warehouseId=VLC1")
-    if not response.ok:
-        req.set_mw_cookie(flags=['-o'], delete_cookie=True)
-        response = req.send_req("https://stowmap-eu.amazon.com/stowmap/loadFCAreaMap.htm?warehouseId=VLC1")
-    if not response.ok:
+    data = get_area_metadata(fc, req=req)
+    if data is None:
         return None
 
-    soup = bs(response.text, "html.parser")
-
-    # Encontrar ul con clase "metric"
-    ul = soup.find_all("ul", {"class": "metric"})
-
-    data = {}
-
-    for i in ul:
-        metric_head = bs(str(i), "html.parser").find("li", {"class": "metric-head"})
-        if metric_head is not None:
-            data[metric_head.text.strip()] = []
-            metric_content = bs(str(i), "html.parser").find("ul", {"class": "metric-content"})
-            if metric_content is not None:
-                for j in metric_content.find_all("li"):
-                    data[metric_head.text.strip()] += [j.text.strip()]
-
     # Configuración de bin_types, shelves y bin_usages por defecto
     if not bin_types:
         bin_types = data.get('type', [])
@@ -153,55 +461,384 @@ def get_stow_map(fc: str, floor: int = None, mod: str = None, aisle: int = None,
         'binProperties': str(bin_properties).replace(':', '=')
     }
 
-    response = req.send_req(url=BASE_URL, params=params)
+    if dest_path:
+        response = req.send_stream_req(url=BASE_URL, params=params, attempt=intento)
+        if not response.ok:
+            response.close()
+            return None
+        try:
+            columnas_extra = {'Floor': floor} if floor != '' else None
+            return _stream_csv_a_archivo(req, response, dest_path, COLUMNAS_A_ELIMINAR, columnas_extra,
+                                         permitir_vacio=permitir_vacio)
+        except Exception:
+            return None
+
+    response = req.send_req(url=BASE_URL, params=params, attempt=intento)
     if response.ok:
         try:
             df = pd.read_csv(StringIO(response.text), low_memory=False)
             return df
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame() if permitir_vacio else None
         except:
             return None
     else:
         return None  # Retorna None en caso de fallo
 
-def write_progress(data_folder, percentage, message):
+def _con_reintentos(descripcion, func, primer_intento=0, **kwargs):
     """
-    Escribe el progreso en un archivo JSON para que el frontend lo lea.
+    Llama a func(**kwargs) hasta REINTENTOS_FRAGMENTO veces más si devuelve None o lanza una
+    excepción, esperando BACKOFF_FRAGMENTO_SEGUNDOS * 2^intento entre intentos.
+    func recibe además intento=primer_intento + número de intento, para las métricas HTTP.
     
-    :param data_folder: Carpeta donde guardar el archivo de progreso
-    :param percentage: Porcentaje de progreso (0-100)
-    :param message: Mensaje descriptivo del paso actual
+    :return: Resultado de func o None si todos los intentos fallaron
     """
-    try:
-        progress_file = os.path.join(data_folder, "progress.json")
-        progress_data = {
-            "percentage": percentage,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
+    for intento in range(REINTENTOS_FRAGMENTO + 1):
+        try:
+            resultado = func(intento=primer_intento + intento, **kwargs)
+        except Exception as e:
+            print(f"[Fragmentos] Error en {descripcion}: {str(e)}", flush=True)
+            resultado = None
+        if resultado is not None:
+            return resultado
+        if intento < REINTENTOS_FRAGMENTO:
+            espera = BACKOFF_FRAGMENTO_SEGUNDOS * 2 ** intento
+            print(f"[Fragmentos] Reintento {intento + 1}/{REINTENTOS_FRAGMENTO} de {descripcion} en {espera}s", flush=True)
+            time.sleep(espera)
+    return None
+
+
+def _pasillos_previos(csv_previo):
+    """
+    Devuelve los pasillos de cada (piso, mod) según el CSV de la descarga anterior.
+    Se lee una sola vez por proceso y solo si algún mod necesita descargarse por pasillos.
+    
+    :return: Diccionario {(piso, mod): [pasillos]} (vacío si no hay CSV anterior)
+    """
+    with _pasillos_lock:
+        if csv_previo in _pasillos_memo:
+            return _pasillos_memo[csv_previo]
+        pasillos = {}
+        try:
+            if os.path.exists(csv_previo):
+                df = pd.read_csv(csv_previo, usecols=['Floor', 'Mod', 'Aisle'], low_memory=False).dropna()
+                for (piso, mod), grupo in df.groupby(['Floor', 'Mod']):
+                    pasillos[(int(piso), str(mod))] = sorted(int(a) for a in grupo['Aisle'].unique())
+        except Exception as e:
+            print(f"[Fragmentos] No se pudieron leer los pasillos de la descarga anterior: {str(e)}", flush=True)
+        _pasillos_memo[csv_previo] = pasillos
+        return pasillos
+
+
+class DescargaParcial:
+    """
+    Resultado de una pieza descargada solo en parte (un mod al que le faltan pasillos, un piso al que
+    le faltan mods). No se anota como completada en el checkpoint y hace que la ejecución termine con avisos.
+    
+    :param resultado: Número de filas (streaming) o DataFrame de lo que sí se descargó
+    :param faltan: Descripción de lo que falta (ej: ['P1-B pasillo 201'])
+    """
+    
+    def __init__(self, resultado, faltan):
+        self.resultado = resultado
+        self.faltan = faltan
+
+
+def _datos_pieza(resultado):
+    # Datos de una pieza (completa o parcial); None si no se descargó
+    return resultado.resultado if isinstance(resultado, DescargaParcial) else resultado
+
+
+def get_stow_map_fragmento(fc: str, floor: int, mod: str, dest_path: str = None, csv_previo: str = None):
+    """
+    Descarga un fragmento (piso + mod) del StowMap con reintentos y backoff exponencial.
+    
+    Si el mod sigue fallando y se conocen sus pasillos por la descarga anterior (csv_previo),
+    se descarga pasillo a pasillo: solo se pierden los pasillos que fallen.
+    
+    :return: Número de filas (si dest_path) o DataFrame; DescargaParcial si fallaron algunos pasillos;
+             None si no se obtuvo ningún dato
+    """
+    descripcion = f"P{floor}-{mod}"
+    resultado = _con_reintentos(descripcion, get_stow_map, fc=fc, floor=floor, mod=mod,
+                                dest_path=dest_path, permitir_vacio=True)
+    if resultado is not None or not csv_previo:
+        return resultado
+    
+    pasillos = _pasillos_previos(csv_previo).get((floor, mod), [])
+    if not pasillos:
+        return None
+    print(f"[Fragmentos] {descripcion} fallido: descargando {len(pasillos)} pasillos por separado", flush=True)
+    
+    partes = []
+    fallidos = []
+    for aisle in pasillos:
+        parte = f"{dest_path}.{aisle}" if dest_path else None
+        resultado = _con_reintentos(f"{descripcion} pasillo {aisle}", get_stow_map, fc=fc, floor=floor, mod=mod,
+                                    aisle=aisle, dest_path=parte, permitir_vacio=True,
+                                    primer_intento=REINTENTOS_FRAGMENTO + 1)
+        if resultado is None:
+            fallidos.append(str(aisle))
+        else:
+            partes.append(parte if dest_path else resultado)
+    if fallidos:
+        print(f"[WARNING] {descripcion}: no se pudieron descargar los pasillos {', '.join(fallidos)}", flush=True)
+    if not partes:
+        return None
+    
+    if dest_path:
+        resultado = combinar_csv(partes, dest_path)
+        for parte in partes:
+            os.remove(parte)
+    else:
+        resultado = pd.concat(partes, ignore_index=True)
+    if fallidos:
+        return DescargaParcial(resultado, [f"{descripcion} pasillo {aisle}" for aisle in fallidos])
+    return resultado
+
+
+def unir_fragmentos_piso(floor, mods, resultados, partes_fragmento=None, dest_path=None):
+    """
+    Une los fragmentos (mods) descargados de un piso en el orden de mods.
+    Los mods que fallaron se omiten: el piso queda incompleto (DescargaParcial) en vez de perderse entero.
+    
+    :param floor: Número de piso
+    :param mods: Lista ordenada de mods del piso
+    :param resultados: Resultados de descargar_tareas (claves 'P{piso}-{mod}')
+    :param partes_fragmento: Diccionario {mod: ruta} de los archivos parciales (modo streaming)
+    :param dest_path: Archivo parcial del piso completo (modo streaming)
+    :return: Número de filas (streaming) o DataFrame; DescargaParcial si falta algún mod o pasillo;
+             None si no hay ningún dato del piso
+    """
+    correctos = [mod for mod in mods if resultados.get(f"P{floor}-{mod}") is not None]
+    faltan = [f"P{floor}-{mod}" for mod in mods if mod not in correctos]
+    for mod in correctos:
+        resultado = resultados[f"P{floor}-{mod}"]
+        if isinstance(resultado, DescargaParcial):
+            faltan.extend(resultado.faltan)
+    if faltan and correctos:
+        print(f"[WARNING] Piso {floor} incompleto: faltan {', '.join(faltan)}", flush=True)
+    
+    if dest_path:
+        # Los archivos de cada mod se conservan: son el checkpoint de la ejecución
+        filas = combinar_csv([partes_fragmento[mod] for mod in correctos], dest_path) if correctos else 0
+        if not filas:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            return None
+        resultado = filas
+    else:
+        dfs = [_datos_pieza(resultados[f"P{floor}-{mod}"]) for mod in correctos]
+        dfs = [df for df in dfs if not df.empty]
+        if not dfs:
+            return None
+        resultado = pd.concat(dfs, ignore_index=True)
+    return DescargaParcial(resultado, faltan) if faltan else resultado
+
+
+def carpeta_checkpoint(data_folder, run_id):
+    """
+    Devuelve la carpeta donde se descargan las piezas de una ejecución.
+    """
+    return os.path.join(data_folder, f"descarga_{run_id}")
+
+
+def _guardar_checkpoint(data_folder, checkpoint):
+    escribir_json_atomico(os.path.join(data_folder, CHECKPOINT_FILE), checkpoint, indent=2)
+
+
+def cargar_checkpoint(data_folder, fc, claves, reanudar=True):
+    """
+    Devuelve el checkpoint de la ejecución anterior si se puede reanudar o uno nuevo.
+    
+    Se reanuda si el checkpoint es del mismo FC y tiene las mismas piezas, de las que falta alguna;
+    solo se conservan las piezas descargadas hace menos de CHECKPOINT_VENTANA_SEGUNDOS (el resto se
+    vuelve a descargar). En caso contrario se borran las piezas de las ejecuciones anteriores.
+    
+    :param data_folder: Carpeta de datos del FC
+    :param fc: Código del centro de distribución
+    :param claves: Claves de todas las piezas de la descarga (ej: ['P1-A', ..., 'Locked Empty Bins'])
+    :param reanudar: Si False, siempre se empieza una ejecución nueva
+    :return: Diccionario {'run_id', 'fc', 'creado', 'tareas', 'completadas': {clave: filas},
+             'descargadas': {clave: timestamp}}
+    """
+    checkpoint_path = os.path.join(data_folder, CHECKPOINT_FILE)
+    previo = None
+    if os.path.exists(checkpoint_path):
+        try:
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                previo = json.load(f)
+        except Exception as e:
+            print(f"[Reanudar] [WARNING] Checkpoint ilegible, se empieza de cero: {str(e)}", flush=True)
+    
+    if previo and reanudar and previo.get('fc') == fc and sorted(previo.get('tareas', [])) == sorted(claves):
+        ahora = time.time()
+        descargadas = previo.get('descargadas', {})
+        vigentes = {
+            clave: filas for clave, filas in previo.get('completadas', {}).items()
+            if ahora - descargadas.get(clave, previo.get('creado', 0)) < CHECKPOINT_VENTANA_SEGUNDOS
         }
-        # Escribir y asegurar que se guarde inmediatamente
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump(progress_data, f)
-            f.flush()  # Forzar escritura inmediata al disco
-            os.fsync(f.fileno())  # Sincronizar con el sistema de archivos
-        # También forzar flush de stdout para que los prints se vean
-        sys.stdout.flush()
+        # Un checkpoint sin piezas pendientes no se reanuda: serviría datos antiguos como recién descargados
+        if vigentes and len(vigentes) < len(claves):
+            previo['completadas'] = vigentes
+            previo['descargadas'] = {clave: descargadas.get(clave, previo.get('creado', 0)) for clave in vigentes}
+            _guardar_checkpoint(data_folder, previo)
+            return previo
+    
+    # Piezas de ejecuciones anteriores (también las de un checkpoint ya cerrado)
+    for nombre in os.listdir(data_folder):
+        if nombre.startswith("descarga_") and os.path.isdir(os.path.join(data_folder, nombre)):
+            shutil.rmtree(os.path.join(data_folder, nombre), ignore_errors=True)
+    checkpoint = {
+        'run_id': datetime.now().strftime("%Y%m%d-%H%M%S"),
+        'fc': fc,
+        'creado': time.time(),
+        'tareas': claves,
+        'completadas': {},
+        'descargadas': {},
+    }
+    _guardar_checkpoint(data_folder, checkpoint)
+    return checkpoint
+
+
+def cerrar_checkpoint(data_folder, checkpoint, borrar_piezas=True):
+    """
+    Borra el checkpoint de una ejecución sin piezas pendientes (ya no se puede reanudar) y,
+    con borrar_piezas, sus piezas.
+    """
+    if borrar_piezas:
+        shutil.rmtree(carpeta_checkpoint(data_folder, checkpoint['run_id']), ignore_errors=True)
+    checkpoint_path = os.path.join(data_folder, CHECKPOINT_FILE)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+def _ejecutar_tarea(clave, func, kwargs):
+    """
+    Ejecuta una tarea de descarga aislando sus errores del resto de tareas.
+    El límite global MAX_DESCARGAS_GLOBALES lo aplican get_stow_map y _download_dps_portal_data
+    en cada intento, de modo que los reintentos en espera no ocupan huecos.
+    
+    :return: Tupla (clave, resultado) donde resultado es None si la tarea falló
+    """
+    try:
+        return clave, func(**kwargs)
     except Exception as e:
-        # No fallar si no se puede escribir el progreso
-        print(f"[DEBUG] Error escribiendo progreso: {e}")
-        sys.stdout.flush()
+        print(f"[WARNING] Error descargando {clave}: {str(e)}", flush=True)
+        return clave, None
 
 
-if __name__ == '__main__':
-    fc = 'VLC1'
-    all_dfs = []
+def descargar_tareas(tareas, data_folder, pct_inicio, pct_fin, max_workers=None, al_completar=None):
+    """
+    Descarga un conjunto de tareas (pisos, reportes) de forma concurrente o secuencial
+    según DESCARGA_CONCURRENTE, informando del progreso de cada tarea.
     
-    # Determinar la carpeta de datos al inicio
-    if len(sys.argv) > 1:
-        user_data_path = sys.argv[1]
-        data_folder = os.path.join(user_data_path, "data", "space-heatmap")
-    else:
-        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
-        data_folder = os.path.join(project_root, "data", "space-heatmap")
+    El fallo de una tarea no afecta al resto: su resultado queda como None.
+    El progreso se escribe siempre desde el hilo principal.
+    
+    :param tareas: Lista de tuplas (clave, funcion, kwargs)
+    :param data_folder: Carpeta donde se escribe progress.json
+    :param pct_inicio: Porcentaje de progreso al empezar las descargas
+    :param pct_fin: Porcentaje de progreso al terminar todas las descargas
+    :param max_workers: Máximo de descargas simultáneas (default: MAX_DESCARGAS_SIMULTANEAS)
+    :param al_completar: Función (clave, resultado) llamada desde el hilo principal al terminar cada tarea
+    :return: Diccionario {clave: resultado}
+    """
+    resultados = {}
+    total = len(tareas)
+    if total == 0:
+        return resultados
+    
+    def informar(clave, resultado, completadas):
+        if al_completar is not None:
+            al_completar(clave, resultado)
+        pct = pct_inicio + int((pct_fin - pct_inicio) * completadas / total)
+        if isinstance(resultado, DescargaParcial):
+            write_progress(data_folder, pct, f"{clave} incompleto")
+            print(f"[WARNING] {clave} descargado solo en parte, faltan: {', '.join(resultado.faltan)} "
+                  f"({completadas}/{total})", flush=True)
+        elif resultado is not None:
+            write_progress(data_folder, pct, f"{clave} completado")
+            print(f"[OK] {clave} descargado ({completadas}/{total})", flush=True)
+        else:
+            write_progress(data_folder, pct, f"Error descargando {clave}")
+            print(f"[WARNING] Fallo al descargar {clave} ({completadas}/{total})", flush=True)
+    
+    if not DESCARGA_CONCURRENTE:
+        for completadas, (clave, func, kwargs) in enumerate(tareas, 1):
+            write_progress(data_folder, pct_inicio + int((pct_fin - pct_inicio) * (completadas - 1) / total), f"Descargando {clave}")
+            print(f"Descargando {clave}...", flush=True)
+            clave, resultado = _ejecutar_tarea(clave, func, kwargs)
+            resultados[clave] = resultado
+            informar(clave, resultado, completadas)
+        return resultados
+    
+    # Autenticar con Midway una sola vez antes de lanzar los hilos, para que
+    # no se abran varias ventanas de mwinit a la vez si la cookie no es válida
+    AmazonRequest().set_mw_cookie()
+    
+    max_workers = max_workers or MAX_DESCARGAS_SIMULTANEAS
+    write_progress(data_folder, pct_inicio, f"Descargando {total} tareas en paralelo")
+    print(f"Descargando {', '.join(clave for clave, _, _ in tareas)} en paralelo (max {max_workers} simultaneas)...", flush=True)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = [executor.submit(_ejecutar_tarea, clave, func, kwargs) for clave, func, kwargs in tareas]
+        for completadas, futuro in enumerate(as_completed(futuros), 1):
+            clave, resultado = futuro.result()
+            resultados[clave] = resultado
+            informar(clave, resultado, completadas)
+    
+    return resultados
+
+
+def parse_args():
+    """
+    Parsea los argumentos de línea de comandos.
+    El primer argumento posicional (opcional) es la ruta de userData que pasa Electron.
+    """
+    parser = argparse.ArgumentParser(description="Descarga los datos de StowMap y DPS Portal")
+    parser.add_argument("user_data_path", nargs="?", default=None,
+                        help="Ruta de userData de Electron (opcional)")
+    parser.add_argument("--refresh-metadata", action="store_true",
+                        help="Ignora la cache de metadatos de StowMap y la vuelve a descargar")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignora el manifest de hashes y reprocesa todos los pisos y heatmaps")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="No reanuda la descarga anterior aunque haya piezas descargadas dentro de la ventana")
+    parser.add_argument("--fc", nargs="+", default=None,
+                        help=f"Uno o varios FCs a descargar (default: {FC_POR_DEFECTO}). Con varios se activa el modo batch")
+    parser.add_argument("--max-fc", type=int, default=None,
+                        help=f"Máximo de FCs procesados a la vez en modo batch (default: {MAX_FC_SIMULTANEOS})")
+    return parser.parse_args()
+
+
+def carpeta_datos_fc(base_folder, fc):
+    """
+    Devuelve la carpeta de datos de un FC. El FC por defecto usa directamente base_folder
+    (la carpeta que lee la app); el resto usa una subcarpeta con su código (ej: data/space-heatmap/MAD4).
+    """
+    if fc.upper() == FC_POR_DEFECTO:
+        return base_folder
+    return os.path.join(base_folder, fc.upper())
+
+
+def ejecutar_fc(fc, data_folder, args):
+    """
+    Ejecuta el pipeline completo de un FC: descarga de pisos y reportes del DPS Portal,
+    combinación, procesamiento (fullness_<fc>.json) y generación de heatmaps.
+    
+    :param fc: Código del centro de distribución (ej: 'VLC1')
+    :param data_folder: Carpeta de datos del FC
+    :param args: Argumentos de línea de comandos (--full, --refresh-metadata)
+    :return: Diccionario resumen {'fc', 'ok', 'avisos', 'filas', 'segundos', 'incompletos'}
+             (ok=False si no se descargó ningún piso; avisos=True si falta alguna pieza de los pisos o falló
+             el procesamiento o algún heatmap; incompletos: piezas de los pisos que no se descargaron)
+    """
+    inicio = time.time()
+    avisos = False
+    all_dfs = []
+    combined_df = None
+    df_pipeline = None
     
     # Crear la carpeta si no existe
     if not os.path.exists(data_folder):
@@ -209,80 +846,192 @@ if __name__ == '__main__':
     
     # Crear archivo de progreso inicial ANTES de cualquier otra operación
     write_progress(data_folder, 0, "Iniciando descarga")
-    print("Iniciando el proceso de descarga y combinacion de datos de StowMap.", flush=True)
+    print(f"Iniciando el proceso de descarga y combinacion de datos de StowMap ({fc}).", flush=True)
     sys.stdout.flush()
-    # Pausa para que se vea el mensaje inicial
-    time.sleep(0.5)
 
-    # Descargar pisos 1-5 (60% del progreso total, 12% por piso)
+    # Cargar los metadatos de StowMap una sola vez; todos los pisos reutilizan la misma lista
+    metadata = get_area_metadata(fc, cache_dir=data_folder, force_refresh=args.refresh_metadata)
+    mods = (metadata or {}).get('mod', []) if DESCARGA_POR_MODS else []
+
+    # Descargar pisos 1-5 y reportes del DPS Portal (60% del progreso total)
     total_floors = 5
     
+    # Lista de funciones de descarga del DPS Portal con sus nombres de archivo
+    downloads = [
+        (get_locked_empty_bins, "LockedEmptyBins_data.csv", "Locked Empty Bins"),
+        (get_pending_verification_bins, "PendingVerificationBins_data.csv", "Pending Verification Bins"),
+        (get_pending_stow_bins, "PendingStowBins_data.csv", "Pending Stow Bins")
+    ]
+    
+    # Nombre del archivo
+    filename = "Stowmap_data.csv"
+    filepath = os.path.join(data_folder, filename)
+    
+    # Piezas de la descarga: un fragmento por piso y mod (P1-A, P1-B...) o el piso completo
+    # si no hay mods, más los reportes del DPS Portal
+    claves_piso = {
+        floor: [f"P{floor}-{mod}" for mod in mods] if mods else [f"P{floor}"]
+        for floor in range(1, total_floors + 1)
+    }
+    claves = [clave for floor in claves_piso for clave in claves_piso[floor]]
+    claves += [data_name for _, _, data_name in downloads]
+    
+    # En modo streaming cada pieza se escribe en la carpeta de la ejecución (descarga_<run_id>/),
+    # que hace de checkpoint: si la ejecución se interrumpe, la siguiente solo descarga lo que falta
+    checkpoint = None
+    rutas = {}
+    partes = {}
+    if DESCARGA_STREAMING:
+        checkpoint = cargar_checkpoint(data_folder, fc, claves, reanudar=DESCARGA_REANUDABLE and not args.no_resume)
+        carpeta_run = carpeta_checkpoint(data_folder, checkpoint['run_id'])
+        os.makedirs(carpeta_run, exist_ok=True)
+        partes = {floor: os.path.join(carpeta_run, f"P{floor}.csv") for floor in range(1, total_floors + 1)}
+        rutas = {clave: os.path.join(carpeta_run, f"{clave}.csv") for floor in claves_piso for clave in claves_piso[floor]}
+        rutas.update({data_name: os.path.join(carpeta_run, dps_filename) for _, dps_filename, data_name in downloads})
+    
+    tareas = []
     for floor in range(1, total_floors + 1):
-        progress_pct = int((floor - 1) * 12)  # 0, 12, 24, 36, 48
-        write_progress(data_folder, progress_pct, f"Descargando P{floor}")
-        # Pausa para que se vea el mensaje antes de empezar la descarga
-        time.sleep(0.3)
-        print(f"Descargando Piso {floor}...", flush=True)
-        sys.stdout.flush()
-        
-        df = get_stow_map(fc=fc, floor=floor)
-        if df is not None:
+        for clave in claves_piso[floor]:
+            if mods:
+                mod = clave.split('-', 1)[1]
+                tareas.append((clave, get_stow_map_fragmento, {'fc': fc, 'floor': floor, 'mod': mod, 'csv_previo': filepath}))
+            else:
+                tareas.append((clave, get_stow_map, {'fc': fc, 'floor': floor}))
+    for download_func, dps_filename, data_name in downloads:
+        tareas.append((data_name, download_func, {'fc': fc}))
+    
+    resultados = {}
+    if DESCARGA_STREAMING:
+        pendientes = []
+        for clave, func, kwargs in tareas:
+            kwargs['dest_path'] = rutas[clave]
+            if clave in checkpoint['completadas'] and os.path.exists(rutas[clave]):
+                resultados[clave] = checkpoint['completadas'][clave]
+            else:
+                pendientes.append((clave, func, kwargs))
+        if resultados:
+            print(f"[Reanudar] Ejecucion {checkpoint['run_id']}: {len(resultados)}/{len(tareas)} piezas ya descargadas, "
+                  f"se descargan {len(pendientes)}", flush=True)
+        tareas = pendientes
+    
+    def anotar_checkpoint(clave, resultado):
+        # Las piezas parciales no se dan por completadas: al reanudar se vuelven a descargar
+        if checkpoint is not None and resultado is not None and not isinstance(resultado, DescargaParcial):
+            checkpoint['completadas'][clave] = resultado
+            checkpoint['descargadas'][clave] = time.time()
+            _guardar_checkpoint(data_folder, checkpoint)
+    
+    resultados.update(descargar_tareas(tareas, data_folder, 0, 60, al_completar=anotar_checkpoint))
+    faltan = [clave for clave in claves
+              if resultados.get(clave) is None or isinstance(resultados[clave], DescargaParcial)]
+    
+    if mods:
+        for floor in range(1, total_floors + 1):
+            partes_fragmento = {mod: rutas.get(f"P{floor}-{mod}") for mod in mods}
+            resultados[f"P{floor}"] = unir_fragmentos_piso(
+                floor, mods, resultados, partes_fragmento, partes.get(floor))
+    
+    # Piezas de los pisos que no se descargaron: la ejecución termina con avisos y se indican en el resumen
+    incompletos = []
+    pisos_incompletos = set()
+    all_parts = []
+    for floor in range(1, total_floors + 1):
+        resultado = resultados.get(f"P{floor}")
+        if isinstance(resultado, DescargaParcial):
+            incompletos.extend(resultado.faltan)
+            pisos_incompletos.add(floor)
+            resultado = resultados[f"P{floor}"] = resultado.resultado
+        if resultado is None:
+            print(f"Fallo al obtener datos para el Piso {floor}.", flush=True)
+            sys.stdout.flush()
+            incompletos.append(f"P{floor}")
+        elif DESCARGA_STREAMING:
+            all_parts.append(partes[floor])
+        else:
+            df = resultado
             # Añadir información del piso al DataFrame si no está presente
             if 'Floor' not in df.columns:
                 df['Floor'] = floor
             all_dfs.append(df)
-            progress_pct_complete = int(floor * 12)  # 12, 24, 36, 48, 60
-            write_progress(data_folder, progress_pct_complete, f"P{floor} completado")
-            # Pausa para que se vea el mensaje de completado
-            time.sleep(0.3)
-            print(f"[OK] Piso {floor} descargado", flush=True)
-            sys.stdout.flush()
-        else:
-            print(f"Fallo al obtener datos para el Piso {floor}.", flush=True)
-            sys.stdout.flush()
-            write_progress(data_folder, progress_pct, f"Error descargando P{floor}")
+    if incompletos:
+        avisos = True
 
-    if all_dfs:
+    if all_dfs or all_parts:
         # 60-67%: Combinando y procesando datos
         write_progress(data_folder, 60, "Combinando datos")
-        time.sleep(0.3)
         print("Generando Csv...", flush=True)
         sys.stdout.flush()
-        combined_df = pd.concat(all_dfs, ignore_index=True)
-
-        # Eliminar las columnas no deseadas si existen
-        write_progress(data_folder, 62, "Limpiando datos")
-        time.sleep(0.3)
-        columnas_a_eliminar = [
-            'Bin Size',
-            'Available Bin Volume',
-            'Bin Usage',
-            'Can Hold High Value Asins',
-            'Can Hold Full Case Asins',
-            'Can Hold Non Conveyable Asins',
-            'Can Hold Sortable',
-            'Max Unique Asin Count'
-        ]
-        columnas_presentes = [col for col in columnas_a_eliminar if col in combined_df.columns]
-        combined_df.drop(columns=columnas_presentes, inplace=True)
         
-        # 64%: Guardando datos
-        write_progress(data_folder, 64, "Guardando CSV")
-        time.sleep(0.3)
-        sys.stdout.flush()
+        # Hash del contenido de cada piso para el refresco incremental (delta)
+        manifest = cargar_manifest(data_folder)
+        hashes_pisos = {}
+        for floor in range(1, total_floors + 1):
+            resultado = resultados.get(f"P{floor}")
+            if resultado is None:
+                continue
+            if DESCARGA_STREAMING:
+                hashes_pisos[str(floor)] = {'hash': hash_archivo(partes[floor]), 'filas': resultado}
+            else:
+                hashes_pisos[str(floor)] = {'hash': hash_dataframe(resultado), 'filas': len(resultado)}
+            # Un piso incompleto queda marcado como tal en el manifest
+            hashes_pisos[str(floor)]['completo'] = floor not in pisos_incompletos
         
-        # Nombre del archivo
-        filename = "Stowmap_data.csv"
-        filepath = os.path.join(data_folder, filename)
+        sin_cambios = (
+            not args.full
+            and manifest_valido(manifest, filepath)
+            and {k: v['hash'] for k, v in manifest['pisos'].items()} == {k: v['hash'] for k, v in hashes_pisos.items()}
+        )
         
-        # Guardar el DataFrame final en CSV
-        combined_df.to_csv(filepath, index=False)
-        print(f"[OK] CSV Exportado: {filepath}", flush=True)
-        sys.stdout.flush()
+        if sin_cambios:
+            print("[Delta] Ningun piso ha cambiado desde la ultima descarga: se conserva Stowmap_data.csv", flush=True)
+            sys.stdout.flush()
+        elif DESCARGA_STREAMING:
+            # Las columnas ya se eliminaron por bloques durante la descarga:
+            # solo hay que concatenar los pisos en orden, sin cargarlos en memoria
+            write_progress(data_folder, 64, "Guardando CSV")
+            filas = combinar_csv(all_parts, filepath)
+            print(f"[OK] CSV Exportado: {filepath} ({filas} registros)", flush=True)
+            if FILAS_POR_BLOQUE > 0:
+                # Procesamiento por bloques: el CSV combinado no se carga entero en memoria
+                # (sin snapshot; el procesamiento lo lee por bloques y los heatmaps desde el CSV)
+                print("[Snapshot] Procesamiento por bloques: no se genera el snapshot", flush=True)
+            else:
+                # El CSV combinado se lee una sola vez, con el esquema de ingesta (tipado, categóricas):
+                # para el snapshot columnar y para el procesamiento
+                combined_df = leer_csv(filepath)
+                guardar_snapshot(combined_df, filepath)
+            sys.stdout.flush()
+        else:
+            combined_df = pd.concat(all_dfs, ignore_index=True)
+
+            # Eliminar las columnas no deseadas si existen
+            write_progress(data_folder, 62, "Limpiando datos")
+            columnas_presentes = [col for col in COLUMNAS_A_ELIMINAR if col in combined_df.columns]
+            combined_df.drop(columns=columnas_presentes, inplace=True)
+            
+            # 64%: Guardando datos
+            write_progress(data_folder, 64, "Guardando CSV")
+            sys.stdout.flush()
+            
+            # Guardar el DataFrame final en CSV
+            combined_df.to_csv(filepath, index=False)
+            print(f"[OK] CSV Exportado: {filepath}", flush=True)
+            guardar_snapshot(combined_df, filepath)
+            sys.stdout.flush()
+        
+        if not sin_cambios:
+            manifest['pisos'] = hashes_pisos
+            manifest['csv'] = firma_csv(filepath)
+            guardar_manifest(data_folder, manifest)
+        
+        # Todas las piezas están en el CSV: el checkpoint se cierra ya, para que un fallo posterior
+        # (procesamiento, heatmaps) no haga que la siguiente ejecución reutilice estas piezas.
+        # La carpeta de la ejecución se borra al final (de ella se copian los reportes del DPS Portal)
+        if checkpoint is not None and not faltan:
+            cerrar_checkpoint(data_folder, checkpoint, borrar_piezas=False)
         
         # 67%: Guardando metadata
         write_progress(data_folder, 67, "Guardando metadata")
-        time.sleep(0.3)
         
         # Guardar archivo de última actualización (JSON simple y rápido de leer)
         update_info = {
@@ -290,156 +1039,238 @@ if __name__ == '__main__':
             "timestamp": datetime.now().timestamp()
         }
         update_file = os.path.join(data_folder, "last_update.json")
-        with open(update_file, 'w', encoding='utf-8') as f:
-            json.dump(update_info, f, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
+        escribir_json_atomico(update_file, update_info, indent=2)
         print(f"[OK] Archivo de actualización guardado: {update_file}", flush=True)
         sys.stdout.flush()
         
-        # 70-90%: Procesamiento de datos
-        write_progress(data_folder, 70, "Procesando datos")
-        time.sleep(0.3)
-        print("\n[Procesamiento] Iniciando procesamiento de datos...", flush=True)
-        sys.stdout.flush()
+        # 70-90%: Procesamiento de datos en este mismo proceso (solo si algún piso o alguna regla
+        # cambió desde el último procesamiento). El DataFrame se carga y corrige una sola vez y se
+        # reutiliza después para los heatmaps.
         try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            procesar_script = os.path.join(script_dir, "Procesar_StowMap.py")
-            
-            write_progress(data_folder, 72, "Calculando estadísticas")
-            time.sleep(0.3)
-            
-            # Ejecutar script de procesamiento con el mismo userData path si existe
-            if len(sys.argv) > 1:
-                result = subprocess.run(
-                    [sys.executable, procesar_script, sys.argv[1]],
-                    capture_output=True,
-                    text=True
-                )
-            else:
-                result = subprocess.run(
-                    [sys.executable, procesar_script],
-                    capture_output=True,
-                    text=True
-                )
-            
-            # Mostrar output del procesamiento
-            if result.stdout:
-                print(result.stdout, flush=True)
-            if result.stderr and result.returncode != 0:
-                print("[WARNING] Errores durante el procesamiento:", flush=True)
-                print(result.stderr, flush=True)
-            
-            if result.returncode == 0:
+            pendiente = args.full or procesamiento_pendiente(filepath, os.path.join(data_folder, "processed"), fc=fc)
+        except Exception as e:
+            # Si no se puede comprobar (p.ej. falta el directorio de reglas) se intenta procesar:
+            # el error se reporta como aviso del procesamiento y el resto del pipeline continúa
+            print(f"[WARNING] No se pudo comprobar si hay cambios que procesar: {str(e)}", flush=True)
+            pendiente = True
+        if not pendiente:
+            print("\n[Delta] Sin cambios desde el ultimo procesamiento: se omite el procesamiento", flush=True)
+            write_progress(data_folder, 90, "Procesamiento sin cambios")
+        else:
+            write_progress(data_folder, 70, "Procesando datos")
+            print("\n[Procesamiento] Iniciando procesamiento de datos...", flush=True)
+            sys.stdout.flush()
+            try:
+                write_progress(data_folder, 72, "Calculando estadísticas")
+                
+                if combined_df is None and FILAS_POR_BLOQUE > 0:
+                    # Procesamiento por bloques: procesar_stowmap lee y corrige el CSV por bloques
+                    procesar_stowmap(filepath, os.path.join(data_folder, "processed"), forzar=args.full, fc=fc)
+                else:
+                    if combined_df is not None:
+                        # Los datos recién descargados pasan por el mismo esquema que la lectura del CSV
+                        df_pipeline = aplicar_esquema(combined_df, origen="Datos descargados")
+                        combined_df = None
+                    else:
+                        # Si ya se guardaron los datos corregidos de este CSV, corregir_csv() no hace nada
+                        df_pipeline = leer_stowmap(filepath, version_correcciones=VERSION_CORRECCIONES)
+                    df_pipeline = corregir_csv(df_pipeline)
+                    procesar_stowmap(filepath, os.path.join(data_folder, "processed"), forzar=args.full,
+                                     df=df_pipeline, corregido=True, fc=fc)
+                
                 print("[OK] Procesamiento completado exitosamente!", flush=True)
                 sys.stdout.flush()
                 write_progress(data_folder, 90, "Procesamiento completado")
-                time.sleep(0.3)
-            else:
-                print("[WARNING] El procesamiento termino con errores.", flush=True)
+            except Exception as e:
+                print(f"[WARNING] Error durante el procesamiento: {str(e)}", flush=True)
+                traceback.print_exc()
+                print("[INFO] Puedes ejecutar manualmente: python Procesar_StowMap.py", flush=True)
                 sys.stdout.flush()
-                write_progress(data_folder, 85, "Procesamiento con advertencias")
-                time.sleep(0.3)
-        except Exception as e:
-            print(f"[WARNING] Error al ejecutar procesamiento: {str(e)}", flush=True)
-            print("[INFO] Puedes ejecutar manualmente: python Procesar_StowMap.py", flush=True)
-            sys.stdout.flush()
-            write_progress(data_folder, 85, "Error en procesamiento")
-            time.sleep(0.3)
+                write_progress(data_folder, 85, "Error en procesamiento")
+                df_pipeline = None
+                avisos = True
     else:
-        print("No se obtuvieron datos para ninguno de los pisos especificados.")
+        print(f"No se obtuvieron datos para ninguno de los pisos especificados ({fc}).")
         write_progress(data_folder, 0, "Error: No se obtuvieron datos")
-        sys.exit(1)
+        return {'fc': fc, 'ok': False, 'avisos': avisos, 'filas': 0, 'segundos': time.time() - inicio,
+                'incompletos': incompletos}
     
-    # 90-100%: Descargar datos adicionales del DPS Portal
-    write_progress(data_folder, 90, "Descargando datos adicionales")
-    time.sleep(0.3)
+    # 90-96%: Guardar datos adicionales del DPS Portal (ya descargados junto a los pisos)
+    write_progress(data_folder, 90, "Guardando datos adicionales")
     print("\n" + "="*50, flush=True)
-    print("Iniciando descarga de datos adicionales del DPS Portal...", flush=True)
+    print("Guardando datos adicionales del DPS Portal...", flush=True)
     print("="*50, flush=True)
     sys.stdout.flush()
     
-    # Lista de funciones de descarga con sus nombres de archivo
-    downloads = [
-        (get_locked_empty_bins, "LockedEmptyBins_data.csv", "Locked Empty Bins"),
-        (get_pending_verification_bins, "PendingVerificationBins_data.csv", "Pending Verification Bins"),
-        (get_pending_stow_bins, "PendingStowBins_data.csv", "Pending Stow Bins")
-    ]
-    
+    hashes_reportes = {}
     for idx, (download_func, filename, data_name) in enumerate(downloads, 1):
         progress_pct = 90 + int((idx - 1) * 3.33)  # 90, 93, 96 aproximadamente
-        write_progress(data_folder, progress_pct, f"Descargando {data_name}")
-        time.sleep(0.3)
-        print(f"\nDescargando {data_name}...", flush=True)
-        sys.stdout.flush()
+        write_progress(data_folder, progress_pct, f"Guardando {data_name}")
         
-        df = download_func(fc=fc)
+        resultado = resultados.get(data_name)
         
-        if df is not None:
-            print(f"[OK] {data_name} descargados: {len(df)} registros", flush=True)
-            sys.stdout.flush()
-            filepath = os.path.join(data_folder, filename)
-            df.to_csv(filepath, index=False)
-            progress_pct_saved = 90 + int(idx * 3.33)  # 93, 96, 99 aproximadamente
-            time.sleep(0.2)
-            print(f"[OK] {data_name} CSV Exportado: {filepath}", flush=True)
+        if resultado is not None:
+            dps_filepath = os.path.join(data_folder, filename)
+            if DESCARGA_STREAMING:
+                # Ya escrito en disco durante la descarga: se copia desde la carpeta de la ejecución
+                shutil.copyfile(rutas[data_name], dps_filepath + ".tmp")
+                os.replace(dps_filepath + ".tmp", dps_filepath)
+                print(f"[OK] {data_name} descargados: {resultado} registros", flush=True)
+            else:
+                print(f"[OK] {data_name} descargados: {len(resultado)} registros", flush=True)
+                resultado.to_csv(dps_filepath, index=False)
+            print(f"[OK] {data_name} CSV Exportado: {dps_filepath}", flush=True)
             sys.stdout.flush()
+            hashes_reportes[filename] = {'hash': hash_archivo(dps_filepath), 'filas': resultado if DESCARGA_STREAMING else len(resultado)}
         else:
             print(f"[WARNING] No se pudieron obtener los datos de {data_name}.", flush=True)
             sys.stdout.flush()
     
+    # Checkpoint: si falta alguna pieza se conserva para reanudar; si no, ya está cerrado y solo
+    # queda borrar las piezas de la ejecución
+    if checkpoint is not None:
+        if faltan:
+            print(f"[Reanudar] Faltan {len(faltan)} piezas ({', '.join(faltan)}). Si se vuelve a ejecutar en menos de "
+                  f"{CHECKPOINT_VENTANA_SEGUNDOS // 3600}h solo se descargaran las que faltan.", flush=True)
+        else:
+            cerrar_checkpoint(data_folder, checkpoint)
+    
+    # Registrar los hashes de los reportes en el manifest (releído: el procesamiento lo actualiza)
+    manifest = cargar_manifest(data_folder)
+    manifest.setdefault('reportes', {}).update(hashes_reportes)
+    guardar_manifest(data_folder, manifest)
+    
     # 96-100%: Generar Heatmaps SVG
     write_progress(data_folder, 96, "Generando heatmaps SVG")
-    time.sleep(0.3)
     print("\n" + "="*50, flush=True)
     print("Generando Heatmaps SVG...", flush=True)
     print("="*50, flush=True)
     sys.stdout.flush()
     
+    # generar_heatmaps() decide qué heatmaps regenerar (pisos, plantilla SVG y SVG generado) y solo lee
+    # los datos si alguno lo necesita
     try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        generar_heatmaps_script = os.path.join(script_dir, "Generar_Heatmaps.py")
-        
-        # Ejecutar script de generación de heatmaps con el mismo userData path si existe
-        if len(sys.argv) > 1:
-            result = subprocess.run(
-                [sys.executable, generar_heatmaps_script, sys.argv[1]],
-                capture_output=True,
-                text=True
-            )
-        else:
-            result = subprocess.run(
-                [sys.executable, generar_heatmaps_script],
-                capture_output=True,
-                text=True
-            )
-        
-        # Mostrar output de la generación
-        if result.stdout:
-            print(result.stdout, flush=True)
-        if result.stderr and result.returncode != 0:
-            print("[WARNING] Errores durante la generación de heatmaps:", flush=True)
-            print(result.stderr, flush=True)
+        # Si el procesamiento se ejecutó, los heatmaps usan el mismo DataFrame corregido en memoria
+        resultados_heatmaps = generar_heatmaps(data_folder, forzar=args.full, df=df_pipeline, fc=fc)
         
-        if result.returncode == 0:
+        if resultados_heatmaps and all(exito for _, exito in resultados_heatmaps):
             print("[OK] Heatmaps SVG generados exitosamente!", flush=True)
             sys.stdout.flush()
             write_progress(data_folder, 98, "Heatmaps SVG completados")
-            time.sleep(0.3)
         else:
             print("[WARNING] La generación de heatmaps terminó con errores.", flush=True)
             sys.stdout.flush()
             write_progress(data_folder, 98, "Heatmaps con advertencias")
-            time.sleep(0.3)
+            avisos = True
     except Exception as e:
-        print(f"[WARNING] Error al ejecutar generación de heatmaps: {str(e)}", flush=True)
+        print(f"[WARNING] Error durante la generación de heatmaps: {str(e)}", flush=True)
+        traceback.print_exc()
         print("[INFO] Puedes ejecutar manualmente: python Generar_Heatmaps.py", flush=True)
         sys.stdout.flush()
         write_progress(data_folder, 98, "Error generando heatmaps")
-        time.sleep(0.3)
+        avisos = True
     
     # 100%: Completado
     write_progress(data_folder, 100, "Descarga completada")
-    print("\n[OK] Proceso de descarga completado!", flush=True)
+    if incompletos:
+        print(f"\n[WARNING] Datos incompletos ({fc}): faltan {', '.join(incompletos)}", flush=True)
+    print(f"\n[OK] Proceso de descarga completado! ({fc})", flush=True)
     sys.stdout.flush()
+    
+    return {
+        'fc': fc,
+        'ok': True,
+        'avisos': avisos,
+        'filas': sum(info['filas'] for info in hashes_pisos.values()),
+        'segundos': time.time() - inicio,
+        'incompletos': incompletos,
+    }
+
+
+def ejecutar_batch(fcs, base_folder, args, max_fc=None):
+    """
+    Ejecuta el pipeline de varios FCs a la vez (como máximo max_fc simultáneos).
+    Las descargas de todos los FCs comparten el límite global MAX_DESCARGAS_GLOBALES.
+    El fallo de un FC no afecta al resto.
+    
+    :return: Lista de resúmenes (ver ejecutar_fc) en el orden de fcs
+    """
+    # Autenticar con Midway una sola vez antes de lanzar los FCs
+    AmazonRequest().set_mw_cookie()
+    
+    def ejecutar_aislado(fc):
+        inicio = time.time()
+        try:
+            return ejecutar_fc(fc, carpeta_datos_fc(base_folder, fc), args)
+        except Exception as e:
+            print(f"[WARNING] Error en el pipeline de {fc}: {str(e)}", flush=True)
+            traceback.print_exc()
+            return {'fc': fc, 'ok': False, 'avisos': True, 'filas': 0, 'segundos': time.time() - inicio,
+                    'incompletos': []}
+    
+    max_fc = max_fc or MAX_FC_SIMULTANEOS
+    print(f"[Batch] Procesando {len(fcs)} FCs ({', '.join(fcs)}), max {max_fc} simultaneos", flush=True)
+    with ThreadPoolExecutor(max_workers=max_fc) as executor:
+        return list(executor.map(ejecutar_aislado, fcs))
+
+
+def imprimir_resumen_batch(resumenes, segundos_total):
+    """
+    Imprime la tabla resumen del modo batch (estado, filas y tiempo de cada FC, y las piezas que faltan).
+    """
+    print("\n" + "="*50, flush=True)
+    print("Resumen por FC", flush=True)
+    print("="*50, flush=True)
+    print(f"{'FC':<8}{'Estado':<8}{'Filas':>12}{'Tiempo (s)':>14}", flush=True)
+    for resumen in resumenes:
+        estado = "FALLO" if not resumen['ok'] else ("AVISOS" if resumen['avisos'] else "OK")
+        print(f"{resumen['fc']:<8}{estado:<8}{resumen['filas']:>12}{resumen['segundos']:>14.1f}", flush=True)
+    print(f"{'TOTAL':<8}{'':<8}{sum(r['filas'] for r in resumenes):>12}{segundos_total:>14.1f}", flush=True)
+    for resumen in resumenes:
+        if resumen['incompletos']:
+            print(f"[WARNING] {resumen['fc']}: datos incompletos, faltan {', '.join(resumen['incompletos'])}", flush=True)
+    sys.stdout.flush()
+
 
+def guardar_metricas_http(data_folder):
+    """
+    Guarda en data_folder las métricas HTTP agregadas de toda la ejecución (todos los FCs).
+    """
+    try:
+        path = os.path.join(data_folder, HTTP_METRICS_FILE)
+        http_metrics.write(path)
+        totales = http_metrics.summary()['totals']
+        print(f"[HTTP] Métricas guardadas: {path} ({totales['requests']} peticiones, "
+              f"{totales['bytes']} bytes, {totales['retries']} reintentos, {totales['reauths']} reautenticaciones, "
+              f"{totales['kerberos_rounds']} rondas Kerberos)", flush=True)
+    except Exception as e:
+        print(f"[WARNING] No se pudieron guardar las métricas HTTP: {str(e)}", flush=True)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    
+    # Determinar la carpeta de datos al inicio
+    if args.user_data_path:
+        user_data_path = args.user_data_path
+        base_folder = os.path.join(user_data_path, "data", "space-heatmap")
+    else:
+        project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))))
+        base_folder = os.path.join(project_root, "data", "space-heatmap")
+    
+    fcs = list(dict.fromkeys(fc.upper() for fc in args.fc)) if args.fc else [FC_POR_DEFECTO]
+    
+    try:
+        if len(fcs) == 1:
+            resumen = ejecutar_fc(fcs[0], carpeta_datos_fc(base_folder, fcs[0]), args)
+            if not resumen['ok']:
+                sys.exit(1)
+        else:
+            inicio_batch = time.time()
+            resumenes = ejecutar_batch(fcs, base_folder, args, max_fc=args.max_fc)
+            imprimir_resumen_batch(resumenes, time.time() - inicio_batch)
+            if not all(resumen['ok'] for resumen in resumenes):
+                sys.exit(1)
+    finally:
+        if os.path.isdir(base_folder):
+            guardar_metricas_http(base_folder)
@@ -6,11 +6,15 @@ Versión adaptada para la aplicación IB_Scope - Genera SVGs con clases CSS
 """
 
 import pandas as pd
+import numpy as np
 import xml.etree.ElementTree as ET
 import os
 import sys
 import re
 from datetime import datetime
+from stowmap_manifest import cargar_manifest, guardar_manifest, hash_archivo, manifest_valido, pisos_cambiados, marcar_etapa
+from stowmap_snapshot import leer_stowmap
+from Procesar_StowMap import corregir_csv, VERSION_CORRECCIONES
 
 # ============================================
 # CONFIGURACIÓN: MODO DESARROLLO
@@ -32,6 +36,8 @@ SVG_CONFIG = {
     'HRK': True,  # High Rack
     'PL': True,   # Pallet Land
 }
+# FC cuyas plantillas SVG están directamente en assets/svg/Space_Heatmaps
+FC_POR_DEFECTO = 'VLC1'
 
 def obtener_color_fullness(nivel):
     """
@@ -85,182 +91,197 @@ def obtener_clase_fullness(nivel):
     else:
         return "fullness-very-high"
 
-def generar_heatmap_svg(svg_path, csv_path, output_path):
+# Formato de Bay Id de cada tipo de plantilla y su ID en el SVG (re.match: desde el inicio).
+# La letra del MOD se omite en el SVG:
+# - BAY-P-1-B294A200 (MOD B) → P1-294A200, BAY-P-3-C288A460 (MOD C) → P3-288A460
+# - BAY-P-1-A250A200 → HRK-250A200
+# - BAY-PL-B{numero} → PL-{numero}
+PATRONES_BAY_ID = [
+    ('P', re.compile(r'BAY-P-(\d+)-[BC](.+)'), lambda m: f'P{m.group(1)}-{m.group(2)}'),
+    ('HRK', re.compile(r'BAY-P-\d+-A(.+)'), lambda m: f'HRK-{m.group(1)}'),
+    ('PL', re.compile(r'BAY-PL-B(.+)'), lambda m: f'PL-{m.group(1)}'),
+]
+# Áreas especiales: sus plantillas se filtran por storage_area en vez de por piso
+STORAGE_AREA_POR_PLANTILLA = {'HRK': 'High Rack', 'PL': 'Pallet Land'}
+
+def _bay_id_a_svg(bay_id):
     """
-    Genera un heatmap SVG desde un SVG base y datos CSV
-    Agrega clases CSS y atributos data-* para fácil manipulación
+    Tipo de plantilla ('P', 'HRK', 'PL') e ID en el SVG de un Bay Id, o (None, None) si no tiene
+    formato de ninguna plantilla.
     """
-    print(f"[Heatmap] Procesando: {os.path.basename(svg_path)}")
-    
-    # Verificar que existe el SVG
-    if not os.path.exists(svg_path):
-        print(f"[ERROR] SVG no encontrado: {svg_path}")
-        return False
+    if pd.isna(bay_id):
+        return None, None
+    bay_id_str = str(bay_id)
+    for tipo, patron, formato in PATRONES_BAY_ID:
+        match = patron.match(bay_id_str)
+        if match:
+            return tipo, formato(match)
+    return None, None
+
+def _plantilla_de_piso(floor):
+    # Floor 1 (o 1.0) → 'P1'; los pisos no enteros no tienen plantilla
+    if pd.isna(floor) or float(floor) != int(floor):
+        return None
+    return f'P{int(floor)}'
+
+def leer_datos_heatmap(csv_path):
+    """
+    Lee y corrige los datos de fullness para los heatmaps: los datos corregidos que guarda
+    Procesar_StowMap.py si existen; si no, el snapshot columnar o el CSV, que todavía hay que corregir.
     
-    # Verificar que existe el CSV
+    Returns:
+        DataFrame corregido o None si no se pudo leer
+    """
     if not os.path.exists(csv_path):
         print(f"[ERROR] CSV no encontrado: {csv_path}")
-        return False
-    
-    # Leer CSV con datos de fullness
+        return None
     try:
-        df = pd.read_csv(csv_path, low_memory=False)
+        df = leer_stowmap(csv_path, consumidor='heatmap', version_correcciones=VERSION_CORRECCIONES)
         print(f"[Heatmap] CSV leído: {len(df)} registros")
+        if 'correcciones' not in df.attrs:
+            df = corregir_csv(df)
+        return df
     except Exception as e:
         print(f"[ERROR] Error al leer CSV: {e}")
-        return False
-    
+        return None
+
+def preparar_datos_heatmap(df):
+    """
+    Prepara una sola vez los datos de todas las plantillas (P1-P5, HRK, PL): asigna a cada bin su
+    plantilla y su ID de bay en el SVG, y calcula la tabla de agregados por bay con un solo groupby
+    (más el conteo de tipos de bin). Generar cada SVG es después una consulta a un diccionario por
+    elemento, sin volver a filtrar los bins.
+    
+    Args:
+        df: DataFrame corregido (no se modifica)
+        
+    Returns:
+        Diccionario {plantilla: {bay_id_svg: agregados}} o None si faltan columnas. Agregados de cada bay:
+        - fullness: Utilization % medio (bins bloqueadas al 100%)
+        - locked: True si alguna bin está bloqueada; locked_count: número de bins bloqueadas
+        - bins: número de bins
+        - primary: tipo de bin más común (None si no hay Bin Type); all: todos los tipos, del más común al menos común
+    """
     # Verificar columnas necesarias
     if 'Floor' not in df.columns or 'Mod' not in df.columns or 'Utilization %' not in df.columns:
         print("[ERROR] CSV no tiene las columnas necesarias (Floor, Mod, Utilization %)")
-        return False
+        return None
+    
+    # Verificar que existe la columna Bay Id
+    if 'Bay Id' not in df.columns:
+        print("[ERROR] CSV no tiene la columna 'Bay Id'")
+        return None
     
     # Ajustar Utilization % para bins bloqueadas: IsLocked = True → 100%
+    utilization = df['Utilization %']
+    locked_mask = np.zeros(len(df), dtype=bool)
     if 'IsLocked' in df.columns:
-        df['Utilization_Adjusted'] = df['Utilization %'].copy()
-        locked_mask = df['IsLocked'] == True
-        df.loc[locked_mask, 'Utilization_Adjusted'] = 1.0
+        locked_mask = (df['IsLocked'] == True).to_numpy(dtype=bool, na_value=False)
+        utilization = utilization.mask(locked_mask, 1.0)
         print(f"[Heatmap] Ajustadas {locked_mask.sum()} bins bloqueadas a 100%")
-    else:
-        df['Utilization_Adjusted'] = df['Utilization %']
     
-    # Extraer tipo del nombre del SVG (P1, P2, HRK, PL, etc.)
-    svg_name = os.path.basename(svg_path).replace('.svg', '')
+    # Bay Id y Floor se resuelven una vez por valor distinto, no por bin
+    codigos_bay, bay_ids = pd.factorize(df['Bay Id'])
+    destinos = [_bay_id_a_svg(bay_id) for bay_id in bay_ids] + [(None, None)]
+    tipos = np.array([tipo for tipo, _ in destinos], dtype=object)[codigos_bay]
+    svg_bay_ids = np.array([svg_id for _, svg_id in destinos], dtype=object)[codigos_bay]
+    codigos_floor, floors = pd.factorize(df['Floor'])
+    pisos = np.array([_plantilla_de_piso(floor) for floor in floors] + [None], dtype=object)[codigos_floor]
+    
+    # Plantilla de cada bin: su piso si el Bay Id es de piso; HRK / PL si además coincide su storage_area
+    plantillas = np.where(tipos == 'P', pisos, None)
+    if 'storage_area' in df.columns:
+        for plantilla, area in STORAGE_AREA_POR_PLANTILLA.items():
+            en_area = (df['storage_area'] == area).to_numpy(dtype=bool, na_value=False)
+            plantillas[(tipos == plantilla) & en_area] = plantilla
+    elif np.isin(tipos, list(STORAGE_AREA_POR_PLANTILLA)).any():
+        print("[ERROR] CSV no tiene la columna 'storage_area'")
+    
+    validas = pd.notna(plantillas)
+    filas = pd.DataFrame({
+        'Plantilla': plantillas[validas],
+        'SVG_Bay_Id': svg_bay_ids[validas],
+        'Utilization_Adjusted': utilization.to_numpy()[validas],
+        'Locked': locked_mask[validas],
+    })
+    
+    # Tabla de agregados por bay de cada plantilla
+    agregados = filas.groupby(['Plantilla', 'SVG_Bay_Id'], sort=False).agg(
+        fullness=('Utilization_Adjusted', 'mean'),
+        locked_count=('Locked', 'sum'),
+        bins=('Locked', 'size'),
+    )
+    datos = {}
+    for (plantilla, bay_id), fullness, locked_count, bins in zip(
+            agregados.index, agregados['fullness'].tolist(), agregados['locked_count'].tolist(),
+            agregados['bins'].tolist()):
+        datos.setdefault(plantilla, {})[bay_id] = {
+            'fullness': fullness,
+            'locked': locked_count > 0,
+            'locked_count': locked_count,
+            'bins': bins,
+            'primary': None,
+            'all': [],
+        }
+    
+    # Tipos de bin de cada bay (para filtrado), del más común al menos común. Los empates se
+    # deshacen por orden de aparición (como value_counts sobre los tipos como texto)
+    if 'Bin Type' in df.columns:
+        tipos_bin = filas[['Plantilla', 'SVG_Bay_Id']].assign(**{
+            'Bin Type': df['Bin Type'].array[validas],
+            'Orden': np.arange(len(filas)),
+        })
+        conteo = tipos_bin.dropna(subset=['Bin Type']).groupby(
+            ['Plantilla', 'SVG_Bay_Id', 'Bin Type'], sort=False, observed=True)['Orden'].agg(['size', 'min'])
+        conteo = conteo.reset_index().sort_values(['Plantilla', 'SVG_Bay_Id', 'size', 'min'],
+                                                  ascending=[True, True, False, True], kind='stable')
+        for plantilla, bay_id, bin_type in zip(conteo['Plantilla'], conteo['SVG_Bay_Id'], conteo['Bin Type']):
+            bay = datos[plantilla][bay_id]
+            if bay['primary'] is None:
+                bay['primary'] = bin_type
+            bay['all'].append(bin_type)
+    
+    return datos
+
+def generar_heatmap_svg(svg_path, csv_path, output_path, df=None, bays=None):
+    """
+    Genera un heatmap SVG desde un SVG base y datos CSV
+    Agrega clases CSS y atributos data-* para fácil manipulación
     
-    # Verificar que existe la columna Bay Id
-    if 'Bay Id' not in df.columns:
-        print("[ERROR] CSV no tiene la columna 'Bay Id'")
+    Si se indica bays (la tabla de agregados por bay de esta plantilla de preparar_datos_heatmap())
+    no se lee ni se prepara nada; si se indica df (DataFrame ya corregido en memoria) no se lee csv_path.
+    """
+    print(f"[Heatmap] Procesando: {os.path.basename(svg_path)}")
+    
+    # Verificar que existe el SVG
+    if not os.path.exists(svg_path):
+        print(f"[ERROR] SVG no encontrado: {svg_path}")
         return False
     
-    # Determinar si es un piso (P1-P5) o un área de almacenamiento especial (HRK, PL)
-    if svg_name.startswith('P') and len(svg_name) == 2:
-        # Es un piso normal (P1, P2, etc.)
-        piso_num_str = svg_name[1:]
-        piso_num = float(piso_num_str)
-        
-        # Filtrar datos por piso (Floor es float64: 1.0, 2.0, etc.)
-        df_filtrado = df[df['Floor'] == piso_num].copy()
-        if df_filtrado.empty:
-            print(f"[ADVERTENCIA] No hay datos para el piso {piso_num}")
-            return False
-        
-        # Convertir Bay Id al formato del SVG
-        # BAY-P-1-B294A200 → P1-294A200
-        # BAY-P-3-C288A460 → P3-288A460
-        def convertir_bay_id_a_svg(bay_id):
-            """
-            Convierte BAY-P-{floor}-{MOD}{numero} a P{floor}-{numero}
-            Soporta MOD B y MOD C (la letra del MOD se omite en el SVG)
-            Ejemplos:
-            - BAY-P-1-B294A200 → P1-294A200
-            - BAY-P-3-C288A460 → P3-288A460
-            """
-            if pd.isna(bay_id):
-                return None
-            
-            bay_id_str = str(bay_id)
-            # Patrón: BAY-P-{floor}-{MOD}{numero}
-            # MOD puede ser B o C, pero se omite en el formato del SVG
-            # Ejemplos:
-            # - BAY-P-1-B294A200 (MOD B) → P1-294A200
-            # - BAY-P-3-C288A460 (MOD C) → P3-288A460
-            match = re.match(r'BAY-P-(\d+)-[BC](.+)', bay_id_str)
-            if match:
-                floor = match.group(1)
-                resto = match.group(2)  # El resto sin la letra del MOD
-                return f'P{floor}-{resto}'
-            return None
-        
-        # Agregar columna con ID del SVG
-        df_filtrado['SVG_Bay_Id'] = df_filtrado['Bay Id'].apply(convertir_bay_id_a_svg)
-        
-    elif svg_name == 'HRK':
-        # High Rack - filtrar por storage_area
-        if 'storage_area' not in df.columns:
-            print("[ERROR] CSV no tiene la columna 'storage_area'")
-            return False
-        
-        df_filtrado = df[df['storage_area'] == 'High Rack'].copy()
-        if df_filtrado.empty:
-            print(f"[ADVERTENCIA] No hay datos para High Rack")
-            return False
-        
-        # Convertir Bay Id al formato del SVG para HRK
-        # BAY-P-{floor}-A{numero} → HRK-{numero}
-        def convertir_bay_id_a_svg(bay_id):
-            """
-            Convierte BAY-P-{floor}-A{numero} a HRK-{numero}
-            Ejemplo: BAY-P-1-A250A200 → HRK-250A200
-            """
-            if pd.isna(bay_id):
-                return None
-            
-            bay_id_str = str(bay_id)
-            # Patrón: BAY-P-{floor}-A{numero}
-            match = re.match(r'BAY-P-\d+-A(.+)', bay_id_str)
-            if match:
-                resto = match.group(1)
-                return f'HRK-{resto}'
-            return None
-        
-        df_filtrado['SVG_Bay_Id'] = df_filtrado['Bay Id'].apply(convertir_bay_id_a_svg)
-        
-    elif svg_name == 'PL':
-        # Pallet Land - filtrar por storage_area
-        if 'storage_area' not in df.columns:
-            print("[ERROR] CSV no tiene la columna 'storage_area'")
-            return False
-        
-        df_filtrado = df[df['storage_area'] == 'Pallet Land'].copy()
-        if df_filtrado.empty:
-            print(f"[ADVERTENCIA] No hay datos para Pallet Land")
-            return False
-        
-        # Convertir Bay Id al formato del SVG para Pallet Land
-        # BAY-PL-B{numero} → PL-{numero}
-        def convertir_bay_id_a_svg(bay_id):
-            """
-            Convierte BAY-PL-B{numero} a PL-{numero}
-            """
-            if pd.isna(bay_id):
-                return None
-            
-            bay_id_str = str(bay_id)
-            # Patrón: BAY-PL-B{numero}
-            match = re.match(r'BAY-PL-B(.+)', bay_id_str)
-            if match:
-                resto = match.group(1)
-                return f'PL-{resto}'
-            return None
-        
-        df_filtrado['SVG_Bay_Id'] = df_filtrado['Bay Id'].apply(convertir_bay_id_a_svg)
-    else:
+    # Extraer tipo del nombre del SVG (P1, P2, HRK, PL, etc.)
+    svg_name = os.path.basename(svg_path).replace('.svg', '')
+    es_piso = svg_name.startswith('P') and len(svg_name) == 2
+    if not es_piso and svg_name not in STORAGE_AREA_POR_PLANTILLA:
         print(f"[ERROR] Tipo de SVG no reconocido: {svg_name}")
         return False
     
-    # Filtrar solo los que tienen ID válido
-    df_filtrado = df_filtrado[df_filtrado['SVG_Bay_Id'].notna()].copy()
+    if bays is None:
+        if df is not None:
+            print(f"[Heatmap] Datos en memoria: {len(df)} registros")
+        else:
+            df = leer_datos_heatmap(csv_path)
+            if df is None:
+                return False
+        datos_plantillas = preparar_datos_heatmap(df)
+        if datos_plantillas is None:
+            return False
+        bays = datos_plantillas.get(svg_name)
     
-    if df_filtrado.empty:
+    if not bays:
         print(f"[ADVERTENCIA] No hay Bay Ids válidos para {svg_name}")
         return False
     
-    # Agrupar por SVG_Bay_Id y calcular fullness promedio y tipos de bin
-    fullness_por_bay = df_filtrado.groupby('SVG_Bay_Id')['Utilization_Adjusted'].mean().to_dict()
-    
-    # Obtener tipos de bin más comunes por bay (para filtrado)
-    bin_types_por_bay = {}
-    if 'Bin Type' in df_filtrado.columns:
-        for bay_id, group in df_filtrado.groupby('SVG_Bay_Id'):
-            bin_types = group['Bin Type'].value_counts()
-            if not bin_types.empty:
-                # Guardar el tipo más común y todos los tipos únicos
-                bin_types_por_bay[bay_id] = {
-                    'primary': bin_types.index[0],
-                    'all': list(bin_types.index.unique())
-                }
-    
-    print(f"[Heatmap] Fullness calculado para {len(fullness_por_bay)} bays")
+    print(f"[Heatmap] Fullness calculado para {len(bays)} bays")
     
     # Leer SVG como texto para preservar estructura
     try:
@@ -292,18 +313,14 @@ def generar_heatmap_svg(svg_path, csv_path, output_path):
         if not elem_id:
             continue
         
-        # Buscar fullness para este elemento por ID del SVG
+        # Buscar los agregados de este elemento por ID del SVG
         # Los IDs en el SVG son del formato: P1-294A200
-        fullness = None
-        bay_id_svg = None
-        
-        # Buscar directamente en el diccionario
-        if elem_id in fullness_por_bay:
-            fullness = fullness_por_bay[elem_id]
-            bay_id_svg = elem_id
-        else:
+        bay = bays.get(elem_id)
+        if bay is None:
             # Si no coincide exactamente, continuar (no hay datos para este elemento)
             continue
+        bay_id_svg = elem_id
+        fullness = bay['fullness']
         
         if pd.isna(fullness):
             continue
@@ -312,12 +329,8 @@ def generar_heatmap_svg(svg_path, csv_path, output_path):
         color = obtener_color_fullness(fullness)
         clase = obtener_clase_fullness(fullness)
         
-        # Verificar si está bloqueado
-        es_bloqueado = False
-        if 'IsLocked' in df.columns:
-            bay_data = df_filtrado[df_filtrado['SVG_Bay_Id'] == bay_id_svg]
-            if not bay_data.empty and bay_data['IsLocked'].any():
-                es_bloqueado = True
+        # Bloqueado si alguna de sus bins lo está
+        es_bloqueado = bay['locked']
         
         # Agregar clases CSS
         clases_existentes = elem.get('class', '').split()
@@ -332,10 +345,9 @@ def generar_heatmap_svg(svg_path, csv_path, output_path):
         elem.set('data-bay-id', str(bay_id_svg))
         
         # Agregar información de tipos de bin si está disponible
-        if bay_id_svg in bin_types_por_bay:
-            bin_info = bin_types_por_bay[bay_id_svg]
-            elem.set('data-bin-type-primary', bin_info['primary'])
-            elem.set('data-bin-types', ','.join(bin_info['all']))
+        if bay['all']:
+            elem.set('data-bin-type-primary', bay['primary'])
+            elem.set('data-bin-types', ','.join(bay['all']))
         
         if es_bloqueado:
             elem.set('data-locked', 'true')
@@ -411,12 +423,20 @@ def generar_heatmap_svg(svg_path, csv_path, output_path):
         print(f"[ERROR] Error al guardar SVG: {e}")
         return False
 
-def main():
+def _pisos_de_svg(svg_name):
     """
-    Función principal
+    Pisos de los que depende un heatmap: P1-P5 solo de su piso; HRK y PL de todos
+    (se filtran por storage_area, que puede aparecer en cualquier piso).
+    """
+    if svg_name.startswith('P') and len(svg_name) == 2:
+        return [svg_name[1:]]
+    return None
+
+def _buscar_directorio_svgs():
+    """
+    Busca el directorio de plantillas SVG (assets/svg/Space_Heatmaps) en desarrollo y en build.
+    Si no existe ninguna ruta devuelve la primera candidata (para mostrar el error).
     """
-    print("[Heatmap] Iniciando generacion de Heatmaps SVG...")
-    
     script_path = os.path.abspath(__file__)
     
     # Lista de posibles rutas para buscar los SVGs (en orden de prioridad)
@@ -460,23 +480,28 @@ def main():
         svg_dir = posibles_rutas_svg[0]
         print(f"[ADVERTENCIA] No se encontró el directorio de SVGs. Buscando en: {svg_dir}")
     
-    # Determinar rutas según configuración
-    if MODO_DEV:
-        data_dir = os.path.join(project_root, "Ejemplos", "data", "space-heatmap")
-        output_dir = os.path.join(data_dir, "heatmaps")
-        csv_path = os.path.join(data_dir, "Stowmap_data.csv")
-        print(f"[MODO DEV] Procesando desde Ejemplos/data/space-heatmap/")
-    elif len(sys.argv) > 1:
-        user_data_path = sys.argv[1]
-        data_dir = os.path.join(user_data_path, "data", "space-heatmap")
-        output_dir = os.path.join(data_dir, "heatmaps")
-        csv_path = os.path.join(data_dir, "Stowmap_data.csv")
-        print(f"[MODO BUILD] Procesando desde userData")
-    else:
-        data_dir = os.path.join(project_root, "data", "space-heatmap")
-        output_dir = os.path.join(data_dir, "heatmaps")
-        csv_path = os.path.join(data_dir, "Stowmap_data.csv")
-        print(f"[MODO DESARROLLO] Procesando desde proyecto")
+    return svg_dir
+
+def generar_heatmaps(data_dir, forzar=False, df=None, fc=FC_POR_DEFECTO):
+    """
+    Genera todos los heatmaps habilitados en SVG_CONFIG para una carpeta de datos.
+    
+    Args:
+        data_dir: Carpeta de datos (contiene Stowmap_data.csv; los SVG se escriben en heatmaps/)
+        forzar: Si True, ignora el manifest y regenera todos los heatmaps
+        df: DataFrame ya corregido en memoria (opcional). Si se indica no se lee el CSV; si no,
+            el CSV se lee una sola vez para todos los heatmaps.
+        fc: Código del FC. Las plantillas de FC_POR_DEFECTO están en Space_Heatmaps/;
+            las de cualquier otro FC en una subcarpeta con su código (ej: Space_Heatmaps/MAD4/)
+        
+    Returns:
+        Lista de tuplas (nombre_svg, exito) o None si no hay SVGs que procesar
+    """
+    output_dir = os.path.join(data_dir, "heatmaps")
+    csv_path = os.path.join(data_dir, "Stowmap_data.csv")
+    svg_dir = _buscar_directorio_svgs()
+    if fc.upper() != FC_POR_DEFECTO:
+        svg_dir = os.path.join(svg_dir, fc.upper())
     
     print(f"[Heatmap] CSV input: {csv_path}")
     print(f"[Heatmap] SVG templates: {svg_dir}")
@@ -491,7 +516,15 @@ def main():
     if not os.path.exists(svg_dir):
         print(f"[ADVERTENCIA] ADVERTENCIA: Directorio de SVGs no encontrado: {svg_dir}")
         print(f"   Crea el directorio y coloca los SVGs (P1.svg, P2.svg, etc.) allí")
-        return
+        return None
+    
+    # Refresco incremental: solo se regeneran los heatmaps cuyos pisos o cuya plantilla SVG cambiaron
+    manifest = cargar_manifest(data_dir)
+    usar_manifest = manifest_valido(manifest, csv_path)
+    omitidos = 0
+    
+    # Datos de todas las plantillas: se leen y se preparan una sola vez, la primera vez que hacen falta
+    datos_plantillas = None
     
     # Procesar cada SVG habilitado
     resultados = []
@@ -508,19 +541,49 @@ def main():
         
         svgs_encontrados = True
         output_path = os.path.join(output_dir, f"{svg_name}_heatmap.svg")
+        etapa = f"heatmap_{svg_name}"
+        pisos_svg = _pisos_de_svg(svg_name)
+        # El heatmap también depende de su plantilla SVG
+        hash_plantilla = hash_archivo(svg_path)
+        plantilla_igual = manifest.get('etapas', {}).get(f"{etapa}_plantilla") == hash_plantilla
+        
+        if (usar_manifest and not forzar and os.path.exists(output_path) and plantilla_igual
+                and not pisos_cambiados(manifest, etapa, pisos_svg)):
+            print(f"[Heatmap] [Delta] {svg_name}: sin cambios, se conserva {os.path.basename(output_path)}")
+            resultados.append((svg_name, True))
+            omitidos += 1
+            continue
         
-        resultado = generar_heatmap_svg(svg_path, csv_path, output_path)
+        if datos_plantillas is None:
+            if df is None:
+                df = leer_datos_heatmap(csv_path)
+            else:
+                print(f"[Heatmap] Datos en memoria: {len(df)} registros")
+            datos_plantillas = (preparar_datos_heatmap(df) if df is not None else None) or {}
+        
+        resultado = generar_heatmap_svg(svg_path, csv_path, output_path, bays=datos_plantillas.get(svg_name, {}))
         resultados.append((svg_name, resultado))
+        if resultado and usar_manifest:
+            marcar_etapa(manifest, etapa, pisos_svg)
+            manifest['etapas'][f"{etapa}_plantilla"] = hash_plantilla
     
     if not svgs_encontrados:
         print(f"\n⚠️ No se encontraron SVGs para procesar en: {svg_dir}")
         print(f"   Asegúrate de tener los archivos SVG (P1.svg, P2.svg, etc.) en ese directorio")
-        return
+        return None
     
     # Resumen
     exitosos = sum(1 for _, exito in resultados if exito)
     total = len(resultados)
     
+    if usar_manifest:
+        # 'heatmaps' resume la etapa completa: solo se marca si todos se generaron bien
+        if exitosos == total:
+            marcar_etapa(manifest, 'heatmaps')
+        guardar_manifest(data_dir, manifest)
+    if omitidos:
+        print(f"[Heatmap] [Delta] {omitidos} heatmaps sin cambios reutilizados")
+    
     print(f"\n[OK] Heatmaps SVG generados: {exitosos}/{total}")
     print(f"[INFO] Archivos creados en: {output_dir}")
     print(f"\n[INFO] Los SVGs generados incluyen:")
@@ -533,6 +596,37 @@ def main():
         for nombre, exito in resultados:
             estado = "OK" if exito else "FALLO"
             print(f"   {nombre}_heatmap.svg: {estado}")
+    
+    return resultados
+
+def main():
+    """
+    Función principal (envoltorio de línea de comandos de generar_heatmaps)
+    
+    Argumentos: [userData] [--full]
+    Con --full se regeneran todos los heatmaps aunque el manifest indique que sus pisos no cambiaron.
+    """
+    print("[Heatmap] Iniciando generacion de Heatmaps SVG...")
+    
+    forzar = '--full' in sys.argv[1:]
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    
+    script_path = os.path.abspath(__file__)
+    project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(script_path))))))
+    
+    # Determinar rutas según configuración
+    if MODO_DEV:
+        data_dir = os.path.join(project_root, "Ejemplos", "data", "space-heatmap")
+        print(f"[MODO DEV] Procesando desde Ejemplos/data/space-heatmap/")
+    elif argumentos:
+        user_data_path = argumentos[0]
+        data_dir = os.path.join(user_data_path, "data", "space-heatmap")
+        print(f"[MODO BUILD] Procesando desde userData")
+    else:
+        data_dir = os.path.join(project_root, "data", "space-heatmap")
+        print(f"[MODO DESARROLLO] Procesando desde proyecto")
+    
+    generar_heatmaps(data_dir, forzar=forzar)
 
 if __name__ == "__main__":
     main()
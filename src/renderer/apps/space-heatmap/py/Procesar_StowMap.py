@@ -1,9 +1,16 @@
 import pandas as pd
+import numpy as np
 import json
 import os
 import sys
+import time
 import platform
 from datetime import datetime
+from stowmap_manifest import cargar_manifest, guardar_manifest, hash_archivo, firma_csv, manifest_valido, pisos_cambiados, marcar_etapa
+from stowmap_snapshot import leer_stowmap, guardar_snapshot, corregido_vigente
+from esquema_stowmap import leer_csv_por_bloques, maximo_columna
+from indice_bins import IndiceBitmap
+from progreso import escribir_json_atomico
 
 # Configurar encoding UTF-8 para stdout/stderr en Windows
 # Usar método compatible con versiones anteriores de Python
@@ -25,122 +32,219 @@ if platform.system() == 'Windows':
         pass
 
 # ============================================
-# CONFIGURACIÓN: GUARDAR CSV CORREGIDO
+# CONFIGURACIÓN: GUARDAR DATOS CORREGIDOS
 # ============================================
-# Cambiar a True para sobrescribir el CSV original con las correcciones aplicadas
-# Cambiar a False para solo corregir en memoria (más rápido, no guarda cambios en el archivo)
-GUARDAR_CSV_CORREGIDO = True
+# True: guardar el dataset corregido una sola vez junto al CSV (Stowmap_data.corregido.*, con su
+# manifiesto de correcciones); los siguientes procesamientos y los heatmaps lo leen sin corregir de nuevo
+# False: corregir siempre en memoria
+GUARDAR_DATOS_CORREGIDOS = True
+# Cambiar a True para sobrescribir además el CSV original con las correcciones aplicadas
+# (exportación para humanos: duplica la escritura y el CSV pasa a tener las columnas añadidas)
+GUARDAR_CSV_CORREGIDO = False
 
-def corregir_csv(df):
+# Versión de las correcciones de corregir_csv(): cambiarla cuando cambien las correcciones para que
+# los datos corregidos guardados con la versión anterior se ignoren y se vuelvan a corregir
+VERSION_CORRECCIONES = 2
+
+# ============================================
+# CONFIGURACIÓN: PROCESAMIENTO POR BLOQUES
+# ============================================
+# Filas por bloque para procesar el CSV por bloques con memoria acotada (varios FC, reprocesado
+# de históricos). 0 = cargar todo el CSV en memoria. También con --bloques=N en la línea de comandos.
+FILAS_POR_BLOQUE = 0
+
+
+def _sin_log(*args, **kwargs):
+    pass
+
+
+# Área de almacenamiento de cada Mod (los Mods que no aparecen aquí quedan sin área)
+STORAGE_AREA_POR_MOD = {'A': 'High Rack', 'F': 'Pallet Land', 'B': 'Pick Tower', 'C': 'Pick Tower'}
+STORAGE_AREAS = ['High Rack', 'Pallet Land', 'Pick Tower']
+
+
+def _eliminar_filas_vacias(df, correcciones, log):
+    # Filas donde todas las columnas son NaN/vacías (entre cambios de piso)
+    vacias = df.isna().all(axis=1).to_numpy()
+    removed_count = int(vacias.sum())
+    correcciones['filas_vacias_eliminadas'] = removed_count
+    if removed_count > 0:
+        log(f"[OK] Eliminadas {removed_count} filas completamente vacías")
+        return df[~vacias]
+    log("[OK] No se encontraron filas completamente vacías")
+    return df
+
+
+def _escalar_utilization(df, correcciones, log):
+    # Si el máximo es > 1, Utilization % viene como porcentaje entero (48.00) y se pasa a decimal (0.48).
+    # NOTA: Utilization % se mantiene como dato original, NO se usa en cálculos automáticos
+    # NO aplicar corrección de PALLET-SINGLE aquí (mantener dato original)
+    if 'Utilization %' not in df.columns:
+        log("[ERROR] No se encontro la columna 'Utilization %'")
+        return None
+    max_util = correcciones.get('max_utilization')
+    if max_util is None:
+        max_util = df['Utilization %'].max()
+        max_util = None if pd.isna(max_util) else float(max_util)
+    porcentaje = max_util is not None and max_util > 1
+    correcciones['max_utilization'] = max_util
+    correcciones['escala_utilization'] = 'porcentaje' if porcentaje else 'decimal'
+    correcciones['utilization_a_decimales'] = porcentaje
+    if not porcentaje:
+        log("[OK] Utilization % ya está en formato decimal (se mantiene como dato original)")
+        return df
+    log(f"[Correccion] Convirtiendo Utilization % de enteros a decimales (max encontrado: {max_util})...")
+    df = df.assign(**{'Utilization %': df['Utilization %'] / 100.0})
+    log("[OK] Utilization % convertido a decimales (0-1) - se mantiene como dato original")
+    return df
+
+
+def _calcular_fullness(df, correcciones, log):
+    # Fullness es la columna PRINCIPAL que se usa en TODOS los cálculos automáticos:
+    # Utilization % en decimales, con PALLET-SINGLE > 0 → 1.0 (una sola asignación con máscara)
+    utilization = df['Utilization %']
+    fullness = utilization.to_numpy(dtype=utilization.dtype if utilization.dtype.kind == 'f' else float,
+                                    na_value=np.nan)
+    if 'Bin Type' not in df.columns:
+        log("[ADVERTENCIA] No se encontro la columna 'Bin Type'")
+        return df.assign(Fullness=fullness)
+    
+    pallet_single_mask = (df['Bin Type'] == 'PALLET-SINGLE').to_numpy(dtype=bool, na_value=False)
+    pallet_single_count = int(pallet_single_mask.sum())
+    if pallet_single_count == 0:
+        log("[OK] No se encontraron registros PALLET-SINGLE")
+        return df.assign(Fullness=fullness)
+    
+    # Mantener 0 (y los nulos) si ya es 0
+    pallet_single_with_util = pallet_single_mask & (fullness > 0)
+    corrected_count = int(pallet_single_with_util.sum())
+    correcciones['pallet_single_a_lleno'] = corrected_count
+    if corrected_count > 0:
+        fullness = np.where(pallet_single_with_util, 1.0, fullness)
+        log(f"[OK] Corregidos {corrected_count} registros PALLET-SINGLE en Fullness (cambiados a 1.0)")
+    else:
+        log(f"[OK] {pallet_single_count} registros PALLET-SINGLE encontrados, todos con Fullness = 0")
+    return df.assign(Fullness=fullness)
+
+
+def _asignar_storage_area(df, correcciones, log):
+    # Se resuelve una vez por valor distinto de Mod (unas pocas letras), no por fila
+    codigos, mods = pd.factorize(df['Mod'])
+    categoria = {area: i for i, area in enumerate(STORAGE_AREAS)}
+    # Código de categoría de cada Mod distinto; el último (-1) es el de los Mods nulos (codigos == -1)
+    areas = np.array([categoria.get(STORAGE_AREA_POR_MOD.get(str(mod).upper()), -1) for mod in mods] + [-1],
+                     dtype=np.int8)[codigos]
+    storage_area_count = int((areas >= 0).sum())
+    correcciones['storage_area_asignadas'] = storage_area_count
+    log(f"[OK] Columna storage_area creada ({storage_area_count} registros con área asignada)")
+    storage_area = pd.Categorical.from_codes(areas, categories=STORAGE_AREAS)
+    return df.assign(storage_area=pd.Series(storage_area, index=df.index))
+
+
+def _calcular_sufijo_bin_id(df, correcciones, log):
+    # Sufijo numérico del Bin Id (P-1-B293B212 → 212), calculado una sola vez aquí en lugar de
+    # en cada regla bin_id_endswith_ranges / bin_id_exclude_patterns
+    if 'Bin Id' not in df.columns:
+        return df
+    df = df.assign(**{'Bin Id Suffix': sufijo_bin_id(df['Bin Id'])})
+    log(f"[OK] Columna Bin Id Suffix creada ({df['Bin Id Suffix'].notna().sum()} registros con sufijo numérico)")
+    return df
+
+
+# Plan de correcciones de corregir_csv(): (nombre, paso) en orden. Cada paso recibe el DataFrame,
+# el manifiesto de correcciones y la función de log, devuelve el DataFrame con sus columnas
+# (transformaciones vectorizadas, sin modificar el de entrada) o None si no se puede seguir.
+# Todos son idempotentes: aplicados a datos ya corregidos no cambian nada.
+PLAN_CORRECCIONES = [
+    ('filas_vacias', _eliminar_filas_vacias),
+    ('escala_utilization', _escalar_utilization),
+    ('fullness', _calcular_fullness),
+    ('storage_area', _asignar_storage_area),
+    ('bin_id_suffix', _calcular_sufijo_bin_id),
+]
+
+
+def corregir_csv(df, max_util=None, silencioso=False):
     """
-    Corrige el DataFrame del CSV antes de procesarlo.
+    Corrige el DataFrame del CSV antes de procesarlo, aplicando los pasos de PLAN_CORRECCIONES.
     
     Correcciones:
     1. Elimina filas completamente vacías (entre cambios de piso)
     2. Convierte Utilization % de valores enteros (48.00) a decimales (0.48) - se mantiene como dato original
+       La escala detectada queda en el manifiesto ('escala_utilization': 'porcentaje' o 'decimal')
     3. Crea columna Fullness: Utilization % en decimales CON corrección de PALLET-SINGLE (si > 0 → 1.0)
        NOTA: Fullness es la columna PRINCIPAL que se usa en todos los cálculos automáticos
        Utilization % solo se mantiene como dato original y se usa solo cuando se indique explícitamente
-    4. Crea columna storage_area basada en MOD (A=High Rack, F=Pallet Land, B/C=Pick Tower)
+    4. Crea columna storage_area (categórica) basada en MOD (A=High Rack, F=Pallet Land, B/C=Pick Tower)
+    5. Crea columna Bin Id Suffix: últimos 3 dígitos del Bin Id como entero (para las reglas por rango de Bin Id)
+    
+    Lo que se ha cambiado y el tiempo de cada paso quedan en df.attrs['correcciones'] (manifiesto de
+    correcciones, con VERSION_CORRECCIONES). Si df ya trae ese manifiesto con la versión actual
+    (datos corregidos guardados), no se vuelve a corregir.
     
     Args:
-        df: DataFrame de pandas con los datos del CSV
+        df: DataFrame de pandas con los datos del CSV (no se modifica)
+        max_util: Máximo de Utilization % de todo el dataset (procesamiento por bloques: la escala
+                  se decide con el máximo global, no con el de cada bloque). None = máximo de df
+        silencioso: Si True, no se muestran los mensajes de cada corrección
         
     Returns:
         DataFrame corregido
     """
-    print("[Correccion] Aplicando correcciones al CSV...")
-    
-    # 0. Eliminar filas completamente vacías (entre cambios de piso)
-    initial_count = len(df)
-    # Eliminar filas donde todas las columnas son NaN/vacías
-    df = df.dropna(how='all')
-    removed_count = initial_count - len(df)
-    if removed_count > 0:
-        print(f"[OK] Eliminadas {removed_count} filas completamente vacías")
-    else:
-        print("[OK] No se encontraron filas completamente vacías")
-    
-    # Verificar que existe la columna Utilization %
-    if 'Utilization %' not in df.columns:
-        print("[ERROR] No se encontro la columna 'Utilization %'")
+    log = _sin_log if silencioso else print
+    previas = df.attrs.get('correcciones')
+    if previas and previas.get('version') == VERSION_CORRECCIONES:
+        log(f"[Correccion] Datos ya corregidos (versión {VERSION_CORRECCIONES}): se omiten las correcciones")
         return df
-    
-    # 1. Corregir Utilization %: convertir de enteros (48.00) a decimales (0.48)
-    # Si los valores son > 1, significa que están como porcentajes enteros
-    # NOTA: Utilization % se mantiene como dato original, NO se usa en cálculos automáticos
-    # NO aplicar corrección de PALLET-SINGLE aquí (mantener dato original)
-    max_util = df['Utilization %'].max()
-    if not pd.isna(max_util) and max_util > 1:
-        print(f"[Correccion] Convirtiendo Utilization % de enteros a decimales (max encontrado: {max_util})...")
-        df.loc[:, 'Utilization %'] = df['Utilization %'] / 100.0
-        print("[OK] Utilization % convertido a decimales (0-1) - se mantiene como dato original")
-    else:
-        print("[OK] Utilization % ya está en formato decimal (se mantiene como dato original)")
-    
-    # 2. Crear columna Fullness: copia de Utilization % en decimales
-    # Fullness es la columna PRINCIPAL que se usa en TODOS los cálculos automáticos
-    # AQUÍ sí aplicar corrección de PALLET-SINGLE (si > 0 → 1.0)
-    # Usar .copy() explícitamente para evitar SettingWithCopyWarning
-    df = df.copy()
-    df['Fullness'] = df['Utilization %'].copy()
-    
-    if 'Bin Type' in df.columns:
-        pallet_single_mask = df['Bin Type'] == 'PALLET-SINGLE'
-        pallet_single_count = pallet_single_mask.sum()
-        
-        if pallet_single_count > 0:
-            # Para PALLET-SINGLE, si Fullness > 0, cambiar a 1.0
-            # Mantener 0 si ya es 0
-            pallet_single_with_util = pallet_single_mask & (df['Fullness'] > 0)
-            corrected_count = pallet_single_with_util.sum()
-            
-            if corrected_count > 0:
-                df.loc[pallet_single_with_util, 'Fullness'] = 1.0
-                print(f"[OK] Corregidos {corrected_count} registros PALLET-SINGLE en Fullness (cambiados a 1.0)")
-            else:
-                print(f"[OK] {pallet_single_count} registros PALLET-SINGLE encontrados, todos con Fullness = 0")
-        else:
-            print("[OK] No se encontraron registros PALLET-SINGLE")
-    else:
-        print("[ADVERTENCIA] No se encontro la columna 'Bin Type'")
-    
-    # 3. Crear columna storage_area basada en MOD
-    def get_storage_area(mod):
-        if pd.isna(mod):
-            return None
-        mod_str = str(mod).upper()
-        if mod_str == 'A':
-            return 'High Rack'
-        elif mod_str == 'F':
-            return 'Pallet Land'
-        elif mod_str in ['B', 'C']:
-            return 'Pick Tower'
-        return None
-    
-    df['storage_area'] = df['Mod'].apply(get_storage_area)
-    storage_area_count = df['storage_area'].notna().sum()
-    print(f"[OK] Columna storage_area creada ({storage_area_count} registros con área asignada)")
-    
-    print("[OK] Correcciones aplicadas correctamente")
+    log("[Correccion] Aplicando correcciones al CSV...")
+    correcciones = {'version': VERSION_CORRECCIONES}
+    if max_util is not None and not pd.isna(max_util):
+        correcciones['max_utilization'] = float(max_util)
+    
+    tiempos = {}
+    for nombre, paso in PLAN_CORRECCIONES:
+        inicio = time.perf_counter()
+        corregido = paso(df, correcciones, log)
+        tiempos[nombre] = round((time.perf_counter() - inicio) * 1000, 1)
+        if corregido is None:
+            return df
+        df = corregido
+    correcciones['tiempos_ms'] = tiempos
+    
+    log(f"[OK] Correcciones aplicadas correctamente ({sum(tiempos.values()):.0f} ms: "
+        + ", ".join(f"{nombre} {ms:.0f} ms" for nombre, ms in tiempos.items()) + ")")
+    df.attrs['correcciones'] = correcciones
     return df
 
 
-def aplicar_filtros_avanzados(df, filtros, zonas_reglas_dict=None):
+def sufijo_bin_id(bin_ids):
     """
-    Aplica filtros avanzados al DataFrame.
-    Soporta ambos formatos: simple (con 'filtros' nested) y avanzado (filtros directos).
+    Últimos 3 dígitos de cada Bin Id como entero nullable (NA si el Bin Id no termina en 3 dígitos).
     
     Args:
-        df: DataFrame a filtrar
-        filtros: Diccionario con los filtros a aplicar
-        zonas_reglas_dict: Diccionario con las reglas de Zonas_reglas.json para resolver referencias 'zone'
+        bin_ids: Serie con los Bin Id
         
     Returns:
-        DataFrame filtrado
+        Serie Int16
     """
-    df_filtrado = df.copy()
+    # Últimos 3 caracteres y comprobación de dígitos (mismo resultado que la regex (\d{3})$, sin regex)
+    sufijos = bin_ids.astype(str).str[-3:]
+    validos = (sufijos.str.len() == 3) & sufijos.str.isdecimal()
+    return pd.to_numeric(sufijos.where(validos), errors='coerce').astype('Int16')
+
+
+def _resolver_filtros(filtros, zonas_reglas_dict=None):
+    """
+    Normaliza los filtros de una zona: extrae la clave 'filtros' (formato simple) y
+    sustituye las referencias 'zone' por los filtros de Zonas_reglas.json.
     
+    Args:
+        filtros: Diccionario con los filtros de la zona
+        zonas_reglas_dict: Diccionario con las reglas de Zonas_reglas.json para resolver referencias 'zone'
+        
+    Returns:
+        Diccionario de filtros efectivos
+    """
     # Si los filtros están dentro de una clave 'filtros', extraerlos
     if 'filtros' in filtros:
         filtros = filtros['filtros']
@@ -171,173 +275,337 @@ def aplicar_filtros_avanzados(df, filtros, zonas_reglas_dict=None):
         filtros = {k: v for k, v in filtros.items() if k != 'zone'}
         filtros.update(filtros_combinados)
     
-    # Filtrar por storage_area (puede ser string o lista)
-    if 'storage_area' in filtros:
-        areas = filtros['storage_area']
-        if isinstance(areas, str):
-            areas = [areas]
-        if 'Storage_Area' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['Storage_Area'].isin(areas)]
-        elif 'storage_area' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['storage_area'].isin(areas)]
-    
-    # Filtrar por bin_type (puede ser string o lista)
-    if 'bin_type' in filtros:
-        tipos = filtros['bin_type']
-        if isinstance(tipos, str):
-            tipos = [tipos]
-        if 'Bin Type' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['Bin Type'].isin(tipos)]
-    
-    # Filtrar por floor (puede ser int, string, o lista)
-    if 'floor' in filtros:
-        pisos = filtros['floor']
-        if isinstance(pisos, (int, str)):
-            pisos = [int(pisos)]
-        else:
-            pisos = [int(p) for p in pisos]
-        if 'Floor' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['Floor'].isin(pisos)]
-    
-    # Filtrar por aisle_range [min, max]
-    if 'aisle_range' in filtros:
-        aisle_range = filtros['aisle_range']
-        if isinstance(aisle_range, list) and len(aisle_range) == 2:
-            min_aisle, max_aisle = aisle_range
-            if 'Aisle' in df_filtrado.columns:
-                df_filtrado = df_filtrado[(df_filtrado['Aisle'] >= min_aisle) & (df_filtrado['Aisle'] <= max_aisle)]
-    
-    # Excluir rango de aisle
-    if 'aisle_exclude_range' in filtros:
-        aisle_exclude = filtros['aisle_exclude_range']
-        if isinstance(aisle_exclude, list) and len(aisle_exclude) == 2:
-            min_aisle, max_aisle = aisle_exclude
-            if 'Aisle' in df_filtrado.columns:
-                df_filtrado = df_filtrado[~((df_filtrado['Aisle'] >= min_aisle) & (df_filtrado['Aisle'] <= max_aisle))]
-    
-    # Filtrar por aisle específico (puede ser int o lista)
-    if 'aisle' in filtros:
-        aisles = filtros['aisle']
-        if isinstance(aisles, (int, float)):
+    return filtros
+
+
+def _pisos_de_filtros(filtros, zonas_reglas_dict=None):
+    """
+    Devuelve los pisos (como str) a los que se limita una zona, o None si la zona
+    puede incluir bins de cualquier piso. Se usa para el recálculo incremental.
+    """
+    filtros = _resolver_filtros(filtros, zonas_reglas_dict)
+    if 'floor' not in filtros:
+        return None
+    pisos = filtros['floor']
+    if isinstance(pisos, (int, str)):
+        pisos = [pisos]
+    return {str(int(p)) for p in pisos}
+
+
+def _como_lista(valor):
+    return [valor] if isinstance(valor, str) else valor
+
+
+def _rangos_validos(rangos):
+    return tuple((r[0], r[1]) for r in rangos if isinstance(r, list) and len(r) == 2)
+
+
+class MotorReglas:
+    """
+    Motor de reglas de zonas compilado sobre un DataFrame.
+    
+    Cada filtro de zona se compila a una lista de predicados (floor=1, storage_area='Pick Tower',
+    aisle en [201, 210]...). Cada predicado distinto se evalúa una sola vez como bitset sobre el
+    índice de bitmaps del dataset (indice_bins.IndiceBitmap) y se memoriza, de modo que las zonas
+    que comparten filtros (mismo piso, misma área, mismo drop_zone_exclude) reutilizan sus bitsets.
+    Una zona es un AND / OR / ANDNOT de bitsets, su número de bins un popcount, y el resto de
+    métricas se calculan con la máscara desempaquetada sobre columnas NumPy, sin copiar el DataFrame.
+    
+    El resultado es el mismo que filtrar el DataFrame paso a paso: todos los filtros son por
+    fila, así que la zona es el AND de sus predicados.
+    """
+    
+    def __init__(self, df):
+        self.df = df
+        self.columnas = set(df.columns)
+        self.indice = IndiceBitmap(df)
+        self._mascaras = {}
+        self._columnas_np = {}
+        self.evaluados = 0
+        self.reutilizados = 0
+    
+    # ---------- Compilación ----------
+    
+    def compilar(self, filtros, zonas_reglas_dict=None, nombre=None):
+        """
+        Compila los filtros de una zona (ambos formatos, con referencias 'zone') a una tupla de predicados.
+        
+        Raises:
+            ValueError: si algún filtro tiene un valor no válido (indica la zona y el filtro)
+        """
+        filtros = _resolver_filtros(filtros, zonas_reglas_dict)
+        predicados = []
+        # Cada filtro se compila por separado para poder indicar cuál tiene un valor no válido
+        for clave, valor in filtros.items():
+            try:
+                for predicado in self._predicados({clave: valor}):
+                    # Los predicados se memorizan por valor: todos sus valores tienen que ser hashables
+                    hash(predicado)
+                    predicados.append(predicado)
+            except (TypeError, ValueError) as e:
+                zona = f"Zona {nombre}" if nombre else "Zona"
+                raise ValueError(f"{zona}: valor no válido en el filtro '{clave}': {str(e)}") from e
+        return tuple(predicados)
+    
+    def _predicados(self, filtros):
+        # Genera los predicados de los filtros que aplican a las columnas del dataset
+        cols = self.columnas
+        
+        if 'storage_area' in filtros:
+            columna = 'Storage_Area' if 'Storage_Area' in cols else 'storage_area' if 'storage_area' in cols else None
+            if columna:
+                yield ('isin', columna, frozenset(_como_lista(filtros['storage_area'])))
+        
+        if 'bin_type' in filtros and 'Bin Type' in cols:
+            yield ('isin', 'Bin Type', frozenset(_como_lista(filtros['bin_type'])))
+        
+        if 'floor' in filtros and 'Floor' in cols:
+            pisos = filtros['floor']
+            pisos = [int(pisos)] if isinstance(pisos, (int, str)) else [int(p) for p in pisos]
+            yield ('isin', 'Floor', frozenset(pisos))
+        
+        if 'aisle_range' in filtros and 'Aisle' in cols:
+            rango = filtros['aisle_range']
+            if isinstance(rango, list) and len(rango) == 2:
+                yield ('entre', 'Aisle', rango[0], rango[1])
+        
+        if 'aisle_exclude_range' in filtros and 'Aisle' in cols:
+            rango = filtros['aisle_exclude_range']
+            if isinstance(rango, list) and len(rango) == 2:
+                yield ('no', ('entre', 'Aisle', rango[0], rango[1]))
+        
+        if 'aisle' in filtros and 'Aisle' in cols:
+            yield self._predicado_aisle(filtros['aisle'])
+        
+        if 'drop_zone' in filtros and 'Dropzone' in cols:
+            yield ('isin', 'Dropzone', frozenset(_como_lista(filtros['drop_zone'])))
+        
+        if 'drop_zone_exclude' in filtros and 'Dropzone' in cols:
+            yield ('no', ('isin', 'Dropzone', frozenset(_como_lista(filtros['drop_zone_exclude']))))
+        
+        if 'shelf' in filtros and 'Shelf' in cols:
+            yield ('isin', 'Shelf', frozenset(_como_lista(filtros['shelf'])))
+        
+        if 'warehouse_id' in filtros:
+            # Columna que pueda contener el warehouse ('Warehouse Id', 'Warehouse_ID', 'FC'...)
+            warehouse_cols = [col for col in self.df.columns if 'warehouse' in col.lower() or 'fc' in col.lower()]
+            if warehouse_cols:
+                yield ('igual', warehouse_cols[0], filtros['warehouse_id'])
+        
+        if 'bin_id_endswith_ranges' in filtros and 'Bin Id' in cols:
+            yield ('sufijo', _rangos_validos(filtros['bin_id_endswith_ranges']))
+        
+        if 'bin_id_exclude_patterns' in filtros and 'Bin Id' in cols:
+            patrones = []
+            for pattern in filtros['bin_id_exclude_patterns']:
+                partes = []
+                if 'aisle' in pattern and 'Aisle' in cols:
+                    partes.append(self._predicado_aisle(pattern['aisle']))
+                if 'bin_type' in pattern and 'Bin Type' in cols:
+                    partes.append(('isin', 'Bin Type', frozenset(_como_lista(pattern['bin_type']))))
+                if 'endswith_range' in pattern:
+                    partes.append(('sufijo', _rangos_validos(pattern['endswith_range'])))
+                patrones.append(('y', tuple(partes)))
+            yield ('no', ('o', tuple(patrones)))
+        
+        if 'exclude_categories' in filtros:
+            # Columna que pueda contener categorías/zonas ('Zona', 'Category', 'Categoria'...)
+            category_cols = [col for col in self.df.columns if 'zona' in col.lower() or 'categor' in col.lower()]
+            if category_cols:
+                yield ('no', ('isin', category_cols[0], frozenset(_como_lista(filtros['exclude_categories']))))
+        
+        # total_site: no añade ningún filtro (incluye todo lo que dejen pasar los anteriores)
+    
+    @staticmethod
+    def _predicado_aisle(aisles):
+        # Un pasillo suelto (206, 206.0 o "206") es una lista de un solo pasillo
+        if isinstance(aisles, (int, float, str)):
             aisles = [int(aisles)]
         elif isinstance(aisles, list):
             aisles = [int(a) for a in aisles]
-        if 'Aisle' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['Aisle'].isin(aisles)]
-    
-    # Filtrar por drop_zone (puede ser string o lista)
-    if 'drop_zone' in filtros:
-        drop_zones = filtros['drop_zone']
-        if isinstance(drop_zones, str):
-            drop_zones = [drop_zones]
-        if 'Dropzone' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['Dropzone'].isin(drop_zones)]
-    
-    # Excluir drop_zone
-    if 'drop_zone_exclude' in filtros:
-        drop_zones_exclude = filtros['drop_zone_exclude']
-        if isinstance(drop_zones_exclude, str):
-            drop_zones_exclude = [drop_zones_exclude]
-        if 'Dropzone' in df_filtrado.columns:
-            df_filtrado = df_filtrado[~df_filtrado['Dropzone'].isin(drop_zones_exclude)]
-    
-    # Filtrar por shelf
-    if 'shelf' in filtros:
-        shelf = filtros['shelf']
-        if isinstance(shelf, str):
-            shelf = [shelf]
-        if 'Shelf' in df_filtrado.columns:
-            df_filtrado = df_filtrado[df_filtrado['Shelf'].isin(shelf)]
-    
-    # Filtrar por warehouse_id (si existe la columna)
-    if 'warehouse_id' in filtros:
-        warehouse = filtros['warehouse_id']
-        # Buscar columna que pueda contener warehouse_id
-        # Puede ser 'Warehouse Id', 'Warehouse_ID', 'Warehouse', etc.
-        warehouse_cols = [col for col in df_filtrado.columns if 'warehouse' in col.lower() or 'fc' in col.lower()]
-        if warehouse_cols:
-            df_filtrado = df_filtrado[df_filtrado[warehouse_cols[0]] == warehouse]
-    
-    # Filtrar por bin_id_endswith_ranges (rangos de finales de bin_id)
-    if 'bin_id_endswith_ranges' in filtros:
-        ranges = filtros['bin_id_endswith_ranges']
-        if 'Bin Id' in df_filtrado.columns:
-            mask = pd.Series([False] * len(df_filtrado), index=df_filtrado.index)
-            for range_pair in ranges:
-                if isinstance(range_pair, list) and len(range_pair) == 2:
-                    min_val, max_val = range_pair
-                    # Extraer los últimos dígitos del Bin Id y verificar si están en el rango
-                    bin_id_str = df_filtrado['Bin Id'].astype(str)
-                    # Intentar extraer los últimos 3 dígitos
-                    last_digits = bin_id_str.str.extract(r'(\d{3})$')[0].astype(float)
-                    mask |= ((last_digits >= min_val) & (last_digits <= max_val))
-            df_filtrado = df_filtrado[mask]
-    
-    # Filtrar por bin_id_exclude_patterns (patrones complejos de exclusión)
-    if 'bin_id_exclude_patterns' in filtros:
-        patterns = filtros['bin_id_exclude_patterns']
-        if 'Bin Id' in df_filtrado.columns:
-            indices_a_excluir = set()
-            for pattern in patterns:
-                pattern_df = df_filtrado.copy()
-                
-                # Aplicar filtros del patrón
-                if 'aisle' in pattern:
-                    aisles = pattern['aisle']
-                    if isinstance(aisles, (int, float)):
-                        aisles = [int(aisles)]
-                    elif isinstance(aisles, list):
-                        aisles = [int(a) for a in aisles]
-                    if 'Aisle' in pattern_df.columns:
-                        pattern_df = pattern_df[pattern_df['Aisle'].isin(aisles)]
-                
-                if 'bin_type' in pattern:
-                    tipos = pattern['bin_type']
-                    if isinstance(tipos, str):
-                        tipos = [tipos]
-                    if 'Bin Type' in pattern_df.columns:
-                        pattern_df = pattern_df[pattern_df['Bin Type'].isin(tipos)]
-                
-                # Aplicar endswith_range
-                if 'endswith_range' in pattern:
-                    ranges = pattern['endswith_range']
-                    pattern_mask = pd.Series([False] * len(pattern_df), index=pattern_df.index)
-                    for range_pair in ranges:
-                        if isinstance(range_pair, list) and len(range_pair) == 2:
-                            min_val, max_val = range_pair
-                            bin_id_str = pattern_df['Bin Id'].astype(str)
-                            last_digits = bin_id_str.str.extract(r'(\d{3})$')[0].astype(float)
-                            pattern_mask |= ((last_digits >= min_val) & (last_digits <= max_val))
-                    pattern_df = pattern_df[pattern_mask]
-                
-                # Agregar índices a excluir
-                indices_a_excluir.update(pattern_df.index.tolist())
-            
-            # Excluir estos registros
-            if indices_a_excluir:
-                df_filtrado = df_filtrado[~df_filtrado.index.isin(indices_a_excluir)]
-    
-    # Filtrar por exclude_categories (excluir zonas/categorías específicas)
-    # Esto requiere una columna 'Zona' o similar en el CSV
-    if 'exclude_categories' in filtros:
-        categories_exclude = filtros['exclude_categories']
-        if isinstance(categories_exclude, str):
-            categories_exclude = [categories_exclude]
-        # Buscar columna que pueda contener categorías/zonas
-        # Puede ser 'Zona', 'Category', 'Categoria', etc.
-        category_cols = [col for col in df_filtrado.columns if 'zona' in col.lower() or 'categor' in col.lower()]
-        if category_cols:
-            df_filtrado = df_filtrado[~df_filtrado[category_cols[0]].isin(categories_exclude)]
-    
-    # total_site: si es true, no filtrar (incluir todo)
-    if filtros.get('total_site') == True:
-        # Ya no aplicar más filtros, solo los que ya se aplicaron (warehouse_id, etc.)
-        pass
+        return ('isin', 'Aisle', frozenset(aisles))
+    
+    # ---------- Evaluación ----------
+    
+    def bits(self, predicados):
+        """
+        Bitset (empaquetado) de las filas que cumplen todos los predicados, memorizado.
+        """
+        return self._evaluar(('y', tuple(predicados)))
+    
+    def mascara(self, predicados):
+        """
+        Máscara booleana (NumPy) de las filas que cumplen todos los predicados.
+        """
+        return self.indice.a_mascara(self.bits(predicados))
+    
+    def _evaluar(self, predicado):
+        bits = self._mascaras.get(predicado)
+        if bits is not None:
+            self.reutilizados += 1
+            return bits
+        
+        indice = self.indice
+        tipo = predicado[0]
+        if tipo == 'y':
+            bits = indice.lleno()
+            for parte in predicado[1]:
+                bits = bits & self._evaluar(parte)
+        elif tipo == 'o':
+            bits = indice.vacio()
+            for parte in predicado[1]:
+                bits = bits | self._evaluar(parte)
+        elif tipo == 'no':
+            bits = indice.negar(self._evaluar(predicado[1]))
+        elif tipo == 'isin':
+            bits = indice.en(predicado[1], predicado[2])
+        elif tipo == 'entre':
+            bits = indice.entre(predicado[1], predicado[2], predicado[3])
+        elif tipo == 'igual':
+            bits = indice.desde_mascara(_a_bool(self.df[predicado[1]] == predicado[2]))
+        elif tipo == 'sufijo':
+            # Tabla de los 1000 sufijos posibles (+1 para "sin sufijo"): todos los rangos en una sola indexación
+            tabla = np.zeros(1001, dtype=bool)
+            valores = np.arange(1000)
+            for minimo, maximo in predicado[1]:
+                tabla[:1000] |= (valores >= minimo) & (valores <= maximo)
+            bits = indice.desde_mascara(tabla[self._sufijos_bin_id()])
+        else:
+            raise ValueError(f"Predicado desconocido: {predicado!r}")
+        
+        self.evaluados += 1
+        self._mascaras[predicado] = bits
+        return bits
+    
+    def _sufijos_bin_id(self):
+        # Sufijo del Bin Id como índice 0-999 (1000 = sin sufijo), desde la columna de corregir_csv
+        if 'sufijos' not in self._columnas_np:
+            if 'Bin Id Suffix' in self.columnas:
+                sufijos = self.df['Bin Id Suffix']
+            else:
+                sufijos = sufijo_bin_id(self.df['Bin Id'])
+            sufijos = sufijos.to_numpy(dtype=float, na_value=np.nan)
+            self._columnas_np['sufijos'] = np.where(np.isnan(sufijos), 1000, sufijos).astype(np.intp)
+        return self._columnas_np['sufijos']
+    
+    # ---------- Métricas ----------
+    
+    def _columna_np(self, nombre):
+        if nombre not in self._columnas_np:
+            df = self.df
+            if nombre == 'fullness':
+                valores = df['Fullness_Adjusted'].to_numpy(dtype=float, na_value=np.nan)
+            elif nombre in ('ocupadas', 'vacias', 'bloqueadas'):
+                # Bitsets de las métricas de conteo: se cruzan con la zona y se cuentan con popcount
+                if nombre == 'bloqueadas':
+                    mascara = _a_bool(df['IsLocked'] == True)
+                else:
+                    fullness = self._columna_np('fullness')
+                    mascara = fullness > 0 if nombre == 'ocupadas' else fullness == 0
+                valores = self.indice.desde_mascara(mascara)
+            else:
+                unidades = df['Total Units']
+                if pd.api.types.is_integer_dtype(unidades.dtype) and not unidades.hasnans:
+                    valores = unidades.to_numpy(dtype=np.int64)
+                else:
+                    valores = unidades.to_numpy(dtype=float, na_value=np.nan)
+                    valores = np.where(np.isnan(valores), 0.0, valores)
+            self._columnas_np[nombre] = valores
+        return self._columnas_np[nombre]
+    
+    def metricas(self, bits, metricas):
+        """
+        Calcula las métricas de una zona sobre las filas del bitset.
+        """
+        return finalizar_metricas(self.parciales(bits, metricas), metricas)
+    
+    def parciales(self, bits, metricas):
+        """
+        Agregados sumables de una zona (sumas y conteos): los de varios bloques del CSV se combinan
+        con sumar_parciales() y finalizar_metricas() los convierte en las métricas de la zona.
+        Los conteos son popcounts; solo fullness y total_units desempaquetan la máscara.
+        """
+        contar = self.indice.contar
+        parciales = {'total_bins': contar(bits)}
+        mascara = self.indice.a_mascara(bits) if 'fullness' in metricas or 'total_units' in metricas else None
+        
+        if 'fullness' in metricas:
+            fullness = self._columna_np('fullness')[mascara]
+            validos = ~np.isnan(fullness)
+            # Misma suma que Series.mean(): NaN como 0 y división entre los valores válidos
+            parciales['suma_fullness'] = float(np.where(validos, fullness, 0.0).sum())
+            parciales['n_fullness'] = int(validos.sum())
+        
+        if 'occupied_bins' in metricas:
+            parciales['occupied_bins'] = contar(bits & self._columna_np('ocupadas'))
+        
+        if 'empty_bins' in metricas:
+            parciales['empty_bins'] = contar(bits & self._columna_np('vacias'))
+        
+        if 'locked_bins' in metricas:
+            parciales['locked_bins'] = contar(bits & self._columna_np('bloqueadas'))
+        
+        if 'total_units' in metricas:
+            parciales['total_units'] = self._columna_np('units')[mascara].sum().item()
+        
+        return parciales
+
+
+def sumar_parciales(acumulado, parciales):
+    """
+    Suma los agregados parciales de una zona (MotorReglas.parciales) a los acumulados.
+    """
+    if acumulado is None:
+        return dict(parciales)
+    for clave, valor in parciales.items():
+        acumulado[clave] = acumulado.get(clave, 0) + valor
+    return acumulado
+
+
+def finalizar_metricas(parciales, metricas):
+    """
+    Convierte los agregados parciales de una zona en sus métricas.
+    """
+    datos = {}
+    
+    if 'fullness' in metricas:
+        n_validos = parciales['n_fullness']
+        avg_fullness = parciales['suma_fullness'] / n_validos if n_validos else np.nan
+        datos['fullness'] = round(float(avg_fullness), 4) if not pd.isna(avg_fullness) else 0.0
+    
+    for metrica in ('total_bins', 'occupied_bins', 'empty_bins', 'locked_bins', 'total_units'):
+        if metrica in metricas:
+            datos[metrica] = int(parciales[metrica])
+    
+    return datos
+
+
+def _a_bool(serie):
+    # Los valores nulos (p.ej. en columnas nullable) no cumplen el predicado
+    return serie.to_numpy(dtype=bool, na_value=False)
+
+
+def aplicar_filtros_avanzados(df, filtros, zonas_reglas_dict=None, motor=None):
+    """
+    Aplica filtros avanzados al DataFrame.
+    Soporta ambos formatos: simple (con 'filtros' nested) y avanzado (filtros directos).
     
-    return df_filtrado
+    Args:
+        df: DataFrame a filtrar
+        filtros: Diccionario con los filtros a aplicar
+        zonas_reglas_dict: Diccionario con las reglas de Zonas_reglas.json para resolver referencias 'zone'
+        motor: MotorReglas de df a reutilizar (con sus máscaras memorizadas), opcional
+        
+    Returns:
+        DataFrame filtrado
+    """
+    if motor is None:
+        motor = MotorReglas(df)
+    return df[motor.mascara(motor.compilar(filtros, zonas_reglas_dict))]
 
 
-def procesar_zonas(df, reglas_path, output_dir=None, metricas_default=None, guardar_archivo=False, zonas_reglas_dict=None):
+def procesar_zonas(df, reglas_path, output_dir=None, metricas_default=None, guardar_archivo=False, zonas_reglas_dict=None,
+                   zonas_previas=None, pisos_modificados=None):
     """
     Procesa las zonas según las reglas definidas en el JSON.
     Soporta dos formatos:
@@ -351,104 +619,54 @@ def procesar_zonas(df, reglas_path, output_dir=None, metricas_default=None, guar
         metricas_default: Lista de métricas por defecto si no se especifican (default: ['fullness'])
         guardar_archivo: Si True, guarda el archivo JSON (default: False)
         zonas_reglas_dict: Diccionario con las reglas de Zonas_reglas.json para resolver referencias 'zone'
+        zonas_previas: Resultado anterior (Data_Fullness.json) para el recálculo incremental (opcional)
+        pisos_modificados: Pisos (str) cuyo contenido cambió; las zonas limitadas a otros pisos
+                           reutilizan su resultado de zonas_previas
     
     Returns:
         Diccionario con las zonas procesadas
     """
     print("[Zonas] Procesando zonas según reglas...")
     
-    # Leer reglas de zonas
-    if not os.path.exists(reglas_path):
-        print(f"[ADVERTENCIA] No se encontro el archivo de reglas: {reglas_path}")
+    reglas = _cargar_reglas_zonas(reglas_path)
+    if reglas is None:
         return None
     
-    with open(reglas_path, 'r', encoding='utf-8-sig') as f:
-        reglas = json.load(f)
-    
-    print(f"[Zonas] Cargadas {len(reglas)} zonas desde {reglas_path}")
-    
     # Asegurar que Fullness_Adjusted existe
     if 'Fullness_Adjusted' not in df.columns:
         df['Fullness_Adjusted'] = df['Fullness'].copy()
         locked_mask = df['IsLocked'] == True
         df.loc[locked_mask, 'Fullness_Adjusted'] = 1.0
     
-    zonas_procesadas = {}
-    
     if metricas_default is None:
         metricas_default = ['fullness']
+    zonas = _zonas_de_reglas(reglas, metricas_default)
+    reutilizadas = _zonas_reutilizables(zonas, zonas_reglas_dict, zonas_previas, pisos_modificados)
     
-    # Procesar cada zona
-    for zona_id, zona_config in reglas.items():
-        # Detectar formato: simple (tiene 'nombre' y 'filtros') o avanzado (filtros directos)
-        if 'nombre' in zona_config:
-            # Formato simple
-            nombre = zona_config.get('nombre', zona_id)
-            filtros = zona_config.get('filtros', {})
-            metricas = zona_config.get('metricas', metricas_default)
-        else:
-            # Formato avanzado: usar zona_id como nombre, filtros son directos
-            nombre = zona_id
-            filtros = zona_config
-            metricas = metricas_default  # Por defecto solo fullness
+    # Reglas compiladas a bitsets; los predicados compartidos entre zonas se evalúan una vez
+    motor = MotorReglas(df)
+    zonas_procesadas = {}
+    for zona_id, nombre, filtros, metricas in zonas:
+        if zona_id in reutilizadas:
+            zonas_procesadas[zona_id] = zonas_previas[zona_id]
+            continue
         
         print(f"[Zonas] Procesando zona: {nombre}")
         
-        # Aplicar filtros (soporta ambos formatos)
+        # Compilar filtros (soporta ambos formatos)
         # Pasar zonas_reglas_dict para resolver referencias 'zone'
-        df_filtrado = aplicar_filtros_avanzados(df, filtros, zonas_reglas_dict)
-        
-        if len(df_filtrado) == 0:
-            print(f"[Zonas] [ADVERTENCIA] Zona {nombre}: No hay datos que coincidan con los filtros")
-            zonas_procesadas[zona_id] = {
-                'nombre': nombre,
-                'datos': {}
-            }
-            continue
-        
-        # Calcular métricas solicitadas
-        datos_zona = {}
-        
-        # Si no hay métricas especificadas, usar las por defecto
-        if len(metricas) == 0:
-            metricas = metricas_default
-        
-        if 'fullness' in metricas:
-            avg_fullness = df_filtrado['Fullness_Adjusted'].mean()
-            datos_zona['fullness'] = round(float(avg_fullness), 4) if not pd.isna(avg_fullness) else 0.0
-        
-        if 'total_bins' in metricas:
-            datos_zona['total_bins'] = int(len(df_filtrado))
-        
-        if 'occupied_bins' in metricas:
-            occupied = len(df_filtrado[df_filtrado['Fullness_Adjusted'] > 0])
-            datos_zona['occupied_bins'] = int(occupied)
-        
-        if 'empty_bins' in metricas:
-            empty = len(df_filtrado[df_filtrado['Fullness_Adjusted'] == 0])
-            datos_zona['empty_bins'] = int(empty)
-        
-        if 'locked_bins' in metricas:
-            locked = int(df_filtrado['IsLocked'].sum())
-            datos_zona['locked_bins'] = locked
-        
-        if 'total_units' in metricas:
-            total_units = int(df_filtrado['Total Units'].sum())
-            datos_zona['total_units'] = total_units
-        
-        zonas_procesadas[zona_id] = {
-            'nombre': nombre,
-            'datos': datos_zona
-        }
-        
-        print(f"[Zonas] [OK] {nombre}: {len(df_filtrado)} registros, {len(datos_zona)} metricas calculadas")
+        bits = motor.bits(motor.compilar(filtros, zonas_reglas_dict, nombre))
+        zonas_procesadas[zona_id] = _resultado_zona(nombre, motor.parciales(bits, metricas), metricas)
+    
+    print(f"[Zonas] Motor de reglas: {motor.evaluados} máscaras calculadas, {motor.reutilizados} reutilizadas")
+    if reutilizadas:
+        print(f"[Zonas] [Delta] {len(reutilizadas)} zonas sin cambios reutilizadas del procesamiento anterior")
     
     # Guardar JSON de zonas procesadas solo si se solicita
     if guardar_archivo and output_dir:
         try:
             output_file = os.path.join(output_dir, 'Data_Fullness.json')
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(zonas_procesadas, f, indent=2, ensure_ascii=False)
+            escribir_json_atomico(output_file, zonas_procesadas, indent=2, ensure_ascii=False)
             print(f"[OK] Data_Fullness.json generado: {output_file}")
         except Exception as e:
             print(f"[ERROR] No se pudo guardar Data_Fullness.json en procesar_zonas: {str(e)}")
@@ -457,70 +675,84 @@ def procesar_zonas(df, reglas_path, output_dir=None, metricas_default=None, guar
     return zonas_procesadas
 
 
-def procesar_stowmap(csv_path, output_dir):
+def _cargar_reglas_zonas(reglas_path):
     """
-    Procesa el CSV de StowMap: limpia los datos y genera fullness por bintype.
-    
-    NOTA: Todos los cálculos usan la columna Fullness (no Utilization %).
-    Utilization % se mantiene como dato original y solo se usa cuando se indique explícitamente.
-    
-    Args:
-        csv_path: Ruta al archivo CSV de StowMap
-        output_dir: Directorio donde guardar el JSON procesado
+    Lee un archivo de reglas de zonas (None si no existe).
     """
-    print(f"[Procesamiento] Leyendo CSV desde: {csv_path}")
-    
-    # Leer CSV original
-    df = pd.read_csv(csv_path, low_memory=False)
-    print(f"[Procesamiento] Total de registros: {len(df)}")
-    
-    # Corregir el CSV antes de procesarlo
-    df = corregir_csv(df)
+    if not os.path.exists(reglas_path):
+        print(f"[ADVERTENCIA] No se encontro el archivo de reglas: {reglas_path}")
+        return None
     
-    # Sobrescribir CSV original si está habilitado
-    if GUARDAR_CSV_CORREGIDO:
-        try:
-            # Asegurar que el directorio del CSV existe
-            csv_dir = os.path.dirname(csv_path)
-            if csv_dir and not os.path.exists(csv_dir):
-                os.makedirs(csv_dir, exist_ok=True)
-                print(f"[Procesamiento] Directorio del CSV creado: {csv_dir}")
-            
-            # Guardar CSV corregido
-            df.to_csv(csv_path, index=False)
-            print(f"[OK] CSV corregido sobrescrito en: {csv_path}")
-            
-            # Verificar que el archivo se guardó correctamente
-            if os.path.exists(csv_path):
-                file_size = os.path.getsize(csv_path)
-                print(f"[OK] Archivo verificado: {file_size} bytes")
-            else:
-                print(f"[ERROR] El archivo no se guardó correctamente: {csv_path}")
-        except PermissionError as e:
-            print(f"[ERROR] Sin permisos para escribir en: {csv_path}")
-            print(f"[ERROR] Detalle: {str(e)}")
-        except Exception as e:
-            print(f"[ERROR] Error al guardar CSV corregido: {str(e)}")
-            import traceback
-            traceback.print_exc()
+    with open(reglas_path, 'r', encoding='utf-8-sig') as f:
+        reglas = json.load(f)
     
-    # Crear directorio de salida si no existe
-    try:
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
-            print(f"[Procesamiento] Directorio creado: {output_dir}")
+    print(f"[Zonas] Cargadas {len(reglas)} zonas desde {reglas_path}")
+    return reglas
+
+
+def _zonas_de_reglas(reglas, metricas_default):
+    """
+    Lista de zonas (zona_id, nombre, filtros, metricas) de un archivo de reglas.
+    Soporta el formato simple (con 'nombre', 'filtros', 'metricas') y el avanzado (filtros directos).
+    """
+    zonas = []
+    for zona_id, zona_config in reglas.items():
+        # Detectar formato: simple (tiene 'nombre' y 'filtros') o avanzado (filtros directos)
+        if 'nombre' in zona_config:
+            # Formato simple
+            nombre = zona_config.get('nombre', zona_id)
+            filtros = zona_config.get('filtros', {})
+            metricas = zona_config.get('metricas', metricas_default)
         else:
-            print(f"[Procesamiento] Directorio de salida existe: {output_dir}")
-    except Exception as e:
-        print(f"[ERROR] No se pudo crear el directorio de salida: {output_dir}")
-        print(f"[ERROR] Detalle: {str(e)}")
-        raise
-    
-    # ============================================
-    # FULLNESS POR BINTYPE (por Floor y Storage Area)
-    # ============================================
-    print("[Procesamiento] Calculando fullness por bintype (Floor + Storage Area)...")
+            # Formato avanzado: usar zona_id como nombre, filtros son directos
+            nombre = zona_id
+            filtros = zona_config
+            metricas = metricas_default  # Por defecto solo fullness
+        
+        # Si no hay métricas especificadas, usar las por defecto
+        if len(metricas) == 0:
+            metricas = metricas_default
+        zonas.append((zona_id, nombre, filtros, metricas))
+    return zonas
+
+
+def _zonas_reutilizables(zonas, zonas_reglas_dict, zonas_previas, pisos_modificados):
+    """
+    Recálculo incremental: zonas que solo incluyen pisos sin cambios y cuyo resultado anterior se reutiliza.
+    """
+    reutilizables = set()
+    if zonas_previas is None or pisos_modificados is None:
+        return reutilizables
+    for zona_id, _nombre, filtros, _metricas in zonas:
+        if zona_id in zonas_previas:
+            pisos_zona = _pisos_de_filtros(filtros, zonas_reglas_dict)
+            if pisos_zona is not None and not (pisos_zona & pisos_modificados):
+                reutilizables.add(zona_id)
+    return reutilizables
+
+
+def _resultado_zona(nombre, parciales, metricas):
+    """
+    Entrada de Data_Fullness.json de una zona a partir de sus agregados parciales.
+    """
+    total_registros = parciales['total_bins']
+    if total_registros == 0:
+        print(f"[Zonas] [ADVERTENCIA] Zona {nombre}: No hay datos que coincidan con los filtros")
+        return {'nombre': nombre, 'datos': {}}
+    
+    # Calcular métricas solicitadas
+    datos_zona = finalizar_metricas(parciales, metricas)
+    print(f"[Zonas] [OK] {nombre}: {total_registros} registros, {len(datos_zona)} metricas calculadas")
+    return {'nombre': nombre, 'datos': datos_zona}
+
+
+def _agregar_columnas_calculo(df):
+    """
+    Añade a df las columnas de cálculo Storage_Area y Fullness_Adjusted.
     
+    Returns:
+        Máscara de las bins bloqueadas
+    """
     # La columna storage_area ya fue creada en corregir_csv()
     # Crear también Storage_Area (con mayúscula) para compatibilidad con código existente
     df['Storage_Area'] = df['storage_area']
@@ -531,93 +763,238 @@ def procesar_stowmap(csv_path, output_dir):
     df['Fullness_Adjusted'] = df['Fullness'].copy()
     locked_mask = df['IsLocked'] == True
     df.loc[locked_mask, 'Fullness_Adjusted'] = 1.0
-    print(f"[Info] Ajustadas {locked_mask.sum()} bins bloqueadas a 100% de fullness (usando columna Fullness)")
+    return locked_mask
+
+
+def _cubo_parcial(df, locked_mask):
+    """
+    Cubo Floor x Storage Area x Bin Type con agregados sumables (sumas y conteos) de df.
+    """
+    # Una sola pasada de groupby (solo las columnas necesarias)
+    return pd.DataFrame({
+        'Floor': df['Floor'],
+        'Storage_Area': df['Storage_Area'],
+        'Bin Type': df['Bin Type'],
+        'fullness': df['Fullness_Adjusted'],
+        'locked': locked_mask,
+        'occupied': df['Fullness_Adjusted'] > 0,
+        'units': df['Total Units'],
+    }).groupby(['Floor', 'Storage_Area', 'Bin Type'], sort=True, observed=True).agg(
+        total_bins=('fullness', 'size'),
+        suma_fullness=('fullness', 'sum'),
+        n_fullness=('fullness', 'count'),
+        locked_bins=('locked', 'sum'),
+        occupied_bins=('occupied', 'sum'),
+        total_units=('units', 'sum'),
+    )
+
+
+def _sumar_cubos(acumulado, parcial):
+    """
+    Combina dos cubos parciales (_cubo_parcial) sumando las celdas comunes.
+    """
+    if acumulado is None:
+        return parcial
+    # Las categorías de cada bloque son distintas: las claves se combinan como valores
+    return pd.concat([acumulado, parcial]).groupby(level=[0, 1, 2], sort=True).sum()
+
+
+def _finalizar_cubo(cubo):
+    """
+    Media de fullness de cada celda del cubo (misma media que groupby().mean(): sin contar NaN).
+    """
+    cubo = cubo.copy()
+    cubo['avg_fullness'] = cubo['suma_fullness'] / cubo['n_fullness']
+    # Pick Tower ya agrupa los mods B y C (storage_area de corregir_csv)
+    return cubo[cubo.index.get_level_values('Storage_Area').isin(['High Rack', 'Pallet Land', 'Pick Tower'])]
+
+
+def _kpis_parciales(df):
+    """
+    Agregados sumables de los KPIs generales de df (necesita Fullness_Adjusted).
+    """
+    fullness = df['Fullness_Adjusted'].to_numpy(dtype=float, na_value=np.nan)
+    validos = ~np.isnan(fullness)
+    return {
+        'total_bins': len(df),
+        # Misma suma que Series.mean(): NaN como 0 y división entre los valores válidos
+        'suma_fullness': float(np.where(validos, fullness, 0.0).sum()),
+        'n_fullness': int(validos.sum()),
+        'total_occupied_bins': int((fullness > 0).sum()),
+        'total_locked_bins': int(df['IsLocked'].sum()),
+        'total_units': float(df['Total Units'].sum()),
+    }
+
+
+class AgregadosPorBloques:
+    """
+    Agregados de procesar_stowmap() acumulados bloque a bloque (procesamiento por bloques del CSV).
     
-    fullness_by_bintype = {}
+    De cada bloque corregido se guardan solo agregados sumables: el cubo Floor x Storage Area x
+    Bin Type, los KPIs generales y los parciales de cada zona (MotorReglas.parciales). Al final se
+    finalizan con las mismas funciones que el procesamiento en memoria, así que el resultado es
+    el mismo que con todo el dataset cargado.
+    """
     
-    # Agrupar por Floor → Storage Area → Bin Type
-    for floor in sorted(df['Floor'].dropna().unique()):
-        floor_data = df[df['Floor'] == floor]
-        floor_int = int(floor)
-        fullness_by_bintype[floor_int] = {}
+    def __init__(self, zonas, zonas_reglas_dict, reutilizadas):
+        self.zonas = zonas
+        self.zonas_reglas_dict = zonas_reglas_dict
+        self.reutilizadas = reutilizadas
+        self.bloques = 0
+        self.filas = 0
+        self.bloqueadas = 0
+        self.pisos = set()
+        self.cubo = None
+        self.kpis = None
+        self.parciales_zonas = {}
+        self.evaluados = 0
+        self.reutilizados = 0
+    
+    def agregar(self, df):
+        """
+        Acumula los agregados de un bloque ya corregido con corregir_csv().
+        """
+        locked_mask = _agregar_columnas_calculo(df)
+        self.bloques += 1
+        self.filas += len(df)
+        self.bloqueadas += int(locked_mask.sum())
+        self.pisos.update(int(piso) for piso in df['Floor'].dropna().unique())
+        self.cubo = _sumar_cubos(self.cubo, _cubo_parcial(df, locked_mask))
+        self.kpis = sumar_parciales(self.kpis, _kpis_parciales(df))
         
-        # Agrupar por Storage Area
-        for storage_area in ['High Rack', 'Pallet Land', 'Pick Tower']:
-            # Para Pick Tower, combinar B y C
-            if storage_area == 'Pick Tower':
-                area_data = floor_data[floor_data['Storage_Area'] == 'Pick Tower']
-            else:
-                area_data = floor_data[floor_data['Storage_Area'] == storage_area]
-            
-            if len(area_data) == 0:
+        motor = MotorReglas(df)
+        for zona_id, nombre, filtros, metricas in self.zonas:
+            if zona_id in self.reutilizadas:
                 continue
-            
-            fullness_by_bintype[floor_int][storage_area] = {}
-            
-            # Agrupar por Bin Type
-            for bintype in sorted(area_data['Bin Type'].dropna().unique()):
-                bintype_data = area_data[area_data['Bin Type'] == bintype]
-                total_bins = len(bintype_data)
-                
-                if total_bins == 0:
-                    continue
-                
-                # Calcular fullness promedio usando Fullness_Adjusted
-                avg_fullness = bintype_data['Fullness_Adjusted'].mean()
-                
-                # Contar bins bloqueadas
-                locked_bins = int(bintype_data['IsLocked'].sum())
-                
-                # Estadísticas adicionales
-                occupied_bins = len(bintype_data[bintype_data['Fullness_Adjusted'] > 0])
-                empty_bins = total_bins - occupied_bins
-                total_units = bintype_data['Total Units'].sum()
-                
-                fullness_by_bintype[floor_int][storage_area][str(bintype)] = {
-                    'total_bins': int(total_bins),
-                    'avg_fullness': round(float(avg_fullness), 4) if not pd.isna(avg_fullness) else 0.0,
-                    'locked_bins': locked_bins,
-                    'occupied_bins': int(occupied_bins),
-                    'empty_bins': int(empty_bins),
-                    'total_units': int(total_units)
-                }
+            bits = motor.bits(motor.compilar(filtros, self.zonas_reglas_dict, nombre))
+            self.parciales_zonas[zona_id] = sumar_parciales(self.parciales_zonas.get(zona_id),
+                                                            motor.parciales(bits, metricas))
+        self.evaluados += motor.evaluados
+        self.reutilizados += motor.reutilizados
+    
+    def resultado_zonas(self, zonas_previas):
+        """
+        Data_Fullness.json de las zonas, en el orden de las reglas (igual que procesar_zonas()).
+        """
+        zonas_procesadas = {}
+        for zona_id, nombre, _filtros, metricas in self.zonas:
+            if zona_id in self.reutilizadas:
+                zonas_procesadas[zona_id] = zonas_previas[zona_id]
+                continue
+            print(f"[Zonas] Procesando zona: {nombre}")
+            parciales = self.parciales_zonas.get(zona_id, {'total_bins': 0})
+            zonas_procesadas[zona_id] = _resultado_zona(nombre, parciales, metricas)
+        
+        print(f"[Zonas] Motor de reglas: {self.evaluados} máscaras calculadas, {self.reutilizados} reutilizadas "
+              f"({self.bloques} bloques)")
+        if self.reutilizadas:
+            print(f"[Zonas] [Delta] {len(self.reutilizadas)} zonas sin cambios reutilizadas del procesamiento anterior")
+        return zonas_procesadas
+
+
+def _procesar_por_bloques(csv_path, filas_por_bloque, agregados):
+    """
+    Lee el CSV por bloques, corrige cada bloque y acumula sus agregados en 'agregados'.
+    Si GUARDAR_CSV_CORREGIDO, los bloques corregidos se escriben en un CSV temporal que
+    sustituye al original al terminar.
+    """
+    # Pre-pasada: la escala de Utilization % (enteros o decimales) se decide con el máximo de
+    # todo el CSV, no con el de cada bloque
+    max_util = maximo_columna(csv_path, 'Utilization %', filas_por_bloque)
+    if max_util is not None and max_util > 1:
+        print(f"[Bloques] Utilization % en enteros (max encontrado: {max_util}): se convierte a decimales")
+    
+    tmp_path = csv_path + ".tmp" if GUARDAR_CSV_CORREGIDO else None
+    # Si se sobrescribe el CSV corregido hay que leer todas las columnas para no perder ninguna
+    consumidor = None if GUARDAR_CSV_CORREGIDO else 'procesar'
+    try:
+        for bloque in leer_csv_por_bloques(csv_path, filas_por_bloque, consumidor):
+            bloque = corregir_csv(bloque, max_util=max_util, silencioso=True)
+            if tmp_path is not None:
+                try:
+                    bloque.to_csv(tmp_path, index=False, header=agregados.bloques == 0,
+                                  mode='w' if agregados.bloques == 0 else 'a')
+                except OSError as e:
+                    print(f"[ERROR] Error al guardar CSV corregido: {str(e)}")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    tmp_path = None
+            agregados.agregar(bloque)
+        
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.replace(tmp_path, csv_path)
+            print(f"[OK] CSV corregido sobrescrito en: {csv_path} ({os.path.getsize(csv_path)} bytes)")
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    if agregados.bloques == 0:
+        raise ValueError(f"[ERROR] El CSV no tiene registros: {csv_path}")
+    print(f"[Bloques] {agregados.filas} registros procesados en {agregados.bloques} bloques de hasta {filas_por_bloque} filas")
+
+
+def _guardar_fullness_by_bintype(cubo, pisos, output_dir, pisos_modificados=None, bintype_previo=None):
+    """
+    Genera fullness_by_bintype.json a partir del cubo finalizado (_finalizar_cubo).
+    """
+    fullness_by_bintype = {}
+    pisos_reutilizados = set()
+    for floor in pisos:
+        floor_int = int(floor)
+        # Recálculo incremental: reutilizar el resultado anterior de los pisos sin cambios
+        if pisos_modificados is not None and str(floor_int) not in pisos_modificados and str(floor_int) in bintype_previo:
+            fullness_by_bintype[floor_int] = bintype_previo[str(floor_int)]
+            pisos_reutilizados.add(floor_int)
+        else:
+            fullness_by_bintype[floor_int] = {}
+    
+    # Floor → Storage Area → Bin Type (el índice del cubo ya viene ordenado)
+    for (floor, storage_area, bintype), fila in zip(cubo.index, cubo.itertuples(index=False)):
+        floor_int = int(floor)
+        if floor_int in pisos_reutilizados:
+            continue
+        fullness_by_bintype[floor_int].setdefault(storage_area, {})[str(bintype)] = {
+            'total_bins': int(fila.total_bins),
+            'avg_fullness': round(float(fila.avg_fullness), 4) if not pd.isna(fila.avg_fullness) else 0.0,
+            'locked_bins': int(fila.locked_bins),
+            'occupied_bins': int(fila.occupied_bins),
+            'empty_bins': int(fila.total_bins - fila.occupied_bins),
+            'total_units': int(fila.total_units)
+        }
     
     # Guardar JSON
     try:
         json_path = os.path.join(output_dir, 'fullness_by_bintype.json')
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(fullness_by_bintype, f, indent=2)
+        escribir_json_atomico(json_path, fullness_by_bintype, indent=2)
         print(f"[OK] fullness_by_bintype.json generado: {json_path}")
     except Exception as e:
         print(f"[ERROR] No se pudo guardar fullness_by_bintype.json: {str(e)}")
         raise
-    
-    # ============================================
-    # SUMMARY KPIs (Métricas generales calculadas)
-    # ============================================
-    print("[Procesamiento] Calculando KPIs generales...")
-    
+
+
+def _guardar_summary_kpis(kpis, output_dir):
+    """
+    Genera summary_kpis.json a partir de los agregados de _kpis_parciales().
+    """
     # Calcular fullness total: promedio directo de todas las bins
     # Usar Fullness_Adjusted (basado en Fullness, columna principal) que ya tiene bins bloqueadas ajustadas a 100%
     # NOTA: Se usa Fullness, NO Utilization %
-    avg_fullness_all_bins = df['Fullness_Adjusted'].mean()
+    n_validos = kpis['n_fullness']
+    avg_fullness_all_bins = kpis['suma_fullness'] / n_validos if n_validos else np.nan
     fullness_total = float(avg_fullness_all_bins * 100) if not pd.isna(avg_fullness_all_bins) else 0.0
     
-    # Calcular totales desde el DataFrame completo
-    total_bins = len(df)
-    total_occupied_bins = len(df[df['Fullness_Adjusted'] > 0])
-    total_locked_bins = int(df['IsLocked'].sum())
-    total_units = int(df['Total Units'].sum())
+    total_bins = kpis['total_bins']
+    total_occupied_bins = kpis['total_occupied_bins']
     
     # Calcular occupancy rate (porcentaje de bins ocupadas)
     occupancy_rate = (total_occupied_bins / total_bins * 100) if total_bins > 0 else 0.0
     
     summary_kpis = {
         'fullness_total': round(float(fullness_total), 2),
-        'total_units': int(total_units),
+        'total_units': int(kpis['total_units']),
         'total_bins': int(total_bins),
         'total_occupied_bins': int(total_occupied_bins),
-        'total_locked_bins': int(total_locked_bins),
+        'total_locked_bins': int(kpis['total_locked_bins']),
         'total_empty_bins': int(total_bins - total_occupied_bins),
         'occupancy_rate': round(float(occupancy_rate), 2),
         'processed_at': datetime.now().isoformat()
@@ -626,16 +1003,53 @@ def procesar_stowmap(csv_path, output_dir):
     # Guardar JSON
     try:
         json_path = os.path.join(output_dir, 'summary_kpis.json')
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(summary_kpis, f, indent=2)
+        escribir_json_atomico(json_path, summary_kpis, indent=2)
         print(f"[OK] summary_kpis.json generado: {json_path}")
     except Exception as e:
         print(f"[ERROR] No se pudo guardar summary_kpis.json: {str(e)}")
         raise
+
+
+def _cargar_reglas_fc(reglas_dir, fullness_nombre):
+    """
+    Carga Zonas_reglas.json (referencias 'zone') y localiza fullness_<fc>.json; ambos son obligatorios.
     
-    # ============================================
-    # PROCESAR ZONAS SEGÚN REGLAS
-    # ============================================
+    Returns:
+        Tupla (zonas_reglas_dict, fullness_path)
+    """
+    # Cargar Zonas_reglas.json primero para resolver referencias 'zone' en fullness_<fc>.json
+    # Este archivo es solo de referencia, NO se procesa para generar datos
+    zonas_reglas_path = os.path.join(reglas_dir, "Zonas_reglas.json")
+    if os.path.exists(zonas_reglas_path):
+        print(f"[Zonas] [OK] Cargando Zonas_reglas.json como referencia para resolver 'zone': {zonas_reglas_path}")
+        with open(zonas_reglas_path, 'r', encoding='utf-8-sig') as f:
+            zonas_reglas_dict = json.load(f)
+        print(f"[Zonas] [OK] Cargadas {len(zonas_reglas_dict)} zonas de referencia (solo para resolver 'zone', no se generan datos)")
+    else:
+        error_msg = f"[ERROR CRÍTICO] No se encontro Zonas_reglas.json en: {zonas_reglas_path}\n"
+        error_msg += "Este archivo es OBLIGATORIO para procesar las zonas correctamente."
+        print(error_msg)
+        raise FileNotFoundError(error_msg)
+    
+    fullness_path = os.path.join(reglas_dir, fullness_nombre)
+    if not os.path.exists(fullness_path):
+        error_msg = f"[ERROR CRÍTICO] No se encontro {fullness_nombre} en: {fullness_path}\n"
+        error_msg += "Este archivo es OBLIGATORIO para generar Data_Fullness.json."
+        print(error_msg)
+        raise FileNotFoundError(error_msg)
+    return zonas_reglas_dict, fullness_path
+
+
+def _buscar_directorio_reglas():
+    """
+    Busca el directorio de reglas (Zonas_reglas.json, fullness_<fc>.json) en desarrollo y en build.
+    
+    Returns:
+        Ruta del directorio de reglas
+        
+    Raises:
+        FileNotFoundError: si no se encuentra en ninguna de las rutas posibles
+    """
     # Determinar rutas de los archivos de reglas
     # Script está en: src/renderer/apps/space-heatmap/py/Procesar_StowMap.py
     # Reglas están en: src/renderer/apps/space-heatmap/js/Reglas/
@@ -695,73 +1109,283 @@ def procesar_stowmap(csv_path, output_dir):
         print(error_msg)
         raise FileNotFoundError(error_msg)
     
-    # Procesar zonas desde fullness_vlc1.json
+    return reglas_dir
+
+
+def _cargar_json_previo(path):
+    """
+    Carga un JSON generado en un procesamiento anterior (None si no existe o es inválido).
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _hash_reglas(reglas_dir, fullness_nombre):
+    # Hash de los archivos de reglas de los que dependen los JSON procesados
+    return {
+        nombre: hash_archivo(os.path.join(reglas_dir, nombre))
+        for nombre in ("Zonas_reglas.json", fullness_nombre)
+        if os.path.exists(os.path.join(reglas_dir, nombre))
+    }
+
+
+def _resultados_previos(manifest, hash_reglas, output_dir):
+    """
+    JSON del último procesamiento que se pueden reutilizar: (fullness_by_bintype, Data_Fullness),
+    o None si las reglas cambiaron desde entonces o falta alguno de los JSON.
+    """
+    if manifest.get('etapas', {}).get('procesar_reglas') != hash_reglas:
+        return None
+    bintype_previo = _cargar_json_previo(os.path.join(output_dir, 'fullness_by_bintype.json'))
+    zonas_previas = _cargar_json_previo(os.path.join(output_dir, 'Data_Fullness.json'))
+    kpis_previos = _cargar_json_previo(os.path.join(output_dir, 'summary_kpis.json'))
+    if bintype_previo is None or zonas_previas is None or kpis_previos is None:
+        return None
+    return bintype_previo, zonas_previas
+
+
+def procesamiento_pendiente(csv_path, output_dir, fc='VLC1'):
+    """
+    Indica, sin leer el CSV, si procesar_stowmap() tiene algo que recalcular: algún piso cambió,
+    cambió alguna regla (Zonas_reglas.json, fullness_<fc>.json) o falta alguno de los JSON procesados.
+    """
+    manifest = cargar_manifest(os.path.dirname(csv_path))
+    if not manifest_valido(manifest, csv_path):
+        return True
+    hash_reglas = _hash_reglas(_buscar_directorio_reglas(), f"fullness_{fc.lower()}.json")
+    if _resultados_previos(manifest, hash_reglas, output_dir) is None:
+        return True
+    return bool(pisos_cambiados(manifest, 'procesar'))
+
+
+def procesar_stowmap(csv_path, output_dir, forzar=False, df=None, corregido=False, fc='VLC1', filas_por_bloque=None):
+    """
+    Procesa el CSV de StowMap: limpia los datos y genera fullness por bintype.
+    
+    NOTA: Todos los cálculos usan la columna Fullness (no Utilization %).
+    Utilization % se mantiene como dato original y solo se usa cuando se indique explícitamente.
+    
+    Refresco incremental: si junto al CSV existe stowmap_manifest.json (escrito por
+    Descarga_StowMap.py), solo se recalculan los pisos y zonas cuyo hash cambió desde el
+    último procesamiento; si no cambió nada (ni los datos ni las reglas) no se lee el CSV.
+    
+    Procesamiento por bloques: con filas_por_bloque > 0 (y sin df) el CSV se lee y se corrige
+    por bloques y solo se guardan agregados sumables (AgregadosPorBloques); la memoria queda
+    acotada por el tamaño del bloque y los JSON generados son los mismos.
+    
+    Args:
+        csv_path: Ruta al archivo CSV de StowMap
+        output_dir: Directorio donde guardar el JSON procesado
+        forzar: Si True, ignora el manifest y recalcula todo
+        df: DataFrame ya cargado en memoria (opcional). Si se indica no se lee csv_path.
+        corregido: Si True, df ya pasó por corregir_csv() y no se vuelve a corregir
+        fc: Código del FC; sus zonas se leen de fullness_<fc>.json (ej: fullness_vlc1.json)
+        filas_por_bloque: Filas por bloque del procesamiento por bloques (None = FILAS_POR_BLOQUE, 0 = en memoria)
+    """
+    # ============================================
+    # REFRESCO INCREMENTAL (DELTA)
+    # ============================================
+    data_folder = os.path.dirname(csv_path)
+    manifest = cargar_manifest(data_folder)
+    usar_manifest = manifest_valido(manifest, csv_path)
+    
+    reglas_dir = _buscar_directorio_reglas()
+    fullness_nombre = f"fullness_{fc.lower()}.json"
+    hash_reglas = _hash_reglas(reglas_dir, fullness_nombre)
+    
+    pisos_modificados = None  # None = recalcular todo
+    bintype_previo = None
+    zonas_previas = None
+    if usar_manifest and not forzar:
+        previos = _resultados_previos(manifest, hash_reglas, output_dir)
+        if previos is not None:
+            bintype_previo, zonas_previas = previos
+            pisos_modificados = pisos_cambiados(manifest, 'procesar')
+            if not pisos_modificados:
+                print("[Delta] Ningun piso ni regla ha cambiado desde el ultimo procesamiento: no hay nada que recalcular")
+                print("\n[EXITO] Procesamiento completado!")
+                print(f"[EXITO] Ubicacion: {output_dir}")
+                return True
+            print(f"[Delta] Pisos modificados: {', '.join(sorted(pisos_modificados))} (el resto se reutiliza)")
+    
+    if filas_por_bloque is None:
+        filas_por_bloque = FILAS_POR_BLOQUE
+    por_bloques = df is None and filas_por_bloque > 0
+    
+    reglas_fc = None
+    if por_bloques:
+        print(f"[Procesamiento] Leyendo CSV por bloques desde: {csv_path}")
+        # Las zonas se acumulan durante la lectura: las reglas se cargan antes
+        reglas_fc = _cargar_reglas_fc(reglas_dir, fullness_nombre)
+        reglas = _cargar_reglas_zonas(reglas_fc[1])
+        zonas = _zonas_de_reglas(reglas, ['fullness']) if reglas else []
+        agregados = AgregadosPorBloques(zonas, reglas_fc[0],
+                                        _zonas_reutilizables(zonas, reglas_fc[0], zonas_previas, pisos_modificados))
+        _procesar_por_bloques(csv_path, filas_por_bloque, agregados)
+    else:
+        if df is None:
+            print(f"[Procesamiento] Leyendo CSV desde: {csv_path}")
+            
+            # Leer los datos corregidos guardados si son de este CSV y de esta versión de las correcciones;
+            # si no, los datos originales (snapshot columnar si existe, si no el CSV) con el esquema de ingesta.
+            # Si se van a guardar los datos corregidos hay que leer todas las columnas (los heatmaps usan Bay Id).
+            guardar = GUARDAR_DATOS_CORREGIDOS or GUARDAR_CSV_CORREGIDO
+            df = leer_stowmap(csv_path, consumidor=None if guardar else 'procesar',
+                              version_correcciones=VERSION_CORRECCIONES if GUARDAR_DATOS_CORREGIDOS else None)
+        else:
+            print("[Procesamiento] Usando datos en memoria (sin releer el CSV)")
+        print(f"[Procesamiento] Total de registros: {len(df)}")
+        
+        # Corregir el CSV antes de procesarlo (se omite si los datos ya vienen corregidos)
+        if not corregido:
+            df = corregir_csv(df)
+        
+        # Sobrescribir CSV original si está habilitado (exportación opcional)
+        if GUARDAR_CSV_CORREGIDO:
+            try:
+                # Asegurar que el directorio del CSV existe
+                csv_dir = os.path.dirname(csv_path)
+                if csv_dir and not os.path.exists(csv_dir):
+                    os.makedirs(csv_dir, exist_ok=True)
+                    print(f"[Procesamiento] Directorio del CSV creado: {csv_dir}")
+                
+                # Guardar CSV corregido
+                df.to_csv(csv_path, index=False)
+                print(f"[OK] CSV corregido sobrescrito en: {csv_path}")
+                guardar_snapshot(df, csv_path)
+                
+                # Verificar que el archivo se guardó correctamente
+                if os.path.exists(csv_path):
+                    file_size = os.path.getsize(csv_path)
+                    print(f"[OK] Archivo verificado: {file_size} bytes")
+                else:
+                    print(f"[ERROR] El archivo no se guardó correctamente: {csv_path}")
+            except PermissionError as e:
+                print(f"[ERROR] Sin permisos para escribir en: {csv_path}")
+                print(f"[ERROR] Detalle: {str(e)}")
+            except Exception as e:
+                print(f"[ERROR] Error al guardar CSV corregido: {str(e)}")
+                import traceback
+                traceback.print_exc()
+        
+        # Guardar los datos corregidos una sola vez (después del CSV: registran su firma)
+        if GUARDAR_DATOS_CORREGIDOS and 'correcciones' in df.attrs and not corregido_vigente(csv_path, VERSION_CORRECCIONES):
+            guardar_snapshot(df, csv_path, correcciones=df.attrs['correcciones'])
+    
+    # Crear directorio de salida si no existe
+    try:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+            print(f"[Procesamiento] Directorio creado: {output_dir}")
+        else:
+            print(f"[Procesamiento] Directorio de salida existe: {output_dir}")
+    except Exception as e:
+        print(f"[ERROR] No se pudo crear el directorio de salida: {output_dir}")
+        print(f"[ERROR] Detalle: {str(e)}")
+        raise
+    
+    # ============================================
+    # FULLNESS POR BINTYPE (por Floor y Storage Area)
+    # ============================================
+    print("[Procesamiento] Calculando fullness por bintype (Floor + Storage Area)...")
+    
+    if por_bloques:
+        bloqueadas = agregados.bloqueadas
+        cubo = agregados.cubo
+        pisos = sorted(agregados.pisos)
+    else:
+        locked_mask = _agregar_columnas_calculo(df)
+        bloqueadas = locked_mask.sum()
+        cubo = _cubo_parcial(df, locked_mask)
+        pisos = sorted(df['Floor'].dropna().unique())
+    print(f"[Info] Ajustadas {bloqueadas} bins bloqueadas a 100% de fullness (usando columna Fullness)")
+    
+    _guardar_fullness_by_bintype(_finalizar_cubo(cubo), pisos, output_dir, pisos_modificados, bintype_previo)
+    
+    # ============================================
+    # SUMMARY KPIs (Métricas generales calculadas)
+    # ============================================
+    print("[Procesamiento] Calculando KPIs generales...")
+    _guardar_summary_kpis(agregados.kpis if por_bloques else _kpis_parciales(df), output_dir)
+    
+    # ============================================
+    # PROCESAR ZONAS SEGÚN REGLAS
+    # ============================================
+    # reglas_dir ya se resolvió al inicio (también forma parte del refresco incremental)
+    # Procesar zonas desde fullness_<fc>.json
     # NOTA: Zonas_reglas.json es solo un archivo de referencia para resolver 'zone',
-    # NO genera datos en el JSON final. Solo fullness_vlc1.json genera datos.
+    # NO genera datos en el JSON final. Solo fullness_<fc>.json genera datos.
     todas_las_zonas = {}
     
-    # Cargar Zonas_reglas.json primero para resolver referencias 'zone' en fullness_vlc1.json
-    # Este archivo es solo de referencia, NO se procesa para generar datos
-    zonas_reglas_path = os.path.join(reglas_dir, "Zonas_reglas.json")
-    zonas_reglas_dict = None
-    if os.path.exists(zonas_reglas_path):
-        print(f"[Zonas] [OK] Cargando Zonas_reglas.json como referencia para resolver 'zone': {zonas_reglas_path}")
-        with open(zonas_reglas_path, 'r', encoding='utf-8-sig') as f:
-            zonas_reglas_dict = json.load(f)
-        print(f"[Zonas] [OK] Cargadas {len(zonas_reglas_dict)} zonas de referencia (solo para resolver 'zone', no se generan datos)")
-    else:
-        error_msg = f"[ERROR CRÍTICO] No se encontro Zonas_reglas.json en: {zonas_reglas_path}\n"
-        error_msg += "Este archivo es OBLIGATORIO para procesar las zonas correctamente."
-        print(error_msg)
-        raise FileNotFoundError(error_msg)
+    # Zonas_reglas.json (solo referencia para resolver 'zone') y fullness_<fc>.json son obligatorios
+    if reglas_fc is None:
+        reglas_fc = _cargar_reglas_fc(reglas_dir, fullness_nombre)
+    zonas_reglas_dict, fullness_path = reglas_fc
     
-    # Procesar SOLO fullness_vlc1.json (este es el único que genera datos en el JSON final)
+    # Procesar SOLO fullness_<fc>.json (este es el único que genera datos en el JSON final)
     # Pasar zonas_reglas_dict para resolver referencias 'zone'
-    fullness_path = os.path.join(reglas_dir, "fullness_vlc1.json")
-    if os.path.exists(fullness_path):
-        print(f"[Zonas] [OK] Procesando fullness_vlc1.json (genera datos en JSON final): {fullness_path}")
-        resultado_fullness = procesar_zonas(df, fullness_path, output_dir, zonas_reglas_dict=zonas_reglas_dict)
-        if resultado_fullness:
-            todas_las_zonas.update(resultado_fullness)
-            print(f"[Zonas] [OK] Procesadas {len(todas_las_zonas)} zonas desde fullness_vlc1.json")
-        else:
-            error_msg = f"[ERROR CRÍTICO] No se procesaron zonas desde fullness_vlc1.json.\n"
-            error_msg += "El archivo existe pero no se pudieron procesar los datos."
-            print(error_msg)
-            raise ValueError(error_msg)
+    print(f"[Zonas] [OK] Procesando {fullness_nombre} (genera datos en JSON final): {fullness_path}")
+    if por_bloques:
+        resultado_fullness = agregados.resultado_zonas(zonas_previas)
     else:
-        error_msg = f"[ERROR CRÍTICO] No se encontro fullness_vlc1.json en: {fullness_path}\n"
-        error_msg += "Este archivo es OBLIGATORIO para generar Data_Fullness.json."
+        resultado_fullness = procesar_zonas(df, fullness_path, output_dir, zonas_reglas_dict=zonas_reglas_dict,
+                                            zonas_previas=zonas_previas, pisos_modificados=pisos_modificados)
+    if resultado_fullness:
+        todas_las_zonas.update(resultado_fullness)
+        print(f"[Zonas] [OK] Procesadas {len(todas_las_zonas)} zonas desde {fullness_nombre}")
+    else:
+        error_msg = f"[ERROR CRÍTICO] No se procesaron zonas desde {fullness_nombre}.\n"
+        error_msg += "El archivo existe pero no se pudieron procesar los datos."
         print(error_msg)
-        raise FileNotFoundError(error_msg)
+        raise ValueError(error_msg)
     
     # Guardar todas las zonas combinadas en un solo archivo
     # CRÍTICO: Solo generar el archivo si hay zonas procesadas
     if not todas_las_zonas or len(todas_las_zonas) == 0:
         error_msg = "[ERROR CRÍTICO] No se procesaron zonas. No se puede generar Data_Fullness.json.\n"
-        error_msg += "Verifica que los archivos de reglas (Zonas_reglas.json y fullness_vlc1.json) existan y sean válidos."
+        error_msg += f"Verifica que los archivos de reglas (Zonas_reglas.json y {fullness_nombre}) existan y sean válidos."
         print(error_msg)
         raise ValueError(error_msg)
     
     try:
         output_file = os.path.join(output_dir, 'Data_Fullness.json')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(todas_las_zonas, f, indent=2, ensure_ascii=False)
+        escribir_json_atomico(output_file, todas_las_zonas, indent=2, ensure_ascii=False)
         print(f"[OK] Total de {len(todas_las_zonas)} zonas guardadas en Data_Fullness.json: {output_file}")
     except Exception as e:
         error_msg = f"[ERROR CRÍTICO] No se pudo guardar Data_Fullness.json: {str(e)}"
         print(error_msg)
         raise
     
+    # Registrar en el manifest los hashes consumidos (el CSV pudo reescribirse con las correcciones)
+    if usar_manifest:
+        marcar_etapa(manifest, 'procesar')
+        manifest['etapas']['procesar_reglas'] = hash_reglas
+        manifest['csv'] = firma_csv(csv_path)
+        guardar_manifest(data_folder, manifest)
+    
     print("\n[EXITO] Procesamiento completado!")
     print(f"[EXITO] Ubicacion: {output_dir}")
     return True
 
 if __name__ == '__main__':
+    # --full: ignorar el manifest de hashes y recalcular todo
+    forzar = '--full' in sys.argv[1:]
+    # --bloques=N: procesar el CSV por bloques de N filas (memoria acotada)
+    filas_por_bloque = None
+    for argumento in sys.argv[1:]:
+        if argumento.startswith('--bloques='):
+            filas_por_bloque = int(argumento.split('=', 1)[1])
+    argumentos = [a for a in sys.argv[1:] if not a.startswith('--')]
+    
     # Siempre usar userData (roaming) - ya no hay modo DEV
-    if len(sys.argv) > 1:
+    if argumentos:
         # Ejecutado desde Electron con userData path
-        user_data_path = sys.argv[1]
+        user_data_path = argumentos[0]
         csv_path = os.path.join(user_data_path, "data", "space-heatmap", "Stowmap_data.csv")
         output_dir = os.path.join(user_data_path, "data", "space-heatmap", "processed")
         print(f"[Procesamiento] Ejecutado desde Electron - userData: {user_data_path}")
@@ -797,7 +1421,7 @@ if __name__ == '__main__':
     
     # Procesar
     try:
-        procesar_stowmap(csv_path, output_dir)
+        procesar_stowmap(csv_path, output_dir, forzar=forzar, filas_por_bloque=filas_por_bloque)
     except Exception as e:
         print(f"[ERROR] Error al procesar: {str(e)}")
         import traceback
@@ -1,38 +1,303 @@
+import codecs
 import csv
+import json
 import sys
+from urllib.parse import urlsplit, urlunsplit
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
 from requests_kerberos import HTTPKerberosAuth, OPTIONAL
 from urllib3 import disable_warnings
 
 import time
 import os
+import threading
+
+from progreso import escribir_json_atomico
 
 
 # Author: Nagi, Karan (karanagi@amazon.com)
 
 
-class AmazonRequest:
+# Sends every AmazonRequest to another server, e.g. http://127.0.0.1:8765 for the local portal stand-in
+# (servidor_portal_local.py): the scheme and host of each URL are replaced, the path and query are kept.
+# Midway authentication is skipped while it is set.
+BASE_URL_OVERRIDE = os.environ.get("AMAZON_BASE_URL", "")
+
+# Seconds before the earliest cookie expiry at which the cached cookies are read again from disk
+MIDWAY_EXPIRY_MARGIN = 60
+
+
+class _MidwayCookieStore:
+    """
+    Thread-safe, process-wide cache of the parsed ~/.midway/cookie file.
+    The file is only read again when its mtime changes or the earliest cookie is about to expire,
+    so parallel workers share the same parsed cookies instead of re-reading the file per request.
+    """
+
     def __init__(self):
+        # Re-entrant: mw_cookie() holds it while running mwinit and may call itself after a refresh
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        self.cookies = None
+        self.mtime = None
+        self.expires = None
+
+    def get(self, path: str):
+        """
+        :return: A copy of the cached cookies, or None if they must be read from the file again.
+        """
+        if self.cookies is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime != self.mtime or self.expires - MIDWAY_EXPIRY_MARGIN < time.time():
+            return None
+        return dict(self.cookies)
+
+    def store(self, path: str, cookies: dict, expires: float):
+        self.cookies = dict(cookies)
+        self.mtime = os.stat(path).st_mtime_ns
+        self.expires = expires
+
+
+_midway_cookies = _MidwayCookieStore()
+
+
+# Connection pool shared by every session: number of hosts kept and keep-alive connections per host.
+# The per-host size should be at least the number of parallel downloads (see Descarga_StowMap.py)
+POOL_HOSTS = 10
+POOL_MAXSIZE_PER_HOST = 16
+
+_shared_adapter = None
+_shared_adapter_lock = threading.Lock()
+
+# Request metrics (see HttpMetrics): set AMAZON_HTTP_LOG=1 to also print one line per request
+HTTP_METRICS_ENABLED = True
+HTTP_METRICS_LOG = os.environ.get("AMAZON_HTTP_LOG", "") == "1"
+
+
+class _PerThreadKerberosAuth(AuthBase):
+    """
+    Kerberos auth shared by every session of the process, backed by one HTTPKerberosAuth per thread.
+    HTTPKerberosAuth keeps the per-host SPNEGO context (and the body position) in the object, and its
+    401 handler re-sends the request and waits for the answer inside the response hook, so one instance
+    cannot be used by parallel threads without serialising whole requests. Each worker thread negotiates
+    once per host instead and reuses its context for the following requests of that thread.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._local = threading.local()
+
+    def _auth(self):
+        auth = getattr(self._local, "auth", None)
+        if auth is None:
+            auth = self._local.auth = HTTPKerberosAuth(**self._kwargs)
+        return auth
+
+    def __call__(self, request):
+        # Registers the response hook of this thread's HTTPKerberosAuth
+        return self._auth()(request)
+
+
+_kerberos_auth = _PerThreadKerberosAuth(mutual_authentication=OPTIONAL)
+
+
+def get_shared_adapter():
+    """
+    Returns the process-wide HTTPAdapter: its connection pool (POOL_MAXSIZE_PER_HOST keep-alive
+    connections per host) is thread-safe and shared by every pooled session.
+    """
+    global _shared_adapter
+    with _shared_adapter_lock:
+        if _shared_adapter is None:
+            _shared_adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_MAXSIZE_PER_HOST)
+        return _shared_adapter
+
+
+def pooled_session():
+    """
+    Returns a new requests.Session on the shared connection pool and Kerberos auth.
+    Repeated and parallel requests skip the TLS handshake and the Kerberos negotiation, while each
+    session (one per AmazonRequest) keeps its own cookie jar, as a plain requests.Session() does.
+    Do not close it: closing the session would close the shared pool.
+
+    :return: A requests.Session() that asks for gzip/deflate bodies
+    """
+    session = requests.Session()
+    adapter = get_shared_adapter()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    session.auth = _kerberos_auth
+    session.verify = False
+    return session
+
+
+def url_template(url: str):
+    """
+    Returns the url without the query string, so every request to an endpoint shares it.
+    e.g. stowmap-eu.amazon.com/stowmap/getBinStatusReport.do
+
+    :param url: The url of the request.
+    """
+    parts = urlsplit(url)
+    return parts.netloc + parts.path
+
+
+class HttpMetrics:
+    """
+    Process-wide aggregate of the requests sent by AmazonRequest, per url template.
+    Each request only adds a few numbers under a lock, so it can stay enabled in production.
+
+    Per template: number of requests, status codes, time until the headers and until the whole body
+    (from the start of send_req, so Midway, Kerberos and retries are included), bytes received,
+    retries (requests sent with attempt > 0 by the caller's retry loop: backoff retries, re-sends after a failed
+    response, fallback requests), Midway re-authentications, Kerberos negotiation rounds (the normal 401 + Negotiate
+    exchange, not a retry) and time spent reading Midway cookies.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = {}
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.endpoints = {}
+
+    def _entry(self, template: str):
+        entry = self.endpoints.get(template)
+        if entry is None:
+            entry = self.endpoints[template] = {
+                "requests": 0, "status": {}, "retries": 0, "reauths": 0, "kerberos_rounds": 0, "midway_s": 0.0,
+                "headers_s": {"total": 0.0, "max": 0.0},
+                "body_s": {"count": 0, "total": 0.0, "max": 0.0},
+                "bytes": 0,
+            }
+        return entry
+
+    @staticmethod
+    def _add_time(stats: dict, seconds: float):
+        stats["total"] += seconds
+        stats["max"] = max(stats["max"], seconds)
+
+    def record_headers(self, template: str, method: str, status: int, headers_s: float, attempt: int = 0,
+                       reauths: int = 0, kerberos_rounds: int = 0, midway_s: float = 0.0):
+        """
+        Records a request once its final response headers arrived.
+        attempt is the caller's attempt number for this request (0 = first attempt, > 0 = a retry).
+
+        :return: The record to pass to record_body() when the body has been read.
+        """
+        template = f"{method.upper()} {template}"
+        with self.lock:
+            entry = self._entry(template)
+            entry["requests"] += 1
+            entry["status"][str(status)] = entry["status"].get(str(status), 0) + 1
+            entry["retries"] += 1 if attempt > 0 else 0
+            entry["reauths"] += reauths
+            entry["kerberos_rounds"] += kerberos_rounds
+            entry["midway_s"] += midway_s
+            self._add_time(entry["headers_s"], headers_s)
+        return {"template": template, "status": status, "headers_s": headers_s, "attempt": attempt, "reauths": reauths,
+                "kerberos_rounds": kerberos_rounds}
+
+    def record_body(self, record: dict, body_s: float, size: int):
+        """
+        Completes a record with the time until the end of the body and the bytes received.
+        """
+        with self.lock:
+            entry = self._entry(record["template"])
+            entry["body_s"]["count"] += 1
+            self._add_time(entry["body_s"], body_s)
+            entry["bytes"] += size
+        if HTTP_METRICS_LOG:
+            print(f"[HTTP] {record['template']} {record['status']} headers={record['headers_s']:.2f}s "
+                  f"body={body_s:.2f}s bytes={size} attempt={record['attempt']} reauths={record['reauths']} "
+                  f"kerberos_rounds={record['kerberos_rounds']}", flush=True)
+
+    def summary(self):
+        """
+        :return: Dictionary with the aggregated metrics (the content of http_metrics.json).
+        """
+        with self.lock:
+            endpoints = json.loads(json.dumps(self.endpoints))
+            started = self.started
+        for entry in endpoints.values():
+            entry["midway_s"] = round(entry["midway_s"], 4)
+            for stats, count in ((entry["headers_s"], entry["requests"]), (entry["body_s"], entry["body_s"]["count"])):
+                stats["mean"] = round(stats["total"] / count, 4) if count else 0.0
+                stats["total"] = round(stats["total"], 4)
+                stats["max"] = round(stats["max"], 4)
+        totals = {
+            "requests": sum(e["requests"] for e in endpoints.values()),
+            "bytes": sum(e["bytes"] for e in endpoints.values()),
+            "retries": sum(e["retries"] for e in endpoints.values()),
+            "reauths": sum(e["reauths"] for e in endpoints.values()),
+            "kerberos_rounds": sum(e["kerberos_rounds"] for e in endpoints.values()),
+        }
+        return {"started": started, "seconds": round(time.time() - started, 3), "totals": totals, "endpoints": endpoints}
+
+    def write(self, path: str):
+        """
+        Writes the aggregated metrics to path (atomically: temp file + os.replace).
+        """
+        escribir_json_atomico(path, self.summary(), indent=2)
+
+
+http_metrics = HttpMetrics()
+
+
+def _received_bytes(response, counted: int = None):
+    # Bytes read from the socket (compressed size); when the raw stream cannot tell, the bytes counted
+    # while iterating a streamed body or the size of the (already read) body
+    try:
+        return int(response.raw.tell())
+    except Exception:
+        return counted if counted is not None else len(response.content)
+
+
+class AmazonRequest:
+    def __init__(self, base_url: str = None):
         """
         An object of this instance can send kerberos authenticated requests to Amazon Internal sites.
         Contains a retry method when the site needs midway authentication.
+
+        :param base_url: Server that receives every request instead of the original host (defaults to
+                         BASE_URL_OVERRIDE). Midway authentication is skipped when it is set.
         """
 
         # Disabling warnings for unverified HTTPS requests
         disable_warnings()
 
-        # Creating a requests.Session() object
-        self.req = requests.Session()
-        self.req.auth = HTTPKerberosAuth(mutual_authentication=OPTIONAL)
-        self.req.verify = False
+        # requests.Session() on the process-wide connection pool (see pooled_session)
+        self.req = pooled_session()
         self.cookie = None
+        self.base_url = (BASE_URL_OVERRIDE if base_url is None else base_url).rstrip("/")
+
+    def resolve_url(self, url: str):
+        """
+        Returns the url that is actually requested: the same url, or its path and query on base_url.
+        """
+        if not self.base_url:
+            return url
+        parts = urlsplit(url)
+        return self.base_url + urlunsplit(("", "", parts.path, parts.query, parts.fragment))
 
     def mw_cookie(self, flags=None, delete_cookie: bool = False):
         """
         Checks if the cookie file exists in the .midway folder in the userprofile location.
         It then validates the cookie making sure it is not expired.
         It uses OTP authentication to make the cookie reusable for 20 hrs.
+        The parsed cookies are cached in memory for the whole process (see _MidwayCookieStore).
 
         :return: A cookie list that can used with a requests.Session()
         """
@@ -43,64 +308,77 @@ class AmazonRequest:
         path = os.path.join(os.path.expanduser("~"), ".midway")
         cookie = os.path.join(path, "cookie")
 
-        if delete_cookie:
-            if os.path.exists(cookie):
-                os.remove(cookie)
-
-        if not os.path.exists(cookie):
-            # Open a new CMD window on Windows to allow user interaction with mwinit
-            if sys.platform == "win32":
-                mwinit_cmd = f"mwinit {' '.join(flags)}"
-                print("\n[!] Se abrira una ventana CMD para autenticacion con Midway.")
-                print("    Por favor, ingresa tu PIN cuando se solicite.\n")
-                # Use 'start cmd /k' to open a new visible CMD window
-                os.system(f'start cmd /k "{mwinit_cmd} && echo. && echo [OK] Autenticacion completada. Puedes cerrar esta ventana. && pause"')
-                # Wait for user to complete authentication
-                print("    Esperando a que completes la autenticacion...")
-                while not os.path.exists(cookie):
-                    time.sleep(1)
-                print("    [OK] Autenticacion completada.\n")
+        # Only one thread at a time reads the file or runs mwinit; the rest reuse its result
+        with _midway_cookies.lock:
+            if delete_cookie:
+                _midway_cookies.clear()
+                if os.path.exists(cookie):
+                    os.remove(cookie)
             else:
-                os.system(f"mwinit {' '.join(flags)}")
+                cached = _midway_cookies.get(cookie)
+                if cached is not None:
+                    return cached
 
-        with open(cookie, "rt") as c:
-            cookie_file = c.readlines()
-
-        cookies = {}
-        # Opening the file and looking at timestamp for expired cookie, running mwinit -o again or getting the cookie
-        now = time.time()
-        for line in range(4, len(cookie_file)):
-            if int(cookie_file[line].split("\t")[4]) < now:
-                # Cookie expired, need to refresh - open a new CMD window on Windows
+            if not os.path.exists(cookie):
+                # Open a new CMD window on Windows to allow user interaction with mwinit
                 if sys.platform == "win32":
                     mwinit_cmd = f"mwinit {' '.join(flags)}"
-                    print("\n[!] Cookie de Midway expirada. Se abrira una ventana CMD para re-autenticacion.")
+                    print("\n[!] Se abrira una ventana CMD para autenticacion con Midway.")
                     print("    Por favor, ingresa tu PIN cuando se solicite.\n")
-                    # Delete expired cookie first
-                    if os.path.exists(cookie):
-                        os.remove(cookie)
                     # Use 'start cmd /k' to open a new visible CMD window
-                    os.system(f'start cmd /k "{mwinit_cmd} && echo. && echo [OK] Re-autenticacion completada. Puedes cerrar esta ventana. && pause"')
+                    os.system(f'start cmd /k "{mwinit_cmd} && echo. && echo [OK] Autenticacion completada. Puedes cerrar esta ventana. && pause"')
                     # Wait for user to complete authentication
-                    print("    Esperando a que completes la re-autenticacion...")
+                    print("    Esperando a que completes la autenticacion...")
                     while not os.path.exists(cookie):
                         time.sleep(1)
-                    print("    [OK] Re-autenticacion completada.\n")
+                    print("    [OK] Autenticacion completada.\n")
                 else:
                     os.system(f"mwinit {' '.join(flags)}")
-                return self.mw_cookie(flags=flags)
-            cookies[cookie_file[line].split("\t")[5]] = str.replace(
-                cookie_file[line].split("\t")[6], "\n", ""
-            )
-        return cookies
+
+            with open(cookie, "rt") as c:
+                cookie_file = c.readlines()
+
+            cookies = {}
+            expires = float("inf")
+            # Opening the file and looking at timestamp for expired cookie, running mwinit -o again or getting the cookie
+            now = time.time()
+            for line in range(4, len(cookie_file)):
+                expires = min(expires, int(cookie_file[line].split("\t")[4]))
+                if int(cookie_file[line].split("\t")[4]) < now:
+                    # Cookie expired, need to refresh - open a new CMD window on Windows
+                    if sys.platform == "win32":
+                        mwinit_cmd = f"mwinit {' '.join(flags)}"
+                        print("\n[!] Cookie de Midway expirada. Se abrira una ventana CMD para re-autenticacion.")
+                        print("    Por favor, ingresa tu PIN cuando se solicite.\n")
+                        # Delete expired cookie first
+                        if os.path.exists(cookie):
+                            os.remove(cookie)
+                        # Use 'start cmd /k' to open a new visible CMD window
+                        os.system(f'start cmd /k "{mwinit_cmd} && echo. && echo [OK] Re-autenticacion completada. Puedes cerrar esta ventana. && pause"')
+                        # Wait for user to complete authentication
+                        print("    Esperando a que completes la re-autenticacion...")
+                        while not os.path.exists(cookie):
+                            time.sleep(1)
+                        print("    [OK] Re-autenticacion completada.\n")
+                    else:
+                        os.system(f"mwinit {' '.join(flags)}")
+                    return self.mw_cookie(flags=flags)
+                cookies[cookie_file[line].split("\t")[5]] = str.replace(
+                    cookie_file[line].split("\t")[6], "\n", ""
+                )
+            _midway_cookies.store(cookie, cookies, expires)
+            return cookies
 
     def set_mw_cookie(self, flags=None, delete_cookie: bool = False):
         """
         Sets the cookie for the requests.Session() object.
         """
+        if self.base_url:
+            self.cookie = None
+            return
         self.cookie = self.mw_cookie(flags=flags, delete_cookie=delete_cookie)
 
-    def send_req(self, url: str, method: str = "GET", needs_midway: bool = True, **options):
+    def send_req(self, url: str, method: str = "GET", needs_midway: bool = True, attempt: int = 0, **options):
         """
         Sends a request to the url provided using the method provided.
         If the request fails, it will retry the request after authenticating with midway.
@@ -124,32 +402,106 @@ class AmazonRequest:
         :param url: The url to send the request to.
         :param method: The method to use for the request. (GET, POST, PUT, DELETE)
         :param needs_midway: If the request needs midway authentication.
+        :param attempt: The caller's attempt number for this request (0 = first attempt), for the metrics.
         :param options: Any additional options to pass to the request. (headers, cookies, data, params, etc.)
         :return: The response from the request.
         """
+        start = time.perf_counter()
+        template = url_template(url)
+        url = self.resolve_url(url)
         if needs_midway:
             self.set_mw_cookie()
+        midway_s = time.perf_counter() - start
         # Dynamically calling the method from the requests.Session() object
         # and passing the options to the method.
+        sent_at = time.perf_counter()
         response = getattr(self.req, method.lower())(
             url, cookies=self.cookie, **options)
+        kerberos_rounds = len(response.history)
+        reauths = 0
 
         # If the request fails, it will retry the request after authenticating with midway.
-        if response.status_code == 401 and 'mwinit' in response.text.lower():
+        if response.status_code == 401 and not self.base_url and 'mwinit' in response.text.lower():
+            reauths = 1
+            mw_start = time.perf_counter()
             if needs_midway:
                 self.cookie = self.mw_cookie(delete_cookie=True)
-                response = getattr(self.req, method.lower())(
-                    url, cookies=self.cookie, **options)
             else:
                 print("The request needs midway authentication.")
                 self.cookie = self.mw_cookie()
-                response = getattr(self.req, method.lower())(
-                    url, cookies=self.cookie, **options)
+            midway_s += time.perf_counter() - mw_start
+            sent_at = time.perf_counter()
+            response = getattr(self.req, method.lower())(
+                url, cookies=self.cookie, **options)
+            kerberos_rounds += len(response.history)
+
+        if HTTP_METRICS_ENABLED:
+            # elapsed: from sending each request until its headers were parsed (Kerberos rounds are in history)
+            elapsed = sum((r.elapsed for r in response.history), response.elapsed).total_seconds()
+            record = http_metrics.record_headers(template, method, response.status_code, sent_at - start + elapsed,
+                                                 attempt=attempt, reauths=reauths,
+                                                 kerberos_rounds=kerberos_rounds, midway_s=midway_s)
+            if options.get("stream"):
+                # Completed by iter_text_lines() once the body has been read
+                response.http_metrics = (record, start)
+            else:
+                http_metrics.record_body(record, time.perf_counter() - start, _received_bytes(response))
+
         # If the request fails again, it will raise an exception.
         if response.status_code == 401 and 'mwinit' in response.text.lower():
             raise Exception("The request failed to authenticate with midway.")
         return response
 
+    def send_stream_req(self, url: str, method: str = "GET", needs_midway: bool = True, attempt: int = 0, **options):
+        """
+        Same as send_req but the body is not downloaded until it is iterated.
+        Use iter_text_lines() to consume it in chunks without holding it all in memory.
+
+        :param url: The url to send the request to.
+        :param method: The method to use for the request. (GET, POST, PUT, DELETE)
+        :param needs_midway: If the request needs midway authentication.
+        :param attempt: The caller's attempt number for this request (0 = first attempt), for the metrics.
+        :param options: Any additional options to pass to the request. (headers, cookies, data, params, etc.)
+        :return: The streamed response from the request.
+        """
+        return self.send_req(url, method, needs_midway, attempt, stream=True, **options)
+
+    @staticmethod
+    def iter_text_lines(response, chunk_size: int = 64 * 1024):
+        """
+        Iterates the body of a (streamed) response as decoded text lines, keeping the line endings.
+        Only one chunk plus one partial line is kept in memory at a time.
+
+        :param response: The response returned by send_stream_req (or send_req).
+        :param chunk_size: The number of bytes to read per chunk.
+        :return: A generator of text lines.
+        """
+        if response.encoding is None:
+            response.encoding = "utf-8"
+        decoder = codecs.getincrementaldecoder(response.encoding)(errors="replace")
+        received = 0
+        pending = ""
+        for raw_chunk in response.iter_content(chunk_size=chunk_size):
+            received += len(raw_chunk)
+            chunk = decoder.decode(raw_chunk)
+            if not chunk:
+                continue
+            pending += chunk
+            lines = pending.splitlines(keepends=True)
+            # The last piece may be an incomplete line (or a \r whose \n is in the next chunk)
+            pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+            for line in lines:
+                yield line
+        pending += decoder.decode(b"", final=True)
+        # The whole body has been read: complete the metrics recorded by send_req
+        metrics = getattr(response, "http_metrics", None)
+        if metrics is not None:
+            response.http_metrics = None
+            record, start = metrics
+            http_metrics.record_body(record, time.perf_counter() - start, _received_bytes(response, received))
+        if pending:
+            yield pending
+
     def authenticate_web_menu(self, fc: str):
         """
         Authenticates the user with the web menu for a given fc.
@@ -167,7 +519,7 @@ class AmazonRequest:
             )
         ).json()["value"][0]
         badge = user["badgeBarcodeId"]
-        url = "http://fcmenu-iad-regionalized.corp.amazon.com/do/login"
+        url = self.resolve_url("http://fcmenu-iad-regionalized.corp.amazon.com/do/login")
         payload = {"badgeBarcodeId": badge}
         with requests.Session() as session:
             session.verify = False
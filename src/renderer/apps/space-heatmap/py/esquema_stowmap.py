@@ -0,0 +1,228 @@
+"""
+Esquema de ingesta del dataset de bins de StowMap (Stowmap_data.csv).
+
+Sin tipos, pd.read_csv() deja las columnas de texto (Bay Id, Bin Type, Dropzone, Mod...) como
+objetos Python, Floor y Aisle como float64 y IsLocked como object si hay huecos. Este módulo
+declara el esquema una sola vez y lo comparten Procesar_StowMap.py, Generar_Heatmaps.py y
+Descarga_StowMap.py:
+
+- columnas que necesita cada consumidor (usecols)
+- categóricas para los atributos de baja cardinalidad (y Bay Id, que se repite por cada bin)
+- enteros nullable (Int16) para Floor, Aisle y Bin Id Suffix
+- IsLocked booleano nullable
+- fullness en float32 (opcional, ver FULLNESS_FLOAT32)
+- motor pyarrow de pd.read_csv si está instalado
+
+La memoria del DataFrame se informa antes y después de aplicar el esquema a un DataFrame ya
+cargado; al leer el CSV solo se informa la memoria final (las categóricas se crean en el parser,
+no hay un "antes" sin tipos que medir).
+"""
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_DISPONIBLE = True
+except ImportError:
+    PYARROW_DISPONIBLE = False
+
+# ============================================
+# CONFIGURACIÓN: ESQUEMA DE INGESTA
+# ============================================
+# Usar el motor pyarrow de pd.read_csv cuando esté instalado (si no, el motor C de pandas)
+USAR_PYARROW = True
+
+# Guardar Utilization % y Fullness como float32 (la mitad de memoria). Desactivado por defecto:
+# float32 no representa exactamente los 4 decimales del portal, y algunas medias redondeadas y
+# colores de bays cambian respecto a float64. Activarlo para datasets de varios FC.
+FULLNESS_FLOAT32 = False
+
+# Mostrar la memoria del DataFrame al aplicar el esquema (antes y después) y al leer el CSV
+INFORMAR_MEMORIA = True
+
+# Tipo de cada columna conocida (las columnas que no aparecen aquí se dejan como las lee pandas)
+TIPOS = {
+    'Bin Id': 'str',
+    'Bay Id': 'category',
+    'Floor': 'Int16',
+    'Mod': 'category',
+    'Aisle': 'Int16',
+    'Shelf': 'category',
+    'Bin Type': 'category',
+    'Dropzone': 'category',
+    'Utilization %': 'float64',
+    'IsLocked': 'boolean',
+    'Total Units': 'float64',
+    'Fullness': 'float64',
+    'storage_area': 'category',
+    'Bin Id Suffix': 'Int16',
+}
+
+# Columnas de fullness que pasan a float32 con FULLNESS_FLOAT32
+COLUMNAS_FULLNESS = ['Utilization %', 'Fullness']
+
+# Columnas que lee cada consumidor (None = todas)
+COLUMNAS_POR_CONSUMIDOR = {
+    'procesar': ['Bin Id', 'Floor', 'Mod', 'Aisle', 'Shelf', 'Bin Type', 'Dropzone', 'Utilization %',
+                 'IsLocked', 'Total Units', 'Fullness', 'storage_area', 'Bin Id Suffix'],
+    'heatmap': ['Bay Id', 'Floor', 'Mod', 'Utilization %', 'IsLocked', 'Bin Type', 'storage_area'],
+}
+
+
+def tipo_columna(nombre):
+    """
+    Devuelve el tipo del esquema de una columna (None si no está en el esquema).
+    """
+    if FULLNESS_FLOAT32 and nombre in COLUMNAS_FULLNESS:
+        return 'float32'
+    return TIPOS.get(nombre)
+
+
+def columnas_consumidor(consumidor, disponibles):
+    """
+    Columnas de 'disponibles' que necesita un consumidor, en el orden del archivo.
+
+    Args:
+        consumidor: Clave de COLUMNAS_POR_CONSUMIDOR, o None para todas las columnas
+        disponibles: Columnas presentes en el CSV o DataFrame
+    """
+    if consumidor is None:
+        return list(disponibles)
+    necesarias = set(COLUMNAS_POR_CONSUMIDOR[consumidor])
+    columnas = []
+    for col in disponibles:
+        nombre = str(col).lower()
+        # Las reglas warehouse_id / exclude_categories buscan estas columnas por nombre
+        dinamica = consumidor == 'procesar' and ('warehouse' in nombre or 'fc' in nombre
+                                                 or 'zona' in nombre or 'categor' in nombre)
+        if col in necesarias or dinamica:
+            columnas.append(col)
+    return columnas
+
+
+def memoria_mb(df):
+    """
+    Memoria ocupada por un DataFrame en MB (incluyendo el contenido de los textos).
+    """
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+
+def _a_booleano(serie):
+    if pd.api.types.infer_dtype(serie, skipna=True) == 'string':
+        # 'True' / 'False' como texto (p.ej. leídos con dtype=str)
+        serie = serie.str.strip().str.lower().map({'true': True, 'false': False, '1': True, '0': False})
+    return serie.astype('boolean')
+
+
+def _convertir(serie, tipo):
+    if tipo == 'boolean':
+        return _a_booleano(serie)
+    if tipo == 'str':
+        # Texto de alta cardinalidad (un valor por bin): se deja tal cual
+        return serie
+    return serie.astype(tipo)
+
+
+def aplicar_esquema(df, consumidor=None, origen="DataFrame", informar=INFORMAR_MEMORIA):
+    """
+    Convierte un DataFrame de StowMap a los tipos del esquema y deja solo las columnas del consumidor.
+    Las columnas que no se pueden convertir (p.ej. Aisle con decimales) se dejan como estaban.
+
+    Args:
+        df: DataFrame leído del CSV, del snapshot o recién descargado (no se modifica)
+        consumidor: Clave de COLUMNAS_POR_CONSUMIDOR, o None para conservar todas las columnas
+        origen: Descripción de la fuente para el log de memoria
+        informar: Si True, informa de la memoria antes y después
+
+    Returns:
+        DataFrame tipado
+    """
+    # Memoria del DataFrame recibido, antes de descartar las columnas que no usa el consumidor
+    antes = memoria_mb(df) if informar else None
+    columnas = columnas_consumidor(consumidor, df.columns)
+    if len(columnas) != len(df.columns):
+        df = df[columnas]
+
+    convertidas = {}
+    for col in df.columns:
+        tipo = tipo_columna(col)
+        if tipo is None or str(df[col].dtype) == tipo:
+            continue
+        try:
+            convertidas[col] = _convertir(df[col], tipo)
+        except (TypeError, ValueError) as e:
+            print(f"[Esquema] [WARNING] Columna '{col}' no convertida a {tipo}: {str(e)}")
+    if convertidas:
+        df = df.assign(**convertidas)
+
+    if informar:
+        print(f"[Esquema] {origen}: {len(df)} filas, {len(df.columns)} columnas, "
+              f"memoria {antes:.1f} MB -> {memoria_mb(df):.1f} MB")
+    return df
+
+
+def leer_csv(csv_path, consumidor=None):
+    """
+    Lee Stowmap_data.csv con el esquema: solo las columnas del consumidor y las categóricas
+    ya en el parser, sin pasar por objetos Python.
+
+    Args:
+        csv_path: Ruta del CSV
+        consumidor: Clave de COLUMNAS_POR_CONSUMIDOR, o None para todas las columnas
+
+    Returns:
+        DataFrame tipado
+    """
+    cabecera = pd.read_csv(csv_path, nrows=0).columns
+    columnas = columnas_consumidor(consumidor, cabecera)
+    categoricas = {col: 'category' for col in columnas if tipo_columna(col) == 'category'}
+
+    if USAR_PYARROW and PYARROW_DISPONIBLE:
+        df = pd.read_csv(csv_path, usecols=columnas, dtype=categoricas, engine='pyarrow')
+    else:
+        df = pd.read_csv(csv_path, usecols=columnas, dtype=categoricas, low_memory=False)
+    df = aplicar_esquema(df, informar=False)
+    if INFORMAR_MEMORIA:
+        print(f"[Esquema] CSV {csv_path}: {len(df)} filas, {len(df.columns)} columnas, "
+              f"memoria {memoria_mb(df):.1f} MB")
+    return df
+
+
+def leer_csv_por_bloques(csv_path, filas, consumidor=None):
+    """
+    Lee Stowmap_data.csv con el esquema en bloques de como mucho 'filas' filas (memoria acotada).
+    El motor pyarrow no admite chunksize: los bloques se leen siempre con el motor C.
+
+    Args:
+        csv_path: Ruta del CSV
+        filas: Filas por bloque
+        consumidor: Clave de COLUMNAS_POR_CONSUMIDOR, o None para todas las columnas
+
+    Yields:
+        DataFrame tipado de cada bloque
+    """
+    cabecera = pd.read_csv(csv_path, nrows=0).columns
+    columnas = columnas_consumidor(consumidor, cabecera)
+    categoricas = {col: 'category' for col in columnas if tipo_columna(col) == 'category'}
+
+    with pd.read_csv(csv_path, usecols=columnas, dtype=categoricas, chunksize=filas) as lector:
+        for bloque in lector:
+            yield aplicar_esquema(bloque, informar=False)
+
+
+def maximo_columna(csv_path, columna, filas):
+    """
+    Máximo de una columna numérica del CSV, leyendo solo esa columna por bloques.
+
+    Returns:
+        El máximo, o None si la columna no existe o no tiene valores
+    """
+    if columna not in pd.read_csv(csv_path, nrows=0).columns:
+        return None
+    maximo = None
+    with pd.read_csv(csv_path, usecols=[columna], chunksize=filas) as lector:
+        for bloque in lector:
+            valor = bloque[columna].max()
+            if not pd.isna(valor) and (maximo is None or valor > maximo):
+                maximo = valor
+    return maximo
@@ -0,0 +1,135 @@
+"""
+Índice de bitmaps sobre los atributos de los bins de StowMap.
+
+Las reglas de zonas (y los filtros de la app) seleccionan casi siempre por los mismos atributos de
+baja cardinalidad: Floor, Mod, storage_area, Bin Type, Shelf, Dropzone, IsLocked y rangos de Aisle.
+El índice se construye una vez por dataset:
+
+- un bitset empaquetado (np.packbits, 1 bit por bin) por cada valor de cada columna indexada
+- el array de Aisle ordenado (con su permutación) para resolver rangos y listas de pasillos
+
+Un filtro es entonces un AND / OR / ANDNOT de bitsets y el número de bins de una zona es un
+popcount; solo las métricas que necesitan valores (media de fullness, suma de unidades) desempaquetan
+la máscara. Las columnas que no están indexadas se resuelven con pandas y se empaquetan igual.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Columnas con un bitset por valor (se construyen la primera vez que se consultan)
+COLUMNAS_INDEXADAS = ['Floor', 'Mod', 'storage_area', 'Storage_Area', 'Bin Type', 'Shelf', 'Dropzone', 'IsLocked']
+
+# Bits a 1 de cada byte (popcount) para NumPy < 2.0, que no tiene np.bitwise_count
+_BITS_POR_BYTE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+class IndiceBitmap:
+    """
+    Bitsets por valor de las columnas indexadas y array ordenado de Aisle de un DataFrame.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.n = len(df)
+        self.n_bytes = (self.n + 7) // 8
+        # Bits válidos del último byte (packbits rellena con ceros por la derecha)
+        sobrantes = self.n_bytes * 8 - self.n
+        self._ultimo_byte = np.uint8((0xFF << sobrantes) & 0xFF)
+        self._bitsets = {}
+        self._aisles = None
+
+    # ---------- Bitsets ----------
+
+    def vacio(self):
+        return np.zeros(self.n_bytes, dtype=np.uint8)
+
+    def lleno(self):
+        return self.negar(self.vacio())
+
+    def desde_mascara(self, mascara):
+        return np.packbits(mascara)
+
+    def a_mascara(self, bits):
+        return np.unpackbits(bits, count=self.n).view(bool)
+
+    def negar(self, bits):
+        negado = np.invert(bits)
+        if self.n_bytes:
+            negado[-1] &= self._ultimo_byte
+        return negado
+
+    @staticmethod
+    def contar(bits):
+        """
+        Número de bins del bitset (popcount).
+        """
+        if hasattr(np, 'bitwise_count'):
+            return int(np.bitwise_count(bits).sum(dtype=np.int64))
+        return int(_BITS_POR_BYTE[bits].sum(dtype=np.int64))
+
+    # ---------- Consultas ----------
+
+    def valores(self, columna):
+        """
+        Diccionario {valor: bitset} de una columna indexada (construido una sola vez).
+        """
+        bitsets = self._bitsets.get(columna)
+        if bitsets is None:
+            codigos, unicos = pd.factorize(self.df[columna], use_na_sentinel=True)
+            bitsets = {}
+            for codigo, valor in enumerate(unicos):
+                bitsets[valor] = np.packbits(codigos == codigo)
+            self._bitsets[columna] = bitsets
+        return bitsets
+
+    def en(self, columna, valores):
+        """
+        Bitset de las filas cuya columna está en valores (mismo resultado que Series.isin).
+        """
+        if columna == 'Aisle':
+            return self._aisles_en(valores)
+        if columna not in COLUMNAS_INDEXADAS:
+            return self.desde_mascara(self.df[columna].isin(valores).to_numpy(dtype=bool, na_value=False))
+        bitsets = self.valores(columna)
+        resultado = self.vacio()
+        for valor in valores:
+            bits = bitsets.get(valor)
+            if bits is not None:
+                resultado |= bits
+        return resultado
+
+    def entre(self, columna, minimo, maximo):
+        """
+        Bitset de las filas con minimo <= columna <= maximo (los nulos no cumplen).
+        """
+        if columna == 'Aisle':
+            return self._aisles_entre(minimo, maximo)
+        serie = self.df[columna]
+        return self.desde_mascara(((serie >= minimo) & (serie <= maximo)).to_numpy(dtype=bool, na_value=False))
+
+    def _indice_aisles(self):
+        # Pasillos ordenados (NaN al final) y la fila de cada uno
+        if self._aisles is None:
+            aisles = self.df['Aisle'].to_numpy(dtype=float, na_value=np.nan)
+            orden = np.argsort(aisles, kind='stable')
+            self._aisles = (aisles[orden], orden)
+        return self._aisles
+
+    def _filas_a_bits(self, filas):
+        mascara = np.zeros(self.n, dtype=bool)
+        mascara[filas] = True
+        return self.desde_mascara(mascara)
+
+    def _aisles_entre(self, minimo, maximo):
+        ordenados, orden = self._indice_aisles()
+        inicio = np.searchsorted(ordenados, minimo, side='left')
+        fin = np.searchsorted(ordenados, maximo, side='right')
+        return self._filas_a_bits(orden[inicio:fin])
+
+    def _aisles_en(self, valores):
+        ordenados, orden = self._indice_aisles()
+        valores = np.asarray(sorted(valores), dtype=float)
+        inicios = np.searchsorted(ordenados, valores, side='left')
+        fines = np.searchsorted(ordenados, valores, side='right')
+        filas = [orden[i:f] for i, f in zip(inicios, fines) if f > i]
+        return self._filas_a_bits(np.concatenate(filas) if filas else np.empty(0, dtype=np.intp))
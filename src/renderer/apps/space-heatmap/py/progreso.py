@@ -0,0 +1,134 @@
+"""
+Canal de progreso de los scripts de descarga (Descarga_StowMap.py, Descarga_Roster.py).
+
+Cada paso se emite como un evento JSON de una sola línea por stdout (NDJSON), que
+execute-python-script de main.js ya captura, y se refleja en progress.json para el frontend,
+que lo consulta cada 200 ms. La escritura del archivo es atómica (archivo temporal + os.replace,
+sin fsync) y se agrupa: como mucho una escritura cada INTERVALO_MINIMO_ESCRITURA segundos por
+archivo; el último estado pendiente lo escribe un temporizador en segundo plano, de modo que
+quien informa del progreso nunca se bloquea esperando al disco.
+"""
+
+import atexit
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Tiempo mínimo entre dos escrituras de progress.json (los pasos intermedios se agrupan)
+INTERVALO_MINIMO_ESCRITURA = 0.2
+
+
+def escribir_json_atomico(path, data, **kwargs):
+    """
+    Escribe un JSON de forma atómica: archivo temporal + os.replace (sin fsync).
+    Quien lo lea ve siempre el archivo anterior completo o el nuevo completo. El temporal tiene
+    un nombre único, así que varios hilos o procesos pueden escribir el mismo archivo a la vez.
+    """
+    directorio, nombre = os.path.split(os.path.abspath(path))
+    f = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directorio, prefix=nombre + ".",
+                                    suffix=".tmp", delete=False)
+    try:
+        with f:
+            json.dump(data, f, **kwargs)
+        os.replace(f.name, path)
+    except BaseException:
+        # No dejar temporales sueltos si falla la serialización o el rename
+        if os.path.exists(f.name):
+            os.remove(f.name)
+        raise
+
+
+class _ArchivoProgreso:
+    """
+    Estado de progreso pendiente de escribir en un archivo, con escrituras agrupadas.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pendiente = None
+        self.ultima_escritura = 0.0
+        self.temporizador = None
+
+    def publicar(self, estado, inmediato=False):
+        with self.lock:
+            self.pendiente = estado
+            espera = INTERVALO_MINIMO_ESCRITURA - (time.monotonic() - self.ultima_escritura)
+            if inmediato or espera <= 0:
+                self._escribir()
+            else:
+                self._programar(espera)
+
+    def vaciar(self):
+        with self.lock:
+            self.temporizador = None
+            if self.pendiente is not None:
+                self._escribir()
+
+    def _programar(self, espera):
+        if self.temporizador is None:
+            self.temporizador = threading.Timer(espera, self.vaciar)
+            self.temporizador.daemon = True
+            self.temporizador.start()
+
+    def _escribir(self):
+        try:
+            escribir_json_atomico(self.path, self.pendiente)
+            self.pendiente = None
+            self.ultima_escritura = time.monotonic()
+        except OSError as e:
+            # En Windows el rename falla si el frontend tiene el archivo abierto justo en ese
+            # momento: se reintenta con el siguiente temporizador
+            print(f"[DEBUG] Error escribiendo progreso: {e}", flush=True)
+            self._programar(INTERVALO_MINIMO_ESCRITURA)
+
+
+_archivos = {}
+_archivos_lock = threading.Lock()
+
+
+def write_progress(data_folder, percentage, message):
+    """
+    Informa del progreso: evento NDJSON por stdout y progress.json en data_folder para el frontend.
+
+    :param data_folder: Carpeta donde guardar el archivo de progreso
+    :param percentage: Porcentaje de progreso (0-100)
+    :param message: Mensaje descriptivo del paso actual
+    """
+    estado = {
+        "percentage": percentage,
+        "message": message,
+        "timestamp": datetime.now().isoformat()
+    }
+    try:
+        print(json.dumps({"event": "progress", **estado}), flush=True)
+    except Exception:
+        pass
+
+    progress_file = os.path.join(data_folder, "progress.json")
+    with _archivos_lock:
+        archivo = _archivos.get(progress_file)
+        if archivo is None:
+            archivo = _archivos[progress_file] = _ArchivoProgreso(progress_file)
+    try:
+        # El inicio y el final (o un error que termina el script) se escriben sin esperar
+        archivo.publicar(estado, inmediato=percentage <= 0 or percentage >= 100)
+    except Exception as e:
+        # No fallar si no se puede escribir el progreso
+        print(f"[DEBUG] Error escribiendo progreso: {e}", flush=True)
+    sys.stdout.flush()
+
+
+@atexit.register
+def vaciar_progreso():
+    """
+    Escribe el último estado pendiente de todos los archivos de progreso (al salir del script).
+    """
+    with _archivos_lock:
+        archivos = list(_archivos.values())
+    for archivo in archivos:
+        archivo.vaciar()
@@ -0,0 +1,332 @@
+"""
+Servidor HTTP local que imita los portales que usan los scripts de descarga, para medir el
+rendimiento de Descarga_StowMap.py / Descarga_Roster.py sin acceso a la red interna.
+
+Sirve:
+- stowmap:   /stowmap/loadFCAreaMap.htm y /stowmap/getBinStatusReport.do (filtra por floor/mod/aisle,
+             bin types y shelves como el portal real)
+- dpsportal: /palletstowrecommendation/download*.do
+- fclm:      /employee/employeeRoster y /ajax/partialEmployeeSearch
+
+Los bins salen de un Stowmap_data.csv grabado (--datos) o se generan de forma sintética y
+reproducible (--pasillos, --bahias, --semilla). El resto de respuestas se pueden sustituir por
+archivos grabados en --fixtures con el nombre del endpoint (p.ej. downloadAllLockedEmptyBins.do.csv,
+loadFCAreaMap.htm o employeeRoster.csv).
+
+Uso:
+    python servidor_portal_local.py --puerto 8765 --latencia 0.3 --fallar P3C --fallar-una-vez P2B
+    AMAZON_BASE_URL=http://127.0.0.1:8765 python Descarga_StowMap.py <user_data_path>
+
+Con AMAZON_BASE_URL definida, AmazonRequest envía todas las peticiones a este servidor y no usa Midway.
+"""
+
+import argparse
+import ast
+import gzip
+import json
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pandas as pd
+
+# ============================================
+# CONFIGURACIÓN: DATOS SINTÉTICOS
+# ============================================
+PISOS = [1, 2, 3, 4, 5]
+MODS = ['A', 'B', 'C']
+SHELVES = ['A', 'B', 'C', 'D']
+BIN_TYPES = ['HALF-VERTICAL', 'LIBRARY-DEEP', 'FLAT-SHELF', 'SHOE']
+DROPZONES = ['dz-P-A', 'dz-P-HRV', 'dz-P-DAMAGE']
+
+# Columnas del informe getBinStatusReport.do (sin Floor, que añade Descarga_StowMap.py)
+COLUMNAS_INFORME = [
+    'Bin Id', 'Bay Id', 'Mod', 'Aisle', 'Shelf', 'Bin Type', 'Dropzone', 'Bin Size',
+    'Available Bin Volume', 'Bin Usage', 'Utilization %', 'IsLocked', 'Total Units',
+    'Can Hold High Value Asins', 'Can Hold Full Case Asins', 'Can Hold Non Conveyable Asins',
+    'Can Hold Sortable', 'Max Unique Asin Count'
+]
+
+# Columnas del roster de FCLM (los parámetros de columna de Descarga_Roster.py)
+COLUMNAS_ROSTER = [
+    'Employee ID', 'User ID', 'Employee Name', 'Badge Barcode ID', 'Department ID',
+    'Employment Start Date', 'Employment Type', 'Employee Status', 'Manager Name',
+    'Temp Agency Code', 'Shift Pattern'
+]
+
+# Tamaño de los bloques del cuerpo (para --ancho-banda y --cortar)
+CHUNK_BYTES = 64 * 1024
+
+
+def generar_bins(pasillos, bahias, semilla):
+    """
+    Genera un dataset de bins sintético: PISOS x MODS x pasillos x bahias x SHELVES (2 bins por shelf).
+
+    :return: DataFrame con la columna Floor y las columnas de COLUMNAS_INFORME
+    """
+    rnd = random.Random(semilla)
+    filas = []
+    for floor in PISOS:
+        for m, mod in enumerate(MODS):
+            for p in range(pasillos):
+                aisle = floor * 100 + m * pasillos + p + 1
+                for bahia in range(bahias):
+                    slot = 200 + bahia * 2
+                    bay_id = f"BAY-P-{floor}-{mod}{aisle}A{slot}"
+                    for shelf in SHELVES:
+                        for k in range(2):
+                            utilizacion = rnd.choice([0.0, 0.0, round(rnd.random() * 100, 2)])
+                            filas.append([
+                                floor, f"P-{floor}-{mod}{aisle}{shelf}{slot + k}", bay_id, mod, aisle, shelf,
+                                rnd.choice(BIN_TYPES), rnd.choice(DROPZONES), 'M', 1.0, 'Stow',
+                                f"{utilizacion:.2f}", rnd.random() < 0.03, int(utilizacion),
+                                'true', 'true', 'false', 'true', 10
+                            ])
+    return pd.DataFrame(filas, columns=['Floor'] + COLUMNAS_INFORME)
+
+
+def cargar_bins(csv_path):
+    """
+    Carga un Stowmap_data.csv grabado (salida de una descarga anterior) como fuente de los informes.
+    """
+    df = pd.read_csv(csv_path, low_memory=False).dropna(how='all')
+    df = df.drop(columns=['storage_area'], errors='ignore')
+    df['Floor'] = pd.to_numeric(df['Floor'], errors='coerce').astype('Int64')
+    df['Aisle'] = pd.to_numeric(df['Aisle'], errors='coerce').astype('Int64')
+    return df
+
+
+def _parsear_bin_properties(texto):
+    """
+    binProperties llega como str(dict) con ':' sustituido por '=' (ver get_stow_map).
+    """
+    return ast.literal_eval(re.sub(r"'(\w+)'=", r"'\1':", texto))
+
+
+class PortalLocal:
+    """
+    Estado del servidor: datos, respuestas cacheadas, inyección de fallos y contadores.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        if args.datos:
+            self.bins = cargar_bins(args.datos)
+        else:
+            self.bins = generar_bins(args.pasillos, args.bahias, args.semilla)
+        if args.repetir > 1:
+            self.bins = pd.concat([self.bins] * args.repetir, ignore_index=True)
+        self.fallar = set(args.fallar)
+        self.fallar_una_vez = set(args.fallar_una_vez)
+        self.cortar = set(args.cortar)
+        self.rnd = random.Random(args.semilla)
+        self.lock = threading.Lock()
+        self.vistos = set()
+        self.cache = {}
+        self.peticiones = Counter()
+        self.bytes_enviados = 0
+
+    def fixture(self, endpoint):
+        if not self.args.fixtures:
+            return None
+        for nombre in (endpoint, endpoint + ".csv"):
+            path = os.path.join(self.args.fixtures, nombre)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+        return None
+
+    def debe_fallar(self, clave):
+        """
+        :return: True si la petición identificada por clave debe responder con un error 500
+        """
+        with self.lock:
+            primera_vez = clave not in self.vistos
+            self.vistos.add(clave)
+            aleatorio = self.rnd.random() < self.args.prob_fallo
+        return clave in self.fallar or (clave in self.fallar_una_vez and primera_vez) or aleatorio
+
+    def metadatos(self):
+        bloques = []
+        for nombre, valores in (('type', sorted(self.bins['Bin Type'].dropna().unique())),
+                                ('usage', sorted(self.bins['Bin Usage'].dropna().unique())),
+                                ('mod', sorted(self.bins['Mod'].dropna().unique()))):
+            items = "".join(f"<li>{v}</li>" for v in valores)
+            bloques.append(f'<ul class="metric"><li class="metric-head">{nombre}</li>'
+                           f'<ul class="metric-content">{items}</ul></ul>')
+        return ("<html><body>" + "".join(bloques) + "</body></html>").encode('utf-8')
+
+    def informe_bins(self, props):
+        """
+        :return: Tupla (clave, CSV en bytes) del informe filtrado como getBinStatusReport.do
+        """
+        floor, mod, aisle = props.get('floor', ''), props.get('mod', ''), props.get('aisle', '')
+        clave = f"P{floor}{mod}" + (f"-{aisle}" if aisle != '' else '')
+        cache_key = (clave, tuple(props.get('binTypeList', [])), tuple(props.get('shelfList', [])))
+        with self.lock:
+            cuerpo = self.cache.get(cache_key)
+        if cuerpo is None:
+            mask = pd.Series(True, index=self.bins.index)
+            if floor != '':
+                mask &= self.bins['Floor'] == int(floor)
+            if mod:
+                mask &= self.bins['Mod'] == mod
+            if aisle != '':
+                mask &= self.bins['Aisle'] == int(aisle)
+            if props.get('binTypeList'):
+                mask &= self.bins['Bin Type'].isin(props['binTypeList'])
+            if props.get('shelfList'):
+                mask &= self.bins['Shelf'].isin(props['shelfList'])
+            df = self.bins.loc[mask.fillna(False), [c for c in self.bins.columns if c != 'Floor']]
+            # El portal responde sin cuerpo cuando el filtro no tiene bins
+            cuerpo = df.to_csv(index=False).encode('utf-8') if len(df) else b""
+            with self.lock:
+                self.cache[cache_key] = cuerpo
+        return clave, cuerpo
+
+    def informe_dps(self, endpoint, warehouse):
+        muestra = self.bins.sample(n=min(len(self.bins), 200), random_state=self.args.semilla)
+        df = pd.DataFrame({'Warehouse': warehouse, 'Bin Id': muestra['Bin Id'].values, 'Report': endpoint})
+        return df.to_csv(index=False).encode('utf-8')
+
+    def roster(self):
+        rnd = random.Random(self.args.semilla)
+        filas = []
+        for i in range(self.args.empleados):
+            filas.append([100000 + i, f"user{i}", f"Empleado, {i}", f"12{i:06d}", rnd.choice(['1299070', '1211010']),
+                          '2020-01-01', rnd.choice(['AMZN', 'TEMP']), 'Active', 'Manager, Uno', '', 'FHD'])
+        return pd.DataFrame(filas, columns=COLUMNAS_ROSTER).to_csv(index=False).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1: conexiones keep-alive como el portal real (todas las respuestas llevan Content-Length)
+    protocol_version = "HTTP/1.1"
+    portal = None
+
+    def log_message(self, format, *args):
+        if self.portal.args.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        self._atender()
+
+    def do_POST(self):
+        longitud = int(self.headers.get('Content-Length') or 0)
+        if longitud:
+            self.rfile.read(longitud)
+        self._atender()
+
+    def _atender(self):
+        portal = self.portal
+        partes = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(partes.query).items()}
+        endpoint = partes.path.rstrip('/').rsplit('/', 1)[-1]
+        with portal.lock:
+            portal.peticiones[endpoint] += 1
+
+        if portal.args.latencia:
+            time.sleep(portal.args.latencia + portal.rnd.uniform(0, portal.args.jitter))
+
+        tipo = 'text/csv'
+        clave = endpoint
+        try:
+            cuerpo = None if endpoint == 'getBinStatusReport.do' else portal.fixture(endpoint)
+            if cuerpo is not None:
+                pass
+            elif endpoint == 'getBinStatusReport.do':
+                clave, cuerpo = portal.informe_bins(_parsear_bin_properties(query.get('binProperties', '{}')))
+            elif endpoint == 'loadFCAreaMap.htm':
+                tipo, cuerpo = 'text/html', portal.metadatos()
+            elif endpoint.startswith('download') and endpoint.endswith('.do'):
+                cuerpo = portal.informe_dps(endpoint, query.get('warehouseId', ''))
+            elif endpoint == 'employeeRoster':
+                cuerpo = portal.roster()
+            elif endpoint == 'partialEmployeeSearch':
+                tipo = 'application/json'
+                cuerpo = json.dumps({'value': [{'badgeBarcodeId': '12000000'}]}).encode('utf-8')
+            else:
+                self._responder(404, b"not found", 'text/plain')
+                return
+        except Exception as e:
+            self._responder(500, str(e).encode('utf-8'), 'text/plain')
+            return
+
+        if portal.debe_fallar(clave):
+            self._responder(500, b"fallo inyectado", 'text/plain')
+            return
+        self._responder(200, cuerpo, tipo, cortar=clave in portal.cortar)
+
+    def _responder(self, estado, cuerpo, tipo, cortar=False):
+        args = self.portal.args
+        if not args.sin_gzip and cuerpo and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            cuerpo = gzip.compress(cuerpo, compresslevel=1)
+            self.send_response(estado)
+            self.send_header('Content-Encoding', 'gzip')
+        else:
+            self.send_response(estado)
+        self.send_header('Content-Type', f"{tipo}; charset=utf-8")
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+
+        # Cortar: se envía la mitad del cuerpo y se cierra la conexión (respuesta truncada)
+        limite = len(cuerpo) // 2 if cortar else len(cuerpo)
+        segundos_por_chunk = CHUNK_BYTES / (args.ancho_banda * 1024) if args.ancho_banda else 0
+        for inicio in range(0, limite, CHUNK_BYTES):
+            self.wfile.write(cuerpo[inicio:min(inicio + CHUNK_BYTES, limite)])
+            if segundos_por_chunk:
+                time.sleep(segundos_por_chunk)
+        with self.portal.lock:
+            self.portal.bytes_enviados += limite
+        if cortar:
+            self.close_connection = True
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor local que imita stowmap, dpsportal y fclm para pruebas sin red.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--datos', help="Stowmap_data.csv grabado a servir (por defecto, datos sintéticos)")
+    parser.add_argument('--fixtures', help="Carpeta con respuestas grabadas, una por endpoint")
+    parser.add_argument('--pasillos', type=int, default=20, help="Pasillos sintéticos por mod y piso")
+    parser.add_argument('--bahias', type=int, default=10, help="Bahías sintéticas por pasillo")
+    parser.add_argument('--repetir', type=int, default=1, help="Multiplica el tamaño de los informes de bins")
+    parser.add_argument('--empleados', type=int, default=500, help="Filas del roster sintético")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--latencia', type=float, default=0.0, help="Segundos hasta enviar las cabeceras")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Segundos aleatorios extra de latencia (0..jitter)")
+    parser.add_argument('--ancho-banda', type=float, default=0.0, help="KB/s del cuerpo (0 = sin límite)")
+    parser.add_argument('--fallar', nargs='*', default=[],
+                        help="Claves que siempre responden 500 (P3C, P3C-301, downloadAllLockedEmptyBins.do...)")
+    parser.add_argument('--fallar-una-vez', nargs='*', default=[], help="Claves que fallan solo la primera vez")
+    parser.add_argument('--cortar', nargs='*', default=[], help="Claves cuya respuesta se corta a la mitad")
+    parser.add_argument('--prob-fallo', type=float, default=0.0, help="Probabilidad de 500 en cualquier petición")
+    parser.add_argument('--sin-gzip', action='store_true', help="No comprimir aunque el cliente acepte gzip")
+    parser.add_argument('--verbose', action='store_true', help="Registrar cada petición")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    portal = PortalLocal(args)
+    _Handler.portal = portal
+    servidor = ThreadingHTTPServer((args.host, args.puerto), _Handler)
+    servidor.daemon_threads = True
+    # Parar con Ctrl+C o con kill (SIGTERM) mostrando el resumen
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"[Portal local] {len(portal.bins)} bins. Escuchando en http://{args.host}:{servidor.server_port}", flush=True)
+    print(f"[Portal local] Usar con: AMAZON_BASE_URL=http://{args.host}:{servidor.server_port}", flush=True)
+    try:
+        servidor.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        servidor.server_close()
+        print(f"[Portal local] Peticiones: {dict(portal.peticiones)}, bytes enviados: {portal.bytes_enviados}", flush=True)
+        sys.stdout.flush()
@@ -0,0 +1,118 @@
+"""
+Manifest de hashes para el refresco incremental (delta) de StowMap.
+
+Descarga_StowMap.py guarda en stowmap_manifest.json (junto a last_update.json) el hash del
+contenido de cada piso y de cada reporte del DPS Portal. Cada etapa posterior
+(Procesar_StowMap.py, Generar_Heatmaps.py) registra qué hashes consumió la última vez,
+de modo que solo recalcula los pisos, zonas y heatmaps cuya entrada ha cambiado.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from progreso import escribir_json_atomico
+
+MANIFEST_FILE = "stowmap_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def hash_archivo(path, chunk_size=1024 * 1024):
+    """
+    Calcula el SHA-256 de un archivo leyéndolo por bloques.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(chunk_size), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+
+def hash_dataframe(df):
+    """
+    Calcula un hash estable del contenido de un DataFrame (columnas y valores).
+    """
+    sha = hashlib.sha256()
+    sha.update(json.dumps([str(col) for col in df.columns]).encode('utf-8'))
+    sha.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return sha.hexdigest()
+
+
+def firma_csv(csv_path):
+    """
+    Firma barata (tamaño y fecha de modificación) del CSV combinado.
+    Permite detectar que el CSV se ha sustituido a mano y el manifest ya no lo describe.
+    """
+    if not os.path.exists(csv_path):
+        return None
+    stat = os.stat(csv_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def cargar_manifest(data_folder):
+    """
+    Lee el manifest de la carpeta de datos. Devuelve un manifest vacío si no existe o es inválido.
+    """
+    manifest_path = os.path.join(data_folder, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except Exception as e:
+            print(f"[Delta] [WARNING] Manifest ilegible, se ignorará: {str(e)}")
+    return {'version': MANIFEST_VERSION, 'pisos': {}, 'reportes': {}, 'csv': None, 'etapas': {}}
+
+
+def guardar_manifest(data_folder, manifest):
+    """
+    Guarda el manifest de forma atómica (archivo temporal + rename).
+    """
+    manifest['updated_at'] = datetime.now().isoformat()
+    escribir_json_atomico(os.path.join(data_folder, MANIFEST_FILE), manifest, indent=2)
+
+
+def manifest_valido(manifest, csv_path):
+    """
+    Indica si el manifest describe el CSV actual (hay hashes por piso y la firma coincide).
+    """
+    return bool(manifest.get('pisos')) and manifest.get('csv') == firma_csv(csv_path)
+
+
+def pisos_cambiados(manifest, etapa, pisos=None):
+    """
+    Devuelve los pisos cuyo hash actual no coincide con el que consumió la etapa la última vez.
+
+    Args:
+        manifest: Manifest cargado con cargar_manifest()
+        etapa: Nombre de la etapa (ej: 'procesar', 'heatmap_P1')
+        pisos: Pisos de los que depende la etapa (default: todos los del manifest)
+
+    Returns:
+        Conjunto de pisos (str) que han cambiado, añadidos o desaparecido
+    """
+    actuales = manifest.get('pisos', {})
+    consumidos = manifest.get('etapas', {}).get(etapa, {})
+    if pisos is None:
+        claves = set(actuales) | set(consumidos)
+    else:
+        claves = {str(p) for p in pisos}
+    return {
+        clave for clave in claves
+        if actuales.get(clave, {}).get('hash') != consumidos.get(clave)
+    }
+
+
+def marcar_etapa(manifest, etapa, pisos=None):
+    """
+    Registra que la etapa ha consumido los hashes actuales de los pisos indicados (default: todos).
+    """
+    actuales = manifest.get('pisos', {})
+    claves = actuales.keys() if pisos is None else [str(p) for p in pisos]
+    manifest.setdefault('etapas', {})[etapa] = {
+        clave: actuales[clave]['hash'] for clave in claves if clave in actuales
+    }
@@ -0,0 +1,304 @@
+"""
+Snapshot columnar binario del dataset de bins de StowMap.
+
+Stowmap_data.csv sigue siendo el formato de exportación para humanos, pero leerlo con
+pd.read_csv() es el paso más lento de Procesar_StowMap.py y Generar_Heatmaps.py. Cada vez que
+se escribe el CSV se guarda también un snapshot tipado junto a él:
+
+- Stowmap_data.snapshot.feather si pyarrow está instalado
+- Stowmap_data.snapshot.npz (solo NumPy) en caso contrario
+
+Las columnas Bin Type, Mod, Dropzone, Shelf y storage_area se guardan como categóricas
+(códigos + categorías). Stowmap_data.snapshot.json registra el formato y la firma del CSV del
+que se generó: si el CSV cambia por otra vía (p.ej. editado a mano), el snapshot se ignora.
+
+Datos corregidos: Procesar_StowMap.py ya no sobrescribe el CSV con las correcciones; guarda el
+dataset corregido una sola vez como Stowmap_data.corregido.{feather|npz}. Su
+Stowmap_data.corregido.json es el manifiesto de correcciones: la versión de corregir_csv() que lo
+generó y lo que cambió. Mientras el CSV y esa versión no cambien, los siguientes procesamientos
+(y los heatmaps) leen los datos corregidos sin volver a corregirlos.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from stowmap_manifest import firma_csv
+from esquema_stowmap import aplicar_esquema, leer_csv
+from progreso import escribir_json_atomico
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_DISPONIBLE = True
+except ImportError:
+    PYARROW_DISPONIBLE = False
+
+# ============================================
+# CONFIGURACIÓN: SNAPSHOT COLUMNAR
+# ============================================
+# Cambiar a False para trabajar solo con el CSV (no se escribe ni se lee el snapshot)
+USAR_SNAPSHOT = True
+
+SNAPSHOT_VERSION = 1
+COLUMNAS_CATEGORICAS = ['Bin Type', 'Mod', 'Dropzone', 'Shelf', 'storage_area']
+
+
+def ruta_snapshot(csv_path, corregido=False):
+    """
+    Devuelve la ruta base del snapshot asociado a un CSV (sin extensión).
+    Con corregido=True, la de los datos corregidos.
+    """
+    return os.path.splitext(csv_path)[0] + (".corregido" if corregido else ".snapshot")
+
+
+def _ruta_meta(csv_path, corregido=False):
+    return ruta_snapshot(csv_path, corregido) + ".json"
+
+
+def _codificar_columna(serie, nombre):
+    """
+    Convierte una columna en arrays NumPy sin objetos Python (no requiere pickle al cargar).
+    Las columnas de texto se guardan siempre con codificación de diccionario (códigos + categorías).
+
+    Returns:
+        Tupla (tipo, arrays) o None si la columna tiene tipos mezclados
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        tipo = 'cat'
+    elif isinstance(serie.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(serie.dtype):
+        # Enteros nullable (Int16, Int64...): valores + máscara de nulos
+        nulos = serie.isna().to_numpy()
+        return 'intn', {'valores': serie.fillna(0).to_numpy(dtype=serie.dtype.numpy_dtype), 'nulos': nulos}
+    elif isinstance(serie.dtype, pd.BooleanDtype):
+        # Booleano nullable del esquema: mismos códigos que los booleanos con huecos
+        nulos = serie.isna().to_numpy()
+        valores = np.where(nulos, -1, serie.fillna(False).to_numpy(dtype=bool).astype(np.int8)).astype(np.int8)
+        return 'bool', {'valores': valores}
+    elif pd.api.types.is_bool_dtype(serie.dtype) or pd.api.types.is_numeric_dtype(serie.dtype):
+        return 'num', {'valores': serie.to_numpy()}
+    else:
+        inferido = pd.api.types.infer_dtype(serie, skipna=True)
+        if inferido == 'boolean':
+            # Booleanos con huecos (read_csv los deja como object): -1 = NaN, 0 = False, 1 = True
+            nulos = serie.isna().to_numpy()
+            valores = np.where(nulos, -1, serie.fillna(False).astype(bool).astype(np.int8)).astype(np.int8)
+            return 'bool', {'valores': valores}
+        if inferido not in ('string', 'empty'):
+            return None
+        tipo = 'cat' if nombre in COLUMNAS_CATEGORICAS else 'str'
+
+    codigos, categorias = pd.factorize(serie, sort=True)
+    return tipo, {
+        'codigos': codigos.astype(np.int32),
+        'categorias': np.asarray(categorias.astype(str), dtype=str),
+    }
+
+
+def _decodificar_columna(tipo, arrays, categoricas):
+    if tipo == 'num':
+        return pd.Series(arrays['valores'])
+    if tipo == 'intn':
+        return pd.Series(pd.arrays.IntegerArray(arrays['valores'], arrays['nulos']))
+    if tipo == 'bool':
+        codigos = arrays['valores']
+        if (codigos >= 0).all():
+            return pd.Series(codigos.astype(bool))
+        valores = np.array([np.nan, False, True], dtype=object)[codigos + 1]
+        return pd.Series(valores, dtype=object)
+
+    codigos = arrays['codigos']
+    if tipo == 'cat' and categoricas:
+        return pd.Series(pd.Categorical.from_codes(codigos, arrays['categorias']))
+    # Misma forma que pd.read_csv(): texto con NaN en los huecos
+    valores = np.append(arrays['categorias'].astype(object), np.nan)[codigos]
+    return pd.Series(valores)
+
+
+def _guardar_npz(df, tmp_path):
+    arrays = {}
+    columnas = []
+    for i, nombre in enumerate(df.columns):
+        codificada = _codificar_columna(df[nombre], nombre)
+        if codificada is None:
+            print(f"[Snapshot] [WARNING] Columna '{nombre}' con tipos mezclados, no se genera snapshot")
+            return None
+        tipo, partes = codificada
+        columnas.append([str(nombre), tipo])
+        for parte, valores in partes.items():
+            arrays[f"c{i}_{parte}"] = valores
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    return columnas
+
+
+def _cargar_npz(path, columnas, categoricas):
+    datos = {}
+    with np.load(path, allow_pickle=False) as npz:
+        for i, (nombre, tipo) in enumerate(columnas):
+            prefijo = f"c{i}_"
+            arrays = {clave[len(prefijo):]: npz[clave] for clave in npz.files if clave.startswith(prefijo)}
+            datos[nombre] = _decodificar_columna(tipo, arrays, categoricas)
+    return pd.DataFrame(datos)
+
+
+def guardar_snapshot(df, csv_path, correcciones=None):
+    """
+    Guarda el snapshot columnar del DataFrame que se acaba de escribir en csv_path.
+    Debe llamarse DESPUÉS de escribir el CSV, ya que registra su firma (tamaño y fecha).
+
+    Args:
+        df: DataFrame con el mismo contenido que el CSV, o los datos corregidos de ese CSV
+        csv_path: Ruta del CSV exportado
+        correcciones: Manifiesto de correcciones de corregir_csv() (con su 'version'). Si se indica,
+                      df son los datos corregidos y se guardan como Stowmap_data.corregido.*
+
+    Returns:
+        True si el snapshot se guardó correctamente
+    """
+    if not USAR_SNAPSHOT:
+        return False
+
+    corregido = correcciones is not None
+    base = ruta_snapshot(csv_path, corregido)
+    formato = 'feather' if PYARROW_DISPONIBLE else 'npz'
+    data_path = f"{base}.{formato}"
+    tmp_path = data_path + ".tmp"
+    meta_path = _ruta_meta(csv_path, corregido)
+    meta = {'version': SNAPSHOT_VERSION, 'formato': formato, 'filas': len(df)}
+    if corregido:
+        meta['correcciones'] = correcciones
+
+    try:
+        if formato == 'feather':
+            df_snapshot = df.reset_index(drop=True)
+            for col in COLUMNAS_CATEGORICAS:
+                if col in df_snapshot.columns:
+                    df_snapshot[col] = df_snapshot[col].astype('category')
+            df_snapshot.to_feather(tmp_path)
+        else:
+            columnas = _guardar_npz(df, tmp_path)
+            if columnas is None:
+                return False
+            meta['columnas'] = columnas
+        # Sin meta el snapshot no es válido: si se interrumpe entre los dos reemplazos, se ignora
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        os.replace(tmp_path, data_path)
+
+        meta['csv'] = firma_csv(csv_path)
+        escribir_json_atomico(meta_path, meta, indent=2)
+
+        descripcion = "Datos corregidos" if corregido else "Snapshot"
+        print(f"[Snapshot] {descripcion} {formato} guardado: {data_path} ({os.path.getsize(data_path)} bytes)")
+        return True
+    except Exception as e:
+        print(f"[Snapshot] [WARNING] No se pudo guardar el snapshot: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+
+
+def _meta_vigente(csv_path, version_correcciones=None):
+    """
+    Meta del snapshot (o de los datos corregidos, si se indica version_correcciones) si corresponde
+    al CSV actual y a esa versión de las correcciones; None en caso contrario.
+    """
+    meta_path = _ruta_meta(csv_path, version_correcciones is not None)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != SNAPSHOT_VERSION or meta.get('csv') != firma_csv(csv_path):
+        return None
+    if version_correcciones is not None and meta.get('correcciones', {}).get('version') != version_correcciones:
+        return None
+    return meta
+
+
+def corregido_vigente(csv_path, version_correcciones):
+    """
+    True si los datos corregidos guardados corresponden al CSV actual y a esa versión de corregir_csv().
+    """
+    if not USAR_SNAPSHOT:
+        return False
+    try:
+        return _meta_vigente(csv_path, version_correcciones) is not None
+    except Exception:
+        return False
+
+
+def cargar_snapshot(csv_path, categoricas=False, version_correcciones=None):
+    """
+    Carga el snapshot asociado a csv_path si existe y corresponde al CSV actual.
+
+    Args:
+        csv_path: Ruta del CSV exportado
+        categoricas: Si True, las columnas categóricas se devuelven con dtype 'category';
+                     si False, se devuelven igual que las leería pd.read_csv()
+        version_correcciones: Si se indica, se cargan los datos corregidos (solo si los generó esa
+                              versión de corregir_csv()); su manifiesto queda en df.attrs['correcciones']
+
+    Returns:
+        DataFrame o None si no hay snapshot válido
+    """
+    if not USAR_SNAPSHOT:
+        return None
+
+    try:
+        meta = _meta_vigente(csv_path, version_correcciones)
+        if meta is None:
+            return None
+
+        formato = meta.get('formato')
+        data_path = f"{ruta_snapshot(csv_path, version_correcciones is not None)}.{formato}"
+        if formato == 'feather':
+            if not PYARROW_DISPONIBLE:
+                return None
+            df = pd.read_feather(data_path)
+            if not categoricas:
+                for col in df.columns:
+                    if isinstance(df[col].dtype, pd.CategoricalDtype):
+                        df[col] = pd.Series(np.asarray(df[col], dtype=object))
+        elif formato == 'npz':
+            df = _cargar_npz(data_path, meta['columnas'], categoricas)
+        else:
+            return None
+
+        if len(df) != meta.get('filas'):
+            return None
+        if 'correcciones' in meta:
+            df.attrs['correcciones'] = meta['correcciones']
+        return df
+    except Exception as e:
+        print(f"[Snapshot] [WARNING] Snapshot ilegible, se usará el CSV: {str(e)}")
+        return None
+
+
+def leer_stowmap(csv_path, consumidor=None, version_correcciones=None):
+    """
+    Lee el dataset de bins con el esquema de ingesta (esquema_stowmap): desde los datos corregidos
+    si se indica version_correcciones y son de esa versión, si no desde el snapshot columnar si es
+    válido, y si no desde el CSV. Solo los datos corregidos llevan df.attrs['correcciones'].
+
+    Args:
+        csv_path: Ruta del CSV exportado
+        consumidor: Clave de esquema_stowmap.COLUMNAS_POR_CONSUMIDOR ('procesar', 'heatmap'),
+                    o None para leer todas las columnas
+        version_correcciones: VERSION_CORRECCIONES de Procesar_StowMap.py (None = sin datos corregidos)
+    """
+    if version_correcciones is not None:
+        df = cargar_snapshot(csv_path, categoricas=True, version_correcciones=version_correcciones)
+        if df is not None:
+            print(f"[Snapshot] Datos corregidos (versión {version_correcciones}) cargados para: {csv_path}")
+            correcciones = df.attrs['correcciones']
+            df = aplicar_esquema(df, consumidor, origen=f"Datos corregidos de {csv_path}")
+            df.attrs['correcciones'] = correcciones
+            return df
+
+    df = cargar_snapshot(csv_path, categoricas=True)
+    if df is not None:
+        print(f"[Snapshot] Datos cargados desde el snapshot de: {csv_path}")
+        return aplicar_esquema(df, consumidor, origen=f"Snapshot de {csv_path}")
+    return leer_csv(csv_path, consumidor)
@@ -0,0 +1,38 @@
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+# Los scripts de py/ se importan como módulos sueltos (igual que cuando se ejecutan desde main.js)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def portal(monkeypatch):
+    """
+    Arranca servidor_portal_local en un hilo (puerto libre) y dirige AmazonRequest hacia él.
+    Devuelve una función que recibe los argumentos de línea de comandos del servidor.
+    """
+    # amazon_utils necesita requests_kerberos: solo lo importan las pruebas que usan el portal
+    import amazon_utils
+    import servidor_portal_local
+
+    servidores = []
+
+    def iniciar(*argv):
+        estado = servidor_portal_local.PortalLocal(
+            servidor_portal_local.parse_args(['--pasillos', '2', '--bahias', '3', *argv]))
+        handler = type('Handler', (servidor_portal_local._Handler,), {'portal': estado})
+        servidor = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        servidor.daemon_threads = True
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        servidores.append(servidor)
+        monkeypatch.setattr(amazon_utils, 'BASE_URL_OVERRIDE', f"http://127.0.0.1:{servidor.server_port}")
+        return estado
+
+    yield iniciar
+    for servidor in servidores:
+        servidor.shutdown()
+        servidor.server_close()
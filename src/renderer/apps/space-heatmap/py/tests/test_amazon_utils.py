@@ -0,0 +1,69 @@
+"""
+Casos mínimos de amazon_utils sin red: métricas HTTP por endpoint (HttpMetrics), también de las
+peticiones enviadas a servidor_portal_local. Necesitan requests_kerberos.
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip('requests_kerberos')
+
+import amazon_utils
+from amazon_utils import AmazonRequest, HttpMetrics
+
+INFORME = 'stowmap-eu.amazon.com/stowmap/getBinStatusReport.do'
+
+
+def test_http_metrics_agrega_por_endpoint(tmp_path):
+    metricas = HttpMetrics()
+    registro = metricas.record_headers(INFORME, 'get', 200, 0.5, kerberos_rounds=1, midway_s=0.25)
+    metricas.record_body(registro, 2.0, 1000)
+    # Reintento del bucle del llamador (attempt > 0) tras una reautenticación con Midway
+    registro = metricas.record_headers(INFORME, 'GET', 500, 1.5, attempt=1, reauths=1)
+    metricas.record_body(registro, 1.5, 10)
+    # Respuesta en streaming cuyo cuerpo aún no se ha leído: solo cuentan las cabeceras
+    metricas.record_headers('dpsportal-na.amazon.com/palletstowrecommendation/downloadAllLockedEmptyBins.do',
+                            'GET', 200, 0.2)
+
+    resumen = metricas.summary()
+    entrada = resumen['endpoints'][f"GET {INFORME}"]
+    assert entrada['requests'] == 2
+    assert entrada['status'] == {'200': 1, '500': 1}
+    assert (entrada['retries'], entrada['reauths'], entrada['kerberos_rounds']) == (1, 1, 1)
+    assert entrada['midway_s'] == 0.25
+    assert entrada['headers_s'] == {'total': 2.0, 'max': 1.5, 'mean': 1.0}
+    assert entrada['body_s'] == {'count': 2, 'total': 3.5, 'max': 2.0, 'mean': 1.75}
+    assert entrada['bytes'] == 1010
+    assert resumen['totals'] == {'requests': 3, 'bytes': 1010, 'retries': 1, 'reauths': 1, 'kerberos_rounds': 1}
+
+    path = tmp_path / 'http_metrics.json'
+    metricas.write(str(path))
+    with open(path, 'r', encoding='utf-8') as f:
+        escrito = json.load(f)
+    assert escrito['totals'] == resumen['totals']
+    assert escrito['endpoints'] == resumen['endpoints']
+
+
+def test_send_req_registra_intentos_y_cuerpo_en_streaming(portal, monkeypatch):
+    portal()
+    metricas = HttpMetrics()
+    monkeypatch.setattr(amazon_utils, 'http_metrics', metricas)
+    req = AmazonRequest()
+    params = {'warehouseId': 'VLC1', 'binProperties': "{'floor'=1, 'mod'='A'}"}
+
+    assert req.send_req(f"https://{INFORME}", params=params).ok
+    assert req.send_req(f"https://{INFORME}", params=params, attempt=1).ok
+
+    # El cuerpo de una respuesta en streaming se registra cuando se termina de leer
+    response = req.send_stream_req(f"https://{INFORME}", params=params, attempt=2)
+    entrada = metricas.summary()['endpoints'][f"GET {INFORME}"]
+    assert (entrada['requests'], entrada['body_s']['count']) == (3, 2)
+    lineas = list(req.iter_text_lines(response))
+    response.close()
+
+    entrada = metricas.summary()['endpoints'][f"GET {INFORME}"]
+    assert lineas[0].startswith('Bin Id,')
+    assert (entrada['requests'], entrada['retries'], entrada['body_s']['count']) == (3, 2, 3)
+    assert entrada['status'] == {'200': 3}
+    assert entrada['bytes'] > 0
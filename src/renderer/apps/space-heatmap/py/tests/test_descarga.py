@@ -0,0 +1,246 @@
+"""
+Casos mínimos de Descarga_StowMap.py sin red: descarga en streaming a disco, combinación de los
+CSV de cada piso, checkpoint para reanudar y el pipeline completo de un FC contra
+servidor_portal_local (fixture portal de conftest.py). Necesitan requests_kerberos (lo importa
+amazon_utils).
+"""
+
+import argparse
+import io
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+pytest.importorskip('requests_kerberos')
+
+import amazon_utils
+import Descarga_StowMap
+import Procesar_StowMap
+from amazon_utils import AmazonRequest, HttpMetrics
+from Descarga_StowMap import (_guardar_checkpoint, _stream_csv_a_archivo, cargar_checkpoint, carpeta_checkpoint,
+                              cerrar_checkpoint, combinar_csv, ejecutar_fc, get_stow_map_fragmento)
+from stowmap_manifest import cargar_manifest
+
+
+def _respuesta(cuerpo, encoding='utf-8'):
+    """
+    requests.Response en streaming con el cuerpo dado (bytes), como la de send_stream_req.
+    """
+    response = requests.models.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(cuerpo)
+    response.encoding = encoding
+    return response
+
+
+def test_iter_text_lines_une_caracteres_y_saltos_partidos_entre_bloques():
+    texto = "Bin Id,Dropzone\r\nP-1-B206A210,dz-P-Añadido\r\nP-1-B206A211,€\nsin salto final"
+    # Bloques de 3 bytes: la ñ, el € y algún \r\n quedan partidos entre dos bloques
+    lineas = list(AmazonRequest.iter_text_lines(_respuesta(texto.encode('utf-8')), chunk_size=3))
+    assert lineas == texto.splitlines(keepends=True)
+
+
+def test_stream_csv_a_archivo_elimina_columnas_y_anade_floor(tmp_path, monkeypatch):
+    monkeypatch.setattr(Descarga_StowMap, 'STREAMING_CHUNK_ROWS', 2)
+    cuerpo = "Bin Id,Max Unique Asin Count,Mod\nA1,3,B\nA2,4,C\n\nA3,5,B\nA4\n"
+    dest = tmp_path / 'P1.csv'
+
+    filas = _stream_csv_a_archivo(AmazonRequest(), _respuesta(cuerpo.encode('utf-8')), str(dest),
+                                  columnas_eliminar=['Max Unique Asin Count'], columnas_extra={'Floor': 1})
+
+    assert filas == 4
+    assert dest.read_text(encoding='utf-8').splitlines() == [
+        'Bin Id,Mod,Floor', 'A1,B,1', 'A2,C,1', 'A3,B,1', 'A4,,1']
+    assert not (tmp_path / 'P1.csv.tmp').exists()
+
+
+def test_stream_csv_a_archivo_respuesta_vacia(tmp_path):
+    dest = tmp_path / 'P1-A.csv'
+    assert _stream_csv_a_archivo(AmazonRequest(), _respuesta(b''), str(dest), permitir_vacio=True) == 0
+    assert dest.read_text() == ''
+
+    # Sin permitir_vacio la descarga falla y no queda ningún archivo
+    otro = tmp_path / 'P2-A.csv'
+    with pytest.raises(ValueError):
+        _stream_csv_a_archivo(AmazonRequest(), _respuesta(b''), str(otro))
+    assert not otro.exists()
+    assert not (tmp_path / 'P2-A.csv.tmp').exists()
+
+
+def test_combinar_csv_igual_que_concat(tmp_path, monkeypatch):
+    monkeypatch.setattr(Descarga_StowMap, 'STREAMING_CHUNK_ROWS', 2)
+    pisos = [
+        pd.DataFrame({'Bin Id': ['A1', 'A2', 'A3'], 'Mod': ['B', 'C', 'B'], 'Floor': [1, 1, 1]}),
+        # Mismas columnas en otro orden: se reordenan según la cabecera del primer piso
+        pd.DataFrame({'Floor': [2, 2], 'Bin Id': ['B1', 'B2'], 'Mod': ['A', 'B']}),
+    ]
+    partes = []
+    for i, piso in enumerate(pisos):
+        partes.append(str(tmp_path / f'P{i + 1}.csv'))
+        piso.to_csv(partes[-1], index=False)
+    # Un piso sin datos (respuesta vacía) no aporta cabecera ni filas
+    vacio = tmp_path / 'P3.csv'
+    vacio.write_text('')
+    partes.insert(0, str(vacio))
+    dest = str(tmp_path / 'Stowmap_data.csv')
+
+    assert combinar_csv(partes, dest) == 5
+    esperado = pd.concat(pisos, ignore_index=True)[['Bin Id', 'Mod', 'Floor']]
+    pd.testing.assert_frame_equal(pd.read_csv(dest), esperado)
+
+
+@pytest.fixture(autouse=True)
+def _sin_estado_entre_pruebas(monkeypatch):
+    # Cada prueba empieza sin metadatos en memoria y sin esperas entre reintentos
+    monkeypatch.setattr(Descarga_StowMap, '_metadata_memo', {})
+    monkeypatch.setattr(Descarga_StowMap, 'BACKOFF_FRAGMENTO_SEGUNDOS', 0)
+
+
+def _args(**opciones):
+    return argparse.Namespace(**{'full': False, 'refresh_metadata': False, 'no_resume': False, **opciones})
+
+
+def test_ejecutar_fc_contra_el_portal_local(portal, tmp_path, capsys):
+    estado = portal()
+    data_folder = str(tmp_path / 'space-heatmap')
+
+    resumen = ejecutar_fc('VLC1', data_folder, _args())
+    assert resumen['ok'] and not resumen['avisos'] and resumen['incompletos'] == []
+    assert resumen['filas'] == len(estado.bins)
+
+    descargado = pd.read_csv(os.path.join(data_folder, 'Stowmap_data.csv'))
+    assert len(descargado) == len(estado.bins)
+    assert set(descargado['Bin Id']) == set(estado.bins['Bin Id'])
+    assert (descargado.groupby('Floor')['Bin Id'].count() == estado.bins.groupby('Floor')['Bin Id'].count()).all()
+    assert 'Max Unique Asin Count' not in descargado.columns
+    for nombre in ('LockedEmptyBins_data.csv', 'PendingVerificationBins_data.csv', 'PendingStowBins_data.csv',
+                   os.path.join('processed', 'Data_Fullness.json'), os.path.join('processed', 'summary_kpis.json')):
+        assert os.path.exists(os.path.join(data_folder, nombre)), nombre
+    assert not os.path.exists(os.path.join(data_folder, Descarga_StowMap.CHECKPOINT_FILE))
+    assert all(piso['completo'] for piso in cargar_manifest(data_folder)['pisos'].values())
+
+    # Sin cambios en el portal, la segunda ejecución no reescribe el CSV ni vuelve a procesar
+    capsys.readouterr()
+    assert ejecutar_fc('VLC1', data_folder, _args())['ok']
+    salida = capsys.readouterr().out
+    assert "Ningun piso ha cambiado" in salida
+    assert "se omite el procesamiento" in salida
+
+
+def test_cargar_checkpoint_reanuda_solo_la_misma_descarga(tmp_path):
+    data_folder = str(tmp_path)
+    claves = ['P1-A', 'P1-B', 'Locked Empty Bins']
+    checkpoint = cargar_checkpoint(data_folder, 'VLC1', claves)
+    os.makedirs(carpeta_checkpoint(data_folder, checkpoint['run_id']))
+    checkpoint['completadas']['P1-A'] = 10
+    checkpoint['descargadas']['P1-A'] = time.time()
+    _guardar_checkpoint(data_folder, checkpoint)
+
+    reanudado = cargar_checkpoint(data_folder, 'VLC1', list(reversed(claves)))
+    assert reanudado['run_id'] == checkpoint['run_id']
+    assert reanudado['completadas'] == {'P1-A': 10}
+
+    # Otro FC, otras piezas o sin reanudar: ejecución nueva y se borran las piezas anteriores
+    for fc, otras_claves, reanudar in (('MAD4', claves, True), ('VLC1', claves[:2], True), ('VLC1', claves, False)):
+        _guardar_checkpoint(data_folder, checkpoint)
+        os.makedirs(carpeta_checkpoint(data_folder, checkpoint['run_id']), exist_ok=True)
+        nuevo = cargar_checkpoint(data_folder, fc, otras_claves, reanudar=reanudar)
+        assert nuevo['completadas'] == {}
+        assert not os.path.exists(carpeta_checkpoint(data_folder, checkpoint['run_id']))
+
+    # Las piezas descargadas fuera de la ventana se vuelven a descargar
+    checkpoint['descargadas']['P1-A'] = time.time() - Descarga_StowMap.CHECKPOINT_VENTANA_SEGUNDOS - 1
+    _guardar_checkpoint(data_folder, checkpoint)
+    assert cargar_checkpoint(data_folder, 'VLC1', claves)['completadas'] == {}
+
+    # Un checkpoint sin piezas pendientes no se reanuda
+    checkpoint['completadas'] = {clave: 1 for clave in claves}
+    checkpoint['descargadas'] = {clave: time.time() for clave in claves}
+    _guardar_checkpoint(data_folder, checkpoint)
+    assert cargar_checkpoint(data_folder, 'VLC1', claves)['completadas'] == {}
+
+
+def test_cerrar_checkpoint(tmp_path):
+    data_folder = str(tmp_path)
+    checkpoint = cargar_checkpoint(data_folder, 'VLC1', ['P1'])
+    carpeta = carpeta_checkpoint(data_folder, checkpoint['run_id'])
+    os.makedirs(carpeta)
+
+    cerrar_checkpoint(data_folder, checkpoint, borrar_piezas=False)
+    assert not os.path.exists(os.path.join(data_folder, Descarga_StowMap.CHECKPOINT_FILE))
+    assert os.path.isdir(carpeta)
+    cerrar_checkpoint(data_folder, checkpoint)
+    assert not os.path.exists(carpeta)
+
+
+def test_ejecutar_fc_reanuda_las_piezas_que_faltan(portal, tmp_path, capsys):
+    estado = portal('--fallar', 'P3C')
+    data_folder = str(tmp_path / 'space-heatmap')
+
+    resumen = ejecutar_fc('VLC1', data_folder, _args())
+    assert resumen['ok'] and resumen['avisos']
+    assert resumen['incompletos'] == ['P3-C']
+    with open(os.path.join(data_folder, Descarga_StowMap.CHECKPOINT_FILE), 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    assert 'P3-C' not in checkpoint['completadas']
+    assert len(checkpoint['completadas']) == len(checkpoint['tareas']) - 1
+    assert not cargar_manifest(data_folder)['pisos']['3']['completo']
+
+    # El portal se recupera: solo se vuelve a pedir el fragmento que faltaba
+    estado.fallar.clear()
+    informes = estado.peticiones['getBinStatusReport.do']
+    capsys.readouterr()
+    resumen = ejecutar_fc('VLC1', data_folder, _args())
+    assert resumen['ok'] and not resumen['avisos'] and resumen['incompletos'] == []
+    assert estado.peticiones['getBinStatusReport.do'] == informes + 1
+    assert f"{len(checkpoint['tareas']) - 1}/{len(checkpoint['tareas'])} piezas ya descargadas" in capsys.readouterr().out
+
+    descargado = pd.read_csv(os.path.join(data_folder, 'Stowmap_data.csv'))
+    assert set(descargado['Bin Id']) == set(estado.bins['Bin Id'])
+    assert not os.path.exists(os.path.join(data_folder, Descarga_StowMap.CHECKPOINT_FILE))
+    assert all(piso['completo'] for piso in cargar_manifest(data_folder)['pisos'].values())
+
+
+def test_ejecutar_fc_sin_reglas_termina_con_avisos(portal, tmp_path, capsys, monkeypatch):
+    portal()
+    data_folder = str(tmp_path / 'space-heatmap')
+
+    def sin_reglas():
+        raise FileNotFoundError("No se encontró el directorio de reglas")
+
+    # Ni la comprobación del delta ni el procesamiento pueden leer las reglas: el resto del pipeline sigue
+    monkeypatch.setattr(Procesar_StowMap, '_buscar_directorio_reglas', sin_reglas)
+    resumen = ejecutar_fc('VLC1', data_folder, _args())
+    assert resumen['ok'] and resumen['avisos'] and resumen['incompletos'] == []
+    salida = capsys.readouterr().out
+    assert "No se pudo comprobar si hay cambios que procesar" in salida
+    assert "Error durante el procesamiento" in salida
+
+    assert os.path.exists(os.path.join(data_folder, 'Stowmap_data.csv'))
+    assert os.path.exists(os.path.join(data_folder, 'PendingStowBins_data.csv'))
+    assert not os.path.exists(os.path.join(data_folder, 'processed', 'Data_Fullness.json'))
+    assert any(nombre.endswith('.svg') for nombre in os.listdir(os.path.join(data_folder, 'heatmaps')))
+
+
+def test_reintentos_de_fragmentos_en_las_metricas_http(portal, tmp_path, monkeypatch):
+    portal('--fallar-una-vez', 'P1A', '--fallar', 'P2B')
+    metricas = HttpMetrics()
+    monkeypatch.setattr(amazon_utils, 'http_metrics', metricas)
+
+    # P1-A falla una vez: un reintento
+    assert get_stow_map_fragmento('VLC1', 1, 'A', dest_path=str(tmp_path / 'P1-A.csv')) > 0
+    assert metricas.summary()['totals']['retries'] == 1
+
+    # P2-B falla siempre: cuentan los reintentos del fragmento y las peticiones por pasillo que lo sustituyen
+    previo = tmp_path / 'Stowmap_data.csv'
+    pd.DataFrame({'Floor': [2, 2], 'Mod': ['B', 'B'], 'Aisle': [203, 204]}).to_csv(previo, index=False)
+    resultado = get_stow_map_fragmento('VLC1', 2, 'B', dest_path=str(tmp_path / 'P2-B.csv'), csv_previo=str(previo))
+    assert resultado > 0
+    reintentos = Descarga_StowMap.REINTENTOS_FRAGMENTO
+    informe = metricas.summary()['endpoints']['GET stowmap-eu.amazon.com/stowmap/getBinStatusReport.do']
+    assert informe['requests'] == 2 + (reintentos + 1) + 2
+    assert informe['retries'] == 1 + reintentos + 2
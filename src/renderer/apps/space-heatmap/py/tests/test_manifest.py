@@ -0,0 +1,88 @@
+"""
+Casos mínimos del refresco incremental (delta): manifest de hashes por piso y las comprobaciones
+que deciden si Procesar_StowMap.py tiene algo que recalcular.
+"""
+
+import os
+
+import Procesar_StowMap
+from Procesar_StowMap import procesamiento_pendiente, procesar_stowmap
+from stowmap_manifest import (cargar_manifest, firma_csv, guardar_manifest, hash_dataframe, manifest_valido,
+                              marcar_etapa, pisos_cambiados)
+from test_stowmap import _leer_salidas, _stowmap
+
+
+def _guardar_con_manifest(df, data_dir):
+    """
+    Escribe el CSV y el manifest con el hash de cada piso, como hace Descarga_StowMap.py.
+    """
+    data_dir.mkdir(exist_ok=True)
+    csv_path = str(data_dir / 'Stowmap_data.csv')
+    df.to_csv(csv_path, index=False)
+    manifest = cargar_manifest(str(data_dir))
+    manifest['pisos'] = {str(int(piso)): {'hash': hash_dataframe(grupo), 'filas': len(grupo), 'completo': True}
+                         for piso, grupo in df.groupby('Floor')}
+    manifest['csv'] = firma_csv(csv_path)
+    guardar_manifest(str(data_dir), manifest)
+    return csv_path
+
+
+def test_pisos_cambiados_respecto_a_lo_consumido_por_la_etapa():
+    manifest = {'pisos': {'1': {'hash': 'a'}, '2': {'hash': 'b'}}, 'etapas': {}}
+    assert pisos_cambiados(manifest, 'procesar') == {'1', '2'}
+
+    marcar_etapa(manifest, 'procesar')
+    assert pisos_cambiados(manifest, 'procesar') == set()
+
+    manifest['pisos']['2']['hash'] = 'c'
+    assert pisos_cambiados(manifest, 'procesar') == {'2'}
+    assert pisos_cambiados(manifest, 'procesar', pisos=[1]) == set()
+
+    # Un piso que desaparece también cuenta como cambiado
+    del manifest['pisos']['1']
+    assert pisos_cambiados(manifest, 'procesar') == {'1', '2'}
+
+
+def test_manifest_valido_solo_para_el_csv_que_describe(tmp_path):
+    df = _stowmap()
+    csv_path = _guardar_con_manifest(df, tmp_path)
+    assert manifest_valido(cargar_manifest(str(tmp_path)), csv_path)
+
+    # El CSV sustituido por otra vía (p.ej. a mano) invalida el manifest
+    df.iloc[:100].to_csv(csv_path, index=False)
+    assert not manifest_valido(cargar_manifest(str(tmp_path)), csv_path)
+
+
+def test_procesamiento_pendiente_y_recalculo_incremental(tmp_path, monkeypatch):
+    df = _stowmap()
+    csv_path = _guardar_con_manifest(df, tmp_path / 'delta')
+    output_dir = str(tmp_path / 'delta' / 'processed')
+
+    # Sin JSON procesados hay que procesar; después ya no hay nada que recalcular
+    assert procesamiento_pendiente(csv_path, output_dir)
+    procesar_stowmap(csv_path, output_dir)
+    assert not procesamiento_pendiente(csv_path, output_dir)
+
+    # Cambia un piso: solo ese piso se recalcula y el resultado es el mismo que procesando todo
+    modificado = df.copy()
+    modificado.loc[modificado['Floor'] == 2, 'Utilization %'] = 0.0
+    csv_path = _guardar_con_manifest(modificado, tmp_path / 'delta')
+    assert procesamiento_pendiente(csv_path, output_dir)
+    procesar_stowmap(csv_path, output_dir)
+    assert not procesamiento_pendiente(csv_path, output_dir)
+
+    completo_csv = _guardar_con_manifest(modificado, tmp_path / 'completo')
+    completo_dir = str(tmp_path / 'completo' / 'processed')
+    procesar_stowmap(completo_csv, completo_dir, forzar=True)
+    assert _leer_salidas(output_dir) == _leer_salidas(completo_dir)
+
+    # Un cambio en las reglas o un JSON procesado que falta obligan a procesar de nuevo
+    hash_reglas = Procesar_StowMap._hash_reglas
+    monkeypatch.setattr(Procesar_StowMap, '_hash_reglas',
+                        lambda *args: {**hash_reglas(*args), 'Zonas_reglas.json': 'otro'})
+    assert procesamiento_pendiente(csv_path, output_dir)
+    monkeypatch.undo()
+    assert not procesamiento_pendiente(csv_path, output_dir)
+
+    os.remove(os.path.join(output_dir, 'summary_kpis.json'))
+    assert procesamiento_pendiente(csv_path, output_dir)
@@ -0,0 +1,93 @@
+"""
+Casos mínimos del canal de progreso: escrituras atómicas de JSON y agrupación de las escrituras
+de progress.json.
+"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import progreso
+from progreso import escribir_json_atomico, vaciar_progreso, write_progress
+
+
+def _leer(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_escribir_json_atomico_con_varios_escritores(tmp_path):
+    path = str(tmp_path / 'summary_kpis.json')
+    errores = []
+
+    def escribir(hilo):
+        try:
+            for i in range(50):
+                escribir_json_atomico(path, {'hilo': hilo, 'i': i, 'datos': list(range(200))})
+        except Exception as e:
+            errores.append(e)
+
+    hilos = [threading.Thread(target=escribir, args=(hilo,)) for hilo in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert errores == []
+    assert _leer(path)['i'] == 49
+    # No quedan temporales en la carpeta
+    assert os.listdir(tmp_path) == ['summary_kpis.json']
+
+
+def test_escribir_json_atomico_no_deja_el_archivo_a_medias(tmp_path):
+    path = str(tmp_path / 'Data_Fullness.json')
+    escribir_json_atomico(path, {'zona': 1})
+    with pytest.raises(TypeError):
+        escribir_json_atomico(path, {'zona': object()})
+    assert _leer(path) == {'zona': 1}
+    assert os.listdir(tmp_path) == ['Data_Fullness.json']
+
+
+def test_write_progress_agrupa_las_escrituras(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(progreso, 'INTERVALO_MINIMO_ESCRITURA', 60)
+    data_folder = str(tmp_path)
+    progress_file = os.path.join(data_folder, 'progress.json')
+
+    # El inicio se escribe sin esperar; los pasos intermedios quedan pendientes
+    write_progress(data_folder, 0, "Iniciando descarga")
+    assert _leer(progress_file)['percentage'] == 0
+    for pct in range(10, 60, 10):
+        write_progress(data_folder, pct, f"Paso {pct}")
+    assert _leer(progress_file)['percentage'] == 0
+
+    # Al vaciar (al salir del script) se escribe el último estado pendiente
+    vaciar_progreso()
+    estado = _leer(progress_file)
+    assert (estado['percentage'], estado['message']) == (50, "Paso 50")
+
+    # El final también se escribe sin esperar
+    write_progress(data_folder, 100, "Descarga completada")
+    assert _leer(progress_file)['percentage'] == 100
+
+    # Cada paso se emite igualmente como evento NDJSON por stdout
+    eventos = [json.loads(linea) for linea in capsys.readouterr().out.splitlines()]
+    assert [evento['percentage'] for evento in eventos] == [0, 10, 20, 30, 40, 50, 100]
+    assert all(evento['event'] == 'progress' for evento in eventos)
+
+
+def test_write_progress_escribe_lo_pendiente_en_segundo_plano(tmp_path, monkeypatch):
+    monkeypatch.setattr(progreso, 'INTERVALO_MINIMO_ESCRITURA', 0.05)
+    data_folder = str(tmp_path)
+    progress_file = os.path.join(data_folder, 'progress.json')
+
+    write_progress(data_folder, 0, "Iniciando descarga")
+    write_progress(data_folder, 30, "Descargando P1")
+    write_progress(data_folder, 40, "Descargando P2")
+
+    limite = time.monotonic() + 5
+    while _leer(progress_file)['percentage'] != 40 and time.monotonic() < limite:
+        time.sleep(0.02)
+    assert _leer(progress_file)['message'] == "Descargando P2"
@@ -0,0 +1,71 @@
+"""
+Casos mínimos del snapshot columnar de Stowmap_data.csv: ida y vuelta frente a la lectura del CSV
+con el esquema de ingesta, formato npz cuando pyarrow no está instalado y datos corregidos
+guardados aparte con la versión de corregir_csv() que los generó.
+"""
+
+import os
+
+import pandas as pd
+
+import stowmap_snapshot
+from esquema_stowmap import aplicar_esquema, leer_csv
+from Procesar_StowMap import VERSION_CORRECCIONES, corregir_csv, procesar_stowmap
+from stowmap_manifest import hash_archivo
+from stowmap_snapshot import cargar_snapshot, corregido_vigente, guardar_snapshot, leer_stowmap, ruta_snapshot
+from test_stowmap import _stowmap
+
+
+def _csv(tmp_path, df=None):
+    csv_path = str(tmp_path / 'Stowmap_data.csv')
+    (_stowmap() if df is None else df).to_csv(csv_path, index=False)
+    return csv_path
+
+
+def test_snapshot_npz_igual_que_leer_el_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(stowmap_snapshot, 'PYARROW_DISPONIBLE', False)
+    csv_path = _csv(tmp_path)
+    assert guardar_snapshot(pd.read_csv(csv_path, low_memory=False), csv_path)
+    assert os.path.exists(ruta_snapshot(csv_path) + '.npz')
+
+    for consumidor in (None, 'procesar', 'heatmap'):
+        pd.testing.assert_frame_equal(leer_stowmap(csv_path, consumidor), leer_csv(csv_path, consumidor))
+
+    # Sin categóricas, las columnas de texto vuelven como las deja pd.read_csv()
+    sin_categoricas = cargar_snapshot(csv_path)
+    assert not any(isinstance(dtype, pd.CategoricalDtype) for dtype in sin_categoricas.dtypes)
+    pd.testing.assert_frame_equal(sin_categoricas.astype(str), pd.read_csv(csv_path).astype(str))
+
+
+def test_snapshot_se_ignora_si_el_csv_cambia(tmp_path):
+    csv_path = _csv(tmp_path)
+    assert guardar_snapshot(pd.read_csv(csv_path, low_memory=False), csv_path)
+    assert cargar_snapshot(csv_path) is not None
+
+    # CSV reescrito por otra vía: el snapshot ya no lo describe y se lee el CSV
+    recortado = _stowmap().iloc[:200]
+    _csv(tmp_path, recortado)
+    assert cargar_snapshot(csv_path) is None
+    assert len(leer_stowmap(csv_path)) == len(recortado)
+
+
+def test_datos_corregidos_guardados_sin_reescribir_el_csv(tmp_path, monkeypatch):
+    monkeypatch.setattr(stowmap_snapshot, 'PYARROW_DISPONIBLE', False)
+    csv_path = _csv(tmp_path)
+    hash_original = hash_archivo(csv_path)
+    procesar_stowmap(csv_path, str(tmp_path / 'processed'), forzar=True)
+
+    assert hash_archivo(csv_path) == hash_original
+    assert os.path.exists(ruta_snapshot(csv_path, corregido=True) + '.npz')
+    assert corregido_vigente(csv_path, VERSION_CORRECCIONES)
+    assert not corregido_vigente(csv_path, VERSION_CORRECCIONES + 1)
+
+    cargado = leer_stowmap(csv_path, version_correcciones=VERSION_CORRECCIONES)
+    assert cargado.attrs['correcciones']['version'] == VERSION_CORRECCIONES
+    esperado = aplicar_esquema(corregir_csv(leer_csv(csv_path), silencioso=True))
+    pd.testing.assert_frame_equal(cargado.reset_index(drop=True), esperado.reset_index(drop=True))
+    # Los datos cargados ya están corregidos: corregir_csv() los devuelve sin cambios
+    assert corregir_csv(cargado, silencioso=True) is cargado
+
+    # Otra versión de las correcciones no usa los datos corregidos guardados
+    assert 'correcciones' not in leer_stowmap(csv_path, version_correcciones=VERSION_CORRECCIONES + 1).attrs
@@ -0,0 +1,205 @@
+"""
+Casos mínimos de las reescrituras de Procesar_StowMap.py y Generar_Heatmaps.py frente a la
+implementación directa (fila a fila / bay a bay). No necesitan red ni requests_kerberos.
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Procesar_StowMap import (MotorReglas, _buscar_directorio_reglas, _cargar_reglas_fc, _resolver_filtros,
+                              corregir_csv, procesar_stowmap)
+from Generar_Heatmaps import preparar_datos_heatmap
+
+
+def _stowmap(filas=600, semilla=0):
+    """
+    StowMap sintético con las columnas del CSV descargado (Utilization % como porcentaje entero).
+    """
+    rng = np.random.default_rng(semilla)
+    floor = rng.integers(1, 6, filas)
+    mod = rng.choice(['A', 'B', 'C', 'F'], filas, p=[0.15, 0.35, 0.35, 0.15])
+    aisle = rng.integers(175, 351, filas)
+    sufijo = rng.integers(200, 400, filas)
+    bin_id = [f"P-{f}-{m}{a}A{s}" for f, m, a, s in zip(floor, mod, aisle, sufijo)]
+    bay_id = [f"BAY-PL-B{a}" if m == 'F' else f"BAY-P-{f}-{m}{a}A{s - s % 10}"
+              for f, m, a, s in zip(floor, mod, aisle, sufijo)]
+    bin_type = rng.choice(['HALF-VERTICAL', 'LIBRARY-DEEP', 'SHOE', 'FLAT-SHELF', 'PALLET-SINGLE'], filas)
+    utilization = np.where(rng.random(filas) < 0.3, 0.0, rng.integers(1, 100, filas)).astype(float)
+    df = pd.DataFrame({
+        'Bin Id': bin_id,
+        'Bay Id': bay_id,
+        'Floor': floor,
+        'Mod': mod,
+        'Aisle': aisle,
+        'Shelf': rng.choice(list('ABCD'), filas),
+        'Bin Type': bin_type,
+        'Dropzone': rng.choice(['dz-P-A', 'dz-P-HRV', 'dz-P-DAMAGE', 'dz-P-HR'], filas),
+        'Utilization %': utilization,
+        'IsLocked': rng.random(filas) < 0.05,
+        'Total Units': rng.integers(0, 80, filas),
+    })
+    # Una fila vacía entre pisos, como en el CSV real
+    vacia = pd.DataFrame([[np.nan] * len(df.columns)], columns=df.columns)
+    return pd.concat([df.iloc[:300], vacia, df.iloc[300:]], ignore_index=True)
+
+
+def _como_lista(valor):
+    return [valor] if isinstance(valor, (str, int, float)) else list(valor)
+
+
+def _sufijo(bin_id):
+    match = re.search(r'(\d{3})$', str(bin_id))
+    return int(match.group(1)) if match else None
+
+
+def _en_rangos(sufijo, rangos):
+    return sufijo is not None and any(minimo <= sufijo <= maximo for minimo, maximo in rangos)
+
+
+def _cumple(fila, filtros):
+    """
+    Evaluación directa de los filtros de una zona sobre una sola fila.
+    """
+    if 'storage_area' in filtros and fila['storage_area'] not in _como_lista(filtros['storage_area']):
+        return False
+    if 'bin_type' in filtros and fila['Bin Type'] not in _como_lista(filtros['bin_type']):
+        return False
+    if 'floor' in filtros and fila['Floor'] not in [int(p) for p in _como_lista(filtros['floor'])]:
+        return False
+    if 'aisle_range' in filtros and not filtros['aisle_range'][0] <= fila['Aisle'] <= filtros['aisle_range'][1]:
+        return False
+    if 'aisle_exclude_range' in filtros and \
+            filtros['aisle_exclude_range'][0] <= fila['Aisle'] <= filtros['aisle_exclude_range'][1]:
+        return False
+    if 'aisle' in filtros and fila['Aisle'] not in [int(a) for a in _como_lista(filtros['aisle'])]:
+        return False
+    if 'drop_zone' in filtros and fila['Dropzone'] not in _como_lista(filtros['drop_zone']):
+        return False
+    if 'drop_zone_exclude' in filtros and fila['Dropzone'] in _como_lista(filtros['drop_zone_exclude']):
+        return False
+    if 'shelf' in filtros and fila['Shelf'] not in _como_lista(filtros['shelf']):
+        return False
+    if 'bin_id_endswith_ranges' in filtros and \
+            not _en_rangos(_sufijo(fila['Bin Id']), filtros['bin_id_endswith_ranges']):
+        return False
+    for patron in filtros.get('bin_id_exclude_patterns', []):
+        if ('aisle' not in patron or fila['Aisle'] in [int(a) for a in _como_lista(patron['aisle'])]) and \
+                ('bin_type' not in patron or fila['Bin Type'] in _como_lista(patron['bin_type'])) and \
+                ('endswith_range' not in patron or _en_rangos(_sufijo(fila['Bin Id']), patron['endswith_range'])):
+            return False
+    return True
+
+
+def _leer_salidas(output_dir):
+    salidas = {}
+    for nombre in sorted(os.listdir(output_dir)):
+        if nombre.endswith('.json'):
+            with open(os.path.join(output_dir, nombre), 'r', encoding='utf-8') as f:
+                datos = json.load(f)
+            if isinstance(datos, dict):
+                datos.pop('processed_at', None)
+            salidas[nombre] = datos
+    return salidas
+
+
+def test_corregir_csv_idempotente():
+    primera = corregir_csv(_stowmap(), silencioso=True)
+    assert primera.attrs['correcciones']['escala_utilization'] == 'porcentaje'
+
+    # Sin el manifiesto de correcciones se vuelven a aplicar todos los pasos sobre los datos ya corregidos
+    datos = primera.copy()
+    datos.attrs = {}
+    segunda = corregir_csv(datos, silencioso=True)
+    assert segunda.attrs['correcciones']['escala_utilization'] == 'decimal'
+    pd.testing.assert_frame_equal(segunda, primera)
+
+
+def test_motor_reglas_igual_que_evaluar_cada_fila():
+    df = corregir_csv(_stowmap(), silencioso=True)
+    zonas_reglas_dict, fullness_path = _cargar_reglas_fc(_buscar_directorio_reglas(), 'fullness_vlc1.json')
+    with open(fullness_path, 'r', encoding='utf-8-sig') as f:
+        reglas = json.load(f)
+
+    motor = MotorReglas(df)
+    filas = df.to_dict('records')
+    for nombre, zona in reglas.items():
+        filtros = _resolver_filtros(zona, zonas_reglas_dict)
+        esperada = np.array([_cumple(fila, filtros) for fila in filas], dtype=bool)
+        mascara = motor.mascara(motor.compilar(zona, zonas_reglas_dict))
+        np.testing.assert_array_equal(mascara, esperada, err_msg=nombre)
+
+
+def test_motor_reglas_valida_los_valores_de_las_reglas():
+    df = corregir_csv(_stowmap(), silencioso=True)
+    motor = MotorReglas(df)
+    # Un pasillo suelto como texto es un solo pasillo (no un conjunto de caracteres)
+    np.testing.assert_array_equal(motor.mascara(motor.compilar({'aisle': '206'})),
+                                  (df['Aisle'] == 206).to_numpy())
+
+    with pytest.raises(ValueError, match=r"Zona P1-Test: .*'bin_type'"):
+        motor.compilar({'bin_type': [['SHOE']]}, nombre='P1-Test')
+
+
+def test_procesamiento_por_bloques_igual_que_en_memoria(tmp_path):
+    salidas = {}
+    for modo, filas_por_bloque in (('memoria', 0), ('bloques', 97)):
+        data_dir = tmp_path / modo
+        data_dir.mkdir()
+        csv_path = str(data_dir / 'Stowmap_data.csv')
+        _stowmap().to_csv(csv_path, index=False)
+        output_dir = str(data_dir / 'processed')
+        procesar_stowmap(csv_path, output_dir, forzar=True, filas_por_bloque=filas_por_bloque)
+        salidas[modo] = _leer_salidas(output_dir)
+
+    assert salidas['memoria']
+    assert salidas['bloques'] == salidas['memoria']
+
+
+def _heatmap_por_bay(df, plantilla):
+    """
+    Filtrado bay a bay de una plantilla (P1-P5, HRK, PL) sobre el DataFrame corregido.
+    """
+    if plantilla[0] == 'P' and plantilla[1:].isdigit():
+        filtrado = df[df['Floor'] == float(plantilla[1:])]
+        svg_ids = filtrado['Bay Id'].str.replace(r'^BAY-P-(\d+)-[BC](.+)$', r'P\1-\2', regex=True)
+        svg_ids = svg_ids.where(filtrado['Bay Id'].str.match(r'BAY-P-\d+-[BC]'))
+    else:
+        area, patron, prefijo = {'HRK': ('High Rack', r'^BAY-P-\d+-A(.+)$', 'HRK-'),
+                                 'PL': ('Pallet Land', r'^BAY-PL-B(.+)$', 'PL-')}[plantilla]
+        filtrado = df[df['storage_area'] == area]
+        svg_ids = prefijo + filtrado['Bay Id'].str.extract(patron)[0]
+    filtrado = filtrado.assign(SVG_Bay_Id=svg_ids)
+    filtrado = filtrado[filtrado['SVG_Bay_Id'].notna()]
+
+    bays = {}
+    for bay_id, grupo in filtrado.groupby('SVG_Bay_Id'):
+        utilization = grupo['Utilization %'].mask(grupo['IsLocked'] == True, 1.0)
+        tipos = grupo['Bin Type'].value_counts()
+        bays[bay_id] = {
+            'fullness': utilization.mean(),
+            'locked': bool(grupo['IsLocked'].any()),
+            'bins': len(grupo),
+            'primary': tipos.index[0],
+            'all': list(tipos.index),
+        }
+    return bays
+
+
+def test_preparar_datos_heatmap_igual_que_filtrar_cada_bay():
+    df = corregir_csv(_stowmap(), silencioso=True)
+    datos = preparar_datos_heatmap(df)
+
+    for plantilla in ('P1', 'P2', 'P3', 'P4', 'P5', 'HRK', 'PL'):
+        esperado = _heatmap_por_bay(df, plantilla)
+        obtenido = datos.get(plantilla, {})
+        assert esperado
+        assert set(obtenido) == set(esperado), plantilla
+        for bay_id, bay in esperado.items():
+            assert obtenido[bay_id]['fullness'] == pytest.approx(bay['fullness'])
+            for clave in ('locked', 'bins', 'primary', 'all'):
+                assert obtenido[bay_id][clave] == bay[clave], (plantilla, bay_id, clave)
@@ -2,42 +2,13 @@ from io import StringIO
 import pandas as pd
 import os
 import sys
-import json
-import time
 from datetime import datetime
 
-# Importar amazon_utils desde space-heatmap
+# Importar amazon_utils y progreso desde space-heatmap
 # Desde utilidades/Pizarra/py necesitamos subir 3 niveles y luego entrar a space-heatmap/py
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../../space-heatmap/py'))
-from amazon_utils import AmazonRequest
-
-
-def write_progress(data_folder, percentage, message):
-    """
-    Escribe el progreso en un archivo JSON para que el frontend lo lea.
-    
-    :param data_folder: Carpeta donde guardar el archivo de progreso
-    :param percentage: Porcentaje de progreso (0-100)
-    :param message: Mensaje descriptivo del paso actual
-    """
-    try:
-        progress_file = os.path.join(data_folder, "progress.json")
-        progress_data = {
-            "percentage": percentage,
-            "message": message,
-            "timestamp": datetime.now().isoformat()
-        }
-        # Escribir y asegurar que se guarde inmediatamente
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump(progress_data, f)
-            f.flush()  # Forzar escritura inmediata al disco
-            os.fsync(f.fileno())  # Sincronizar con el sistema de archivos
-        # También forzar flush de stdout para que los prints se vean
-        sys.stdout.flush()
-    except Exception as e:
-        # No fallar si no se puede escribir el progreso
-        print(f"[DEBUG] Error escribiendo progreso: {e}")
-        sys.stdout.flush()
+from amazon_utils import AmazonRequest, http_metrics
+from progreso import write_progress, escribir_json_atomico
 
 
 def download_employee_roster(fc: str):
@@ -82,7 +53,7 @@ def download_employee_roster(fc: str):
     response = req.send_req(url=BASE_URL, params=params)
     if not response.ok:
         req.set_mw_cookie(flags=['-o'], delete_cookie=True)
-        response = req.send_req(url=BASE_URL, params=params)
+        response = req.send_req(url=BASE_URL, params=params, attempt=1)
     
     if response.ok:
         try:
@@ -115,19 +86,22 @@ if __name__ == '__main__':
     write_progress(data_folder, 0, "Preparando descarga del roster de empleados...")
     print("Iniciando descarga del roster de empleados desde FCLM Portal.", flush=True)
     sys.stdout.flush()
-    time.sleep(0.5)
     
     # Descargar roster (0-90%)
     write_progress(data_folder, 10, "Descargando roster de empleados...")
-    time.sleep(0.3)
     print("Descargando roster de empleados...", flush=True)
     sys.stdout.flush()
     
     df = download_employee_roster(fc=fc)
     
+    # Métricas de la petición al portal (tiempos, bytes, reintentos); ver amazon_utils.HttpMetrics
+    try:
+        http_metrics.write(os.path.join(data_folder, "http_metrics.json"))
+    except Exception as e:
+        print(f"[WARNING] No se pudieron guardar las métricas HTTP: {str(e)}", flush=True)
+    
     if df is not None:
         write_progress(data_folder, 80, "Guardando datos del roster...")
-        time.sleep(0.3)
         
         # Nombre del archivo
         filename = "employee_roster.csv"
@@ -146,10 +120,7 @@ if __name__ == '__main__':
             "timestamp": datetime.now().timestamp()
         }
         update_file = os.path.join(data_folder, "last_update.json")
-        with open(update_file, 'w', encoding='utf-8') as f:
-            json.dump(update_info, f, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
+        escribir_json_atomico(update_file, update_info, indent=2)
         print(f"[OK] Archivo de actualización guardado: {update_file}", flush=True)
         sys.stdout.flush()
         